@@ -8,16 +8,23 @@ import collections
 from colorama import Fore, Style
 from dataclasses import dataclass
 import difflib
+import hashlib
 import itertools
 import math
 from pathlib import Path
 import re
+import sqlite3
 import subprocess
 import sys
 import multiprocessing
 import multiprocessing.pool
 from typing import Dict, Iterator, List, Optional, Tuple
 
+import elftools.common.exceptions
+import elftools.elf.descriptions
+import elftools.elf.elffile
+import rabbitizer
+
 
 def green(s: str) -> str:
     return f"{Fore.GREEN}{s}{Style.RESET_ALL}"
@@ -138,6 +145,88 @@ def disassemble(path: Path) -> List[Inst]:
     return result
 
 
+def disassemble_text(
+    elf: elftools.elf.elffile.ELFFile, text_index: int, data: bytes
+) -> List[Inst]:
+    """
+    Disassemble the .text section of an object file into the same records
+    `disassemble` extracts from objdump's output.
+    """
+    # Function names by address, as objdump labels them: global symbols win
+    # over local ones
+    symtab = elf.get_section_by_name(".symtab")
+    labels: Dict[int, str] = {}
+    relocs: Dict[int, Tuple[str, str]] = {}
+    if symtab is not None:
+        for sym in sorted(
+            symtab.iter_symbols(),
+            key=lambda sym: sym["st_info"]["bind"] == "STB_GLOBAL",
+        ):
+            if (
+                sym["st_shndx"] == text_index
+                and sym.name
+                and sym["st_info"]["type"] not in ("STT_SECTION", "STT_FILE")
+            ):
+                labels[sym["st_value"]] = sym.name
+
+        for section in elf.iter_sections():
+            if (
+                section["sh_type"] not in ("SHT_REL", "SHT_RELA")
+                or section["sh_info"] != text_index
+            ):
+                continue
+            for reloc in section.iter_relocations():
+                sym = symtab.get_symbol(reloc["r_info_sym"])
+                if sym["st_info"]["type"] == "STT_SECTION":
+                    sym_name = elf.get_section(sym["st_shndx"]).name
+                else:
+                    sym_name = sym.name
+                if reloc.is_RELA() and reloc["r_addend"]:
+                    sym_name += f"+0x{reloc['r_addend']:x}"
+                reloc_type = elftools.elf.descriptions.describe_reloc_type(
+                    reloc["r_info_type"], elf
+                )
+                # Like `disassemble`, only keep the first reloc of each instruction
+                relocs.setdefault(reloc["r_offset"], (reloc_type, sym_name))
+
+    result = []
+    func_name = labels.get(0, ".text")
+    for addr in range(0, len(data) - 3, 4):
+        func_name = labels.get(addr, func_name)
+        word = int.from_bytes(data[addr : addr + 4], "big")
+        instr = rabbitizer.Instruction(word, vram=addr)
+
+        mnemonic, *rest = instr.disassemble().split(None, 1)
+        operands = rest[0].replace("$", "").split(", ") if rest else []
+        regs = []
+        imm = None
+        if instr.isBranch():
+            # convert branch targets to relative offsets, like objdump's
+            operands.pop()
+            imm = instr.getBranchOffset() - 4
+        elif instr.isJumpWithAddress():
+            operands.pop()
+            imm = instr.getInstrIndexAsVram()
+        for operand in operands:
+            if "(" in operand:  # load/store
+                offset_str, rest_str = operand.split("(")
+                regs.append(rest_str[:-1])
+                imm = int(offset_str, 0)
+            else:
+                try:
+                    imm = int(operand, 0)
+                except ValueError:
+                    regs.append(operand)
+
+        reloc_type, reloc_symbol = relocs.get(addr, (None, None))
+        result.append(Inst(func_name, mnemonic, regs, imm, reloc_type, reloc_symbol))
+
+    # trim trailing nops
+    while result and result[-1].mnemonic == "nop":
+        result.pop()
+    return result
+
+
 def pair_instructions(
     insts1: List[Inst], insts2: List[Inst]
 ) -> Iterator[Tuple[Optional[Inst], Optional[Inst]]]:
@@ -189,6 +278,17 @@ def get_section_hex_dump(path: Path, section: str) -> List[str]:
     return lines[4:]
 
 
+def format_hex_dump(data: bytes) -> List[str]:
+    """Format data like objdump -s does."""
+    lines = []
+    for offset in range(0, len(data), 0x10):
+        chunk = data[offset : offset + 0x10]
+        words = " ".join(chunk[i : i + 4].hex().ljust(8) for i in range(0, 0x10, 4))
+        text = "".join(chr(b) if 0x20 <= b < 0x7F else "." for b in chunk)
+        lines.append(f" {offset:04x} {words}  {text}")
+    return lines
+
+
 def parse_hex_dump(lines: List[str]) -> bytes:
     result = bytearray()
     for line in lines:
@@ -204,14 +304,77 @@ def parse_hex_dump(lines: List[str]) -> bytes:
     return result
 
 
-def find_functions_with_diffs(version: str, c_path: str):
+@dataclass
+class ObjectData:
+    insts: List[Inst]
+    sizes: Dict[str, int]
+    rodata: bytes
+    rodata_dump: List[str]
+
+
+def read_object_objdump(path: Path) -> ObjectData:
+    rodata_dump = get_section_hex_dump(path, ".rodata")
+    return ObjectData(
+        disassemble(path),
+        get_section_sizes(path),
+        parse_hex_dump(rodata_dump),
+        rodata_dump,
+    )
+
+
+def read_object(path: Path, use_objdump: bool = False) -> ObjectData:
+    """
+    Read the instructions, section sizes and .rodata of an object file. This
+    is done in-process by default, which is much faster than running objdump
+    several times per object.
+    """
+    if use_objdump:
+        return read_object_objdump(path)
+
+    if not path.exists():
+        raise Exception(f"file {path} does not exist")
+
+    with path.open("rb") as f:
+        try:
+            elf = elftools.elf.elffile.ELFFile(f)
+            sections = list(elf.iter_sections())
+        except elftools.common.exceptions.ELFError:
+            return ObjectData([], {}, b"", [])
+
+        insts = []
+        sizes = {}
+        rodata = bytearray()
+        for i, section in enumerate(sections):
+            if section["sh_type"] in (
+                "SHT_NULL",
+                "SHT_SYMTAB",
+                "SHT_STRTAB",
+                "SHT_REL",
+                "SHT_RELA",
+            ):
+                continue
+            # Pad to 0x10-byte alignment
+            sizes[section.name] = (section["sh_size"] + 0xF) & ~0xF
+            if section.name == ".text":
+                insts = disassemble_text(elf, i, section.data())
+            elif section.name == ".rodata":
+                rodata = bytearray(section.data())
+
+    # pad to 0x10-byte alignment
+    while len(rodata) % 0x10:
+        rodata.append(0)
+
+    return ObjectData(insts, sizes, bytes(rodata), format_hex_dump(rodata))
+
+
+def find_functions_with_diffs(version: str, c_path: str, use_objdump: bool):
     object_path = Path(c_path).with_suffix(".o")
 
     expected_dir = Path("expected/build") / version
     build_dir = Path("build") / version
 
-    insts1 = disassemble(expected_dir / object_path)
-    insts2 = disassemble(build_dir / object_path)
+    insts1 = read_object(expected_dir / object_path, use_objdump).insts
+    insts2 = read_object(build_dir / object_path, use_objdump).insts
 
     functions_with_diffs = collections.OrderedDict()
     for inst1, inst2 in pair_instructions(insts1, insts2):
@@ -232,18 +395,20 @@ def find_functions_with_diffs(version: str, c_path: str):
         print(f"  {func_name}")
 
 
-def find_data_diffs(version: str, c_path: str):
+def find_data_diffs(version: str, c_path: str, use_objdump: bool):
     object_path = Path(c_path).with_suffix(".o")
 
     expected_dir = Path("expected/build") / version
     build_dir = Path("build") / version
 
-    sizes1 = get_section_sizes(expected_dir / object_path)
-    sizes2 = get_section_sizes(build_dir / object_path)
-    rodata_dump1 = get_section_hex_dump(expected_dir / object_path, ".rodata")
-    rodata_dump2 = get_section_hex_dump(build_dir / object_path, ".rodata")
-    rodata1 = parse_hex_dump(rodata_dump1)
-    rodata2 = parse_hex_dump(rodata_dump2)
+    object1 = read_object(expected_dir / object_path, use_objdump)
+    object2 = read_object(build_dir / object_path, use_objdump)
+    sizes1 = object1.sizes
+    sizes2 = object2.sizes
+    rodata_dump1 = object1.rodata_dump
+    rodata_dump2 = object2.rodata_dump
+    rodata1 = object1.rodata
+    rodata2 = object2.rodata
 
     rodata_matches = rodata1 == rodata2
     data_size_matches = sizes1.get(".data", 0) == sizes2.get(".data", 0)
@@ -276,92 +441,334 @@ def find_data_diffs(version: str, c_path: str):
 
 
 @dataclass
-class ObjectDataForComparison:
-    insts1: List[Inst]
-    insts2: List[Inst]
-    sizes1: Dict[str, int]
-    sizes2: Dict[str, int]
-    rodata1: bytes
-    rodata2: bytes
-
-
-def get_object_data_for_comparison(object1: Path, object2: Path):
-    insts1 = disassemble(object1)
-    insts2 = disassemble(object2)
-    sizes1 = get_section_sizes(object1)
-    sizes2 = get_section_sizes(object2)
-    rodata_dump1 = get_section_hex_dump(object1, ".rodata")
-    rodata_dump2 = get_section_hex_dump(object2, ".rodata")
-    rodata1 = parse_hex_dump(rodata_dump1)
-    rodata2 = parse_hex_dump(rodata_dump2)
-    return ObjectDataForComparison(insts1, insts2, sizes1, sizes2, rodata1, rodata2)
-
-
-def print_summary(version: str, csv: bool, only_not_ok: bool):
+class ComparisonResult:
+    expected_insts: int
+    actual_insts: int
+    text_progress: float
+    rodata_matches: bool
+    data_size_matches: bool
+    bss_size_matches: bool
+
+    def is_ok(self) -> bool:
+        return (
+            self.text_progress == 1
+            and self.rodata_matches
+            and self.data_size_matches
+            and self.bss_size_matches
+        )
+
+
+def compare_objects(
+    object1: Path, object2: Path, use_objdump: bool
+) -> ComparisonResult:
+    data1 = read_object(object1, use_objdump)
+    data2 = read_object(object2, use_objdump)
+
+    insts1 = data1.insts
+    insts2 = data2.insts
+
+    added = 0
+    removed = 0
+    changed = 0
+    for inst1, inst2 in pair_instructions(insts1, insts2):
+        if inst1 is None and inst2 is not None:
+            added += 1
+        elif inst1 is not None and inst2 is None:
+            removed += 1
+        elif inst1 is not None and inst2 is not None and has_diff(inst1, inst2):
+            changed += 1
+
+    if insts1:
+        text_progress = max(1.0 - (added + removed + changed) / len(insts1), 0)
+    else:
+        text_progress = 1.0
+
+    sizes1 = data1.sizes
+    sizes2 = data2.sizes
+
+    return ComparisonResult(
+        expected_insts=len(insts1),
+        actual_insts=len(insts2),
+        text_progress=text_progress,
+        rodata_matches=data1.rodata == data2.rodata,
+        data_size_matches=sizes1.get(".data", 0) == sizes2.get(".data", 0),
+        bss_size_matches=sizes1.get(".bss", 0) == sizes2.get(".bss", 0),
+    )
+
+
+def hash_file(path: Path) -> Optional[str]:
+    try:
+        return hashlib.sha256(path.read_bytes()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+class ProgressDatabase:
+    """
+    SQLite store of comparison results, keyed by the hashes of the expected
+    and built objects so that unchanged objects aren't compared again, along
+    with the history of each file's results across runs. The reader key also
+    holds a hash of this script, so that results computed by an older version
+    of the comparison code aren't reused.
+    """
+
+    SCHEMA_VERSION = 1
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Summaries of several versions can be run at the same time, so wait for
+        # the other writers instead of failing, and let them read while one writes
+        self.conn = sqlite3.connect(str(path), timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] not in (
+            0,
+            self.SCHEMA_VERSION,
+        ):
+            raise Exception(f"{path} was written by an incompatible version")
+        self.conn.executescript(f"""
+            CREATE TABLE IF NOT EXISTS results (
+                expected_hash TEXT NOT NULL,
+                build_hash TEXT NOT NULL,
+                reader TEXT NOT NULL,
+                expected_insts INTEGER NOT NULL,
+                actual_insts INTEGER NOT NULL,
+                text_progress REAL NOT NULL,
+                rodata_matches INTEGER NOT NULL,
+                data_size_matches INTEGER NOT NULL,
+                bss_size_matches INTEGER NOT NULL,
+                PRIMARY KEY (expected_hash, build_hash, reader)
+            );
+            CREATE TABLE IF NOT EXISTS runs (
+                id INTEGER PRIMARY KEY,
+                version TEXT NOT NULL,
+                time TEXT NOT NULL,
+                num_files INTEGER NOT NULL,
+                num_ok INTEGER NOT NULL,
+                expected_insts INTEGER NOT NULL,
+                matching_insts REAL NOT NULL
+            );
+            -- Only written when a file's result differs from its previous one
+            CREATE TABLE IF NOT EXISTS file_history (
+                run_id INTEGER NOT NULL REFERENCES runs (id),
+                path TEXT NOT NULL,
+                expected_insts INTEGER NOT NULL,
+                text_progress REAL NOT NULL,
+                rodata_matches INTEGER NOT NULL,
+                data_size_matches INTEGER NOT NULL,
+                bss_size_matches INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS file_history_path ON file_history (path);
+            PRAGMA user_version = {self.SCHEMA_VERSION};
+            """)
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get_result(
+        self, expected_hash: str, build_hash: str, reader: str
+    ) -> Optional[ComparisonResult]:
+        row = self.conn.execute(
+            """
+            SELECT expected_insts, actual_insts, text_progress, rodata_matches,
+                data_size_matches, bss_size_matches
+            FROM results
+            WHERE expected_hash = ? AND build_hash = ? AND reader = ?
+            """,
+            (expected_hash, build_hash, reader),
+        ).fetchone()
+        if row is None:
+            return None
+        return ComparisonResult(
+            row[0], row[1], row[2], bool(row[3]), bool(row[4]), bool(row[5])
+        )
+
+    def put_results(
+        self,
+        reader: str,
+        results: List[Tuple[str, str, ComparisonResult]],
+    ):
+        """Store (expected hash, build hash, result) tuples, in one transaction."""
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        expected_hash,
+                        build_hash,
+                        reader,
+                        result.expected_insts,
+                        result.actual_insts,
+                        result.text_progress,
+                        result.rodata_matches,
+                        result.data_size_matches,
+                        result.bss_size_matches,
+                    )
+                    for expected_hash, build_hash, result in results
+                ],
+            )
+
+    def record_run(self, version: str, results: Dict[str, ComparisonResult]):
+        """Record the results of all files of a version, for trend reports."""
+        cursor = self.conn.execute(
+            "INSERT INTO runs VALUES (NULL, ?, datetime('now'), ?, ?, ?, ?)",
+            (
+                version,
+                len(results),
+                sum(result.is_ok() for result in results.values()),
+                sum(result.expected_insts for result in results.values()),
+                sum(
+                    result.expected_insts * result.text_progress
+                    for result in results.values()
+                ),
+            ),
+        )
+        run_id = cursor.lastrowid
+
+        # The latest recorded result of each file of this version
+        latest = {}
+        for row in self.conn.execute(
+            """
+            SELECT path, file_history.expected_insts, text_progress,
+                rodata_matches, data_size_matches, bss_size_matches
+            FROM file_history JOIN runs ON file_history.run_id = runs.id
+            WHERE runs.version = ?
+            ORDER BY runs.id
+            """,
+            (version,),
+        ):
+            latest[row[0]] = tuple(row[1:])
+
+        for path, result in results.items():
+            row = (
+                result.expected_insts,
+                result.text_progress,
+                int(result.rodata_matches),
+                int(result.data_size_matches),
+                int(result.bss_size_matches),
+            )
+            if latest.get(path) != row:
+                self.conn.execute(
+                    "INSERT INTO file_history VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (run_id, path) + row,
+                )
+        self.conn.commit()
+
+    def version_history(self, version: str) -> List[Tuple[str, int, int, float]]:
+        """(time, files, OK files, .text progress) of each run of a version"""
+        return [
+            (time, num_files, num_ok, matching / expected if expected else 1.0)
+            for time, num_files, num_ok, expected, matching in self.conn.execute(
+                """
+                SELECT time, num_files, num_ok, expected_insts, matching_insts
+                FROM runs WHERE version = ? ORDER BY id
+                """,
+                (version,),
+            )
+        ]
+
+    def file_history(
+        self, version: str, path: str
+    ) -> List[Tuple[str, float, bool, bool, bool]]:
+        """
+        (time, .text progress, .rodata, .data size and .bss size matches) of
+        each run in which the result of a file changed
+        """
+        return [
+            (time, text_progress, bool(rodata), bool(data_size), bool(bss_size))
+            for time, text_progress, rodata, data_size, bss_size in self.conn.execute(
+                """
+                SELECT time, text_progress, rodata_matches, data_size_matches,
+                    bss_size_matches
+                FROM file_history JOIN runs ON file_history.run_id = runs.id
+                WHERE runs.version = ? AND path = ?
+                ORDER BY runs.id
+                """,
+                (version, path),
+            )
+        ]
+
+
+def print_summary(
+    version: str,
+    csv: bool,
+    only_not_ok: bool,
+    use_objdump: bool,
+    db_path: Optional[Path],
+):
     expected_dir = Path("expected/build") / version
     build_dir = Path("build") / version
 
     expected_object_files = sorted(expected_dir.glob("src/**/*.o"))
 
-    comparison_data_list: List[multiprocessing.pool.AsyncResult] = []
+    reader = "objdump" if use_objdump else "elf"
+    script_hash = hash_file(Path(__file__))
+    assert script_hash is not None
+    reader = f"{reader}-{script_hash[:16]}"
+    db = ProgressDatabase(db_path) if db_path is not None else None
+    hashes: List[Tuple[Optional[str], Optional[str]]] = []
+    results: List[Optional[ComparisonResult]] = []
+    for expected_object in expected_object_files:
+        build_object = build_dir / expected_object.relative_to(expected_dir)
+        expected_hash = hash_file(expected_object)
+        build_hash = hash_file(build_object)
+        hashes.append((expected_hash, build_hash))
+        if db is not None and expected_hash is not None and build_hash is not None:
+            results.append(db.get_result(expected_hash, build_hash, reader))
+        else:
+            results.append(None)
+
+    comparison_data_list: List[Optional[multiprocessing.pool.AsyncResult]] = []
+    run_results: Dict[str, ComparisonResult] = {}
+    new_results: List[Tuple[str, str, ComparisonResult]] = []
 
     with multiprocessing.Pool(initializer=set_sigint_ignored) as p:
-        for expected_object in expected_object_files:
+        # Only compare the objects that changed since the results were stored
+        for expected_object, result in zip(expected_object_files, results):
             build_object = build_dir / expected_object.relative_to(expected_dir)
+            if result is not None:
+                comparison_data_list.append(None)
+                continue
             comparison_data_list.append(
                 p.apply_async(
-                    get_object_data_for_comparison,
-                    (expected_object, build_object),
+                    compare_objects,
+                    (expected_object, build_object, use_objdump),
                 )
             )
         if csv:
             print("path,expected,actual,.text,.rodata,.data size,.bss size")
-        for expected_object, data_async in zip(
-            expected_object_files, comparison_data_list
+        for expected_object, result, data_async, (expected_hash, build_hash) in zip(
+            expected_object_files, results, comparison_data_list, hashes
         ):
             c_path = expected_object.relative_to(expected_dir).with_suffix(".c")
-            data = data_async.get()
-
-            insts1 = data.insts1
-            insts2 = data.insts2
-
-            added = 0
-            removed = 0
-            changed = 0
-            for inst1, inst2 in pair_instructions(insts1, insts2):
-                if inst1 is None and inst2 is not None:
-                    added += 1
-                elif inst1 is not None and inst2 is None:
-                    removed += 1
-                elif inst1 is not None and inst2 is not None and has_diff(inst1, inst2):
-                    changed += 1
-
-            if insts1:
-                text_progress = max(1.0 - (added + removed + changed) / len(insts1), 0)
-            else:
-                text_progress = 1.0
-
-            sizes1 = data.sizes1
-            sizes2 = data.sizes2
-            rodata1 = data.rodata1
-            rodata2 = data.rodata2
-
-            rodata_matches = rodata1 == rodata2
-            data_size_matches = sizes1.get(".data", 0) == sizes2.get(".data", 0)
-            bss_size_matches = sizes1.get(".bss", 0) == sizes2.get(".bss", 0)
-
-            if only_not_ok:
+            if data_async is not None:
+                result = data_async.get()
                 if (
-                    text_progress == 1
-                    and rodata_matches
-                    and data_size_matches
-                    and bss_size_matches
+                    db is not None
+                    and expected_hash is not None
+                    and build_hash is not None
                 ):
-                    continue
+                    new_results.append((expected_hash, build_hash, result))
+            assert result is not None
+            run_results[str(c_path)] = result
+
+            text_progress = result.text_progress
+            rodata_matches = result.rodata_matches
+            data_size_matches = result.data_size_matches
+            bss_size_matches = result.bss_size_matches
+
+            if only_not_ok and result.is_ok():
+                continue
 
             if csv:
                 print(
-                    f"{c_path},{len(insts1)},{len(insts2)},{text_progress:.3f},{rodata_matches},{data_size_matches},{bss_size_matches}"
+                    f"{c_path},{result.expected_insts},{result.actual_insts},{text_progress:.3f},{rodata_matches},{data_size_matches},{bss_size_matches}"
                 )
             else:
                 ok = green("OK")
@@ -379,6 +786,29 @@ def print_summary(version: str, csv: bool, only_not_ok: bool):
                 )
             sys.stdout.flush()
 
+    if db is not None:
+        # Written at the end, so that the database isn't locked while comparing
+        db.put_results(reader, new_results)
+        db.record_run(version, run_results)
+        db.close()
+
+
+def print_history(version: str, c_path: Optional[str], db_path: Path):
+    if not db_path.exists():
+        print(f"no progress database at {db_path}", file=sys.stderr)
+        sys.exit(1)
+
+    with ProgressDatabase(db_path) as db:
+        if c_path is None:
+            print("time,files,ok files,.text")
+            for time, num_files, num_ok, text_progress in db.version_history(version):
+                print(f"{time},{num_files},{num_ok},{text_progress:.4f}")
+        else:
+            print("time,.text,.rodata,.data size,.bss size")
+            for row in db.file_history(version, str(Path(c_path).with_suffix(".c"))):
+                time, text_progress, rodata, data_size, bss_size = row
+                print(f"{time},{text_progress:.3f},{rodata},{data_size},{bss_size}")
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Calculate progress matching retail")
@@ -407,12 +837,42 @@ if __name__ == "__main__":
         dest="only_not_ok",
     )
     parser.add_argument("--csv", help="print summary CSV", action="store_true")
+    parser.add_argument(
+        "--objdump",
+        help="read object files with mips-linux-gnu-objdump instead of in-process (slower)",
+        action="store_true",
+        dest="use_objdump",
+    )
+    parser.add_argument(
+        "--db",
+        help="database of results, used to skip comparing unchanged objects and to track progress over time (default: build/retail_progress.db)",
+        type=Path,
+        default=Path("build/retail_progress.db"),
+    )
+    parser.add_argument(
+        "--no-db",
+        help="don't read or update the results database",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--history",
+        help="print the recorded progress of the version (or of the given file) over time",
+        action="store_true",
+    )
     args = parser.parse_args()
 
-    if args.file is not None:
+    if args.history:
+        print_history(args.oot_version, args.file, args.db)
+    elif args.file is not None:
         if args.data:
-            find_data_diffs(args.oot_version, args.file)
+            find_data_diffs(args.oot_version, args.file, args.use_objdump)
         else:
-            find_functions_with_diffs(args.oot_version, args.file)
+            find_functions_with_diffs(args.oot_version, args.file, args.use_objdump)
     else:
-        print_summary(args.oot_version, args.csv, args.only_not_ok)
+        print_summary(
+            args.oot_version,
+            args.csv,
+            args.only_not_ok,
+            args.use_objdump,
+            None if args.no_db else args.db,
+        )
@@ -12,6 +12,7 @@
 #include <functional>
 #include "CrashHandler.h"
 
+#include <iostream>
 #include <string>
 #include <string_view>
 #include "tinyxml2.h"
@@ -53,6 +54,7 @@ void BuildAssetBackground(const fs::path& imageFilePath, const fs::path& outPath
 void BuildAssetBlob(const fs::path& blobFilePath, const fs::path& outPath);
 ZFileMode ParseFileMode(const std::string& buildMode, ExporterSet* exporterSet);
 int HandleExtract(ZFileMode fileMode, ExporterSet* exporterSet);
+int HandleBatch(int argc, char* argv[], ExporterSet* exporterSet);
 
 extern const char gBuildHash[];
 
@@ -92,6 +94,14 @@ int main(int argc, char* argv[])
 	// Parse File Mode
 	ExporterSet* exporterSet = Globals::Instance->GetExporterSet();
 	std::string buildMode = argv[1];
+
+	if (buildMode == "batch")
+	{
+		returnCode = HandleBatch(argc, argv, exporterSet);
+		delete g;
+		return returnCode;
+	}
+
 	ZFileMode fileMode = ParseFileMode(buildMode, exporterSet);
 
 	if (fileMode == ZFileMode::Invalid)
@@ -491,6 +501,83 @@ int HandleExtract(ZFileMode fileMode, ExporterSet* exporterSet)
 	return 0;
 }
 
+/**
+ * Batch extraction mode.
+ * The arguments passed on the command line are shared by every job. Then each line read from stdin
+ * is a job: the extra arguments for that extraction (input, output, offsets, etc), separated by
+ * tabs. Once a job is done, a line with `BATCH_JOB_DONE_MARKER` followed by the exit code of the
+ * job is printed to stdout. This avoids paying for process startup and parsing the config for
+ * every single XML.
+ */
+#define BATCH_JOB_DONE_MARKER "ZAPD_BATCH_JOB_DONE"
+
+void ResetBatchJobState()
+{
+	// Every file successfully parsed is in `files`, while `segmentRefFiles` may also reference a
+	// file whose parsing failed halfway, so only the former is used to free them
+	for (ZFile* file : Globals::Instance->files)
+		delete file;
+	Globals::Instance->files.clear();
+	Globals::Instance->externalFiles.clear();
+	Globals::Instance->segments.clear();
+	Globals::Instance->cfg.segmentRefFiles.clear();
+}
+
+int HandleBatch(int argc, char* argv[], ExporterSet* exporterSet)
+{
+	if (exporterSet != nullptr && exporterSet->parseArgsFunc != nullptr)
+	{
+		for (int32_t i = 2; i < argc; i++)
+			exporterSet->parseArgsFunc(argc, argv, i);
+	}
+
+	std::string line;
+	while (std::getline(std::cin, line))
+	{
+		if (line.empty())
+			continue;
+
+		ResetBatchJobState();
+		Globals::Instance->inputPath = "";
+		Globals::Instance->outputPath = Directory::GetCurrentDirectory();
+		Globals::Instance->sourceOutputPath = "";
+		Globals::Instance->baseAddress = -1;
+		Globals::Instance->startOffset = -1;
+		Globals::Instance->endOffset = -1;
+		Globals::Instance->forceStatic = false;
+		Globals::Instance->forceUnaccountedStatic = false;
+
+		// Build an argv-like array, the first two elements are skipped by ParseArgs
+		std::vector<std::string> jobArgs = {argv[0], "e"};
+		for (const std::string& arg : StringHelper::Split(line, "\t"))
+			jobArgs.push_back(arg);
+		std::vector<char*> jobArgv;
+		for (std::string& arg : jobArgs)
+			jobArgv.push_back(arg.data());
+		jobArgv.push_back(nullptr);
+		int jobArgc = jobArgs.size();
+
+		int returnCode;
+		try
+		{
+			ParseArgs(jobArgc, jobArgv.data());
+			returnCode = HandleExtract(ZFileMode::Extract, exporterSet);
+		}
+		catch (const std::exception& e)
+		{
+			fprintf(stderr, "%s\n", e.what());
+			returnCode = 1;
+		}
+
+		fflush(stderr);
+		printf("\n" BATCH_JOB_DONE_MARKER " %i\n", returnCode);
+		fflush(stdout);
+	}
+
+	ResetBatchJobState();
+	return 0;
+}
+
 void BuildAssetTexture(const fs::path& pngFilePath, TextureType texType, const fs::path& outPath)
 {
 	std::string name = outPath.stem().string();
@@ -14,6 +14,7 @@ from typing import (
     Optional,
     Pattern,
     Set,
+    TextIO,
     Tuple,
     Type,
     Union,
@@ -59,6 +60,7 @@ if __name__ == "__main__":
 
     start_argument = parser.add_argument(
         "start",
+        nargs="?",
         help="Function name or address to start diffing from.",
     )
 
@@ -186,6 +188,52 @@ if __name__ == "__main__":
         metavar="FILE",
         help="Read assembly from given file instead of configured base img.",
     )
+    parser.add_argument(
+        "--batch",
+        dest="batch",
+        nargs="*",
+        metavar="TARGET",
+        help="""Score many functions at once instead of showing a diff, and print
+        the scores as a JSON object, with the architecture name in "arch_str" and
+        one entry per function in "functions" (with either "score" and "max_score",
+        or "error"). Each TARGET is either a function name, or a directory in which
+        to score every function of every .o file; defaults to the build directory.
+        Requires -o and pyelftools.""",
+    )
+    parser.add_argument(
+        "--batch-jobs",
+        dest="batch_jobs",
+        metavar="N",
+        type=int,
+        help="""Number of worker processes for --batch and --rom-report. Defaults
+        to the CPU count.""",
+    )
+    parser.add_argument(
+        "--rom-report",
+        dest="rom_report",
+        nargs="?",
+        const=50,
+        type=int,
+        metavar="N",
+        help="""Score every function of the ROM against the base image instead of
+        showing a diff, and print the N worst-scoring ones (default: 50, 0 for
+        all). Functions are delimited using the map file, which must be in GNU
+        format, and found in the base image using the map file of the same
+        name in the expected directory. Functions are matched by name, so
+        functions that were renamed since the expected build are reported as
+        errors. Static functions aren't in the map, and are found using the
+        symbols of the object files (those in the expected directory for the
+        base image) if pyelftools is installed. Otherwise, they are scored as
+        part of the function before them. Not compatible with -o.""",
+    )
+    parser.add_argument(
+        "--no-base-cache",
+        dest="base_cache",
+        action="store_false",
+        help="""Don't use or update the cache of disassembled base functions, which
+        is kept in the cache directory between invocations. The cache is never
+        used with --source.""",
+    )
     parser.add_argument(
         "--write-asm",
         dest="write_asm",
@@ -318,9 +366,29 @@ if __name__ == "__main__":
         "--algorithm",
         dest="algorithm",
         default="levenshtein",
-        choices=["levenshtein", "difflib"],
+        choices=["levenshtein", "difflib", "myers"],
         help="""Diff algorithm to use. Levenshtein gives the minimum diff, while difflib
-        aims for long sections of equal opcodes. Defaults to %(default)s.""",
+        aims for long sections of equal opcodes. myers gives a minimal diff in
+        terms of insertions and deletions, is fast even when instructions were
+        heavily reordered, and needs no external module.
+        Defaults to %(default)s.""",
+    )
+    parser.add_argument(
+        "--incremental-align",
+        dest="incremental_align",
+        action="store_true",
+        help="""In watch mode, only realign the part of the function that changed
+        since the last refresh. This is faster for very large functions, but the
+        alignment and score can then differ from a fresh run on the same files.""",
+    )
+    parser.add_argument(
+        "--disassembler",
+        dest="disassembler",
+        choices=["objdump", "rabbitizer"],
+        help="""Disassembler to use. rabbitizer reads MIPS object files and their
+        relocations directly instead of running objdump, which makes refreshes in
+        watch mode faster. Only works with -o, and not with --source. May be
+        enabled by default depending on diff_settings.py.""",
     )
     parser.add_argument(
         "--max-size",
@@ -340,9 +408,18 @@ if __name__ == "__main__":
     )
     parser.add_argument(
         "--format",
-        choices=("color", "plain", "html", "json"),
+        choices=("color", "plain", "html", "json", "jsonl"),
         default="color",
-        help="Output format, default is color. --format=html or json implies --no-pager.",
+        help="""Output format, default is color. --format=html, json or jsonl implies
+        --no-pager. jsonl writes one JSON object per row, followed by a summary
+        object, and can't be used with --watch.""",
+    )
+    parser.add_argument(
+        "--output-socket",
+        dest="output_socket",
+        metavar="PATH",
+        help="""Connect to the Unix socket at PATH and write the output there
+        instead of to stdout. Requires --format=jsonl.""",
     )
     parser.add_argument(
         "-U",
@@ -376,13 +453,18 @@ if __name__ == "__main__":
 # (We do imports late to optimize auto-complete performance.)
 
 import abc
+import bisect
 from collections import Counter, defaultdict
+import contextlib
 from dataclasses import asdict, dataclass, field, replace
 import difflib
+import hashlib
 import html
+import io
 import itertools
 import json
 import os
+import pickle
 import queue
 import re
 import string
@@ -392,10 +474,10 @@ import threading
 import time
 import traceback
 
-
 MISSING_PREREQUISITES = (
     "Missing prerequisite python module {}. "
-    "Run `python3 -m pip install --user colorama watchdog levenshtein cxxfilt` to install prerequisites (cxxfilt only needed with --source)."
+    "Run `python3 -m pip install --user colorama watchdog levenshtein cxxfilt` to install prerequisites (cxxfilt only needed with --source). "
+    "--disassembler=rabbitizer additionally needs `rabbitizer pyelftools`."
 )
 
 try:
@@ -415,6 +497,7 @@ class ProjectSettings:
     build_command: List[str]
     map_format: str
     build_dir: str
+    cache_dir: Optional[str]
     map_address_offset: int
     baseimg: Optional[str]
     myimg: Optional[str]
@@ -425,6 +508,7 @@ class ProjectSettings:
     disassemble_all: bool
     reg_categories: Dict[str, int]
     expected_dir: str
+    disassembler: str
 
 
 @dataclass
@@ -462,6 +546,8 @@ class Config:
     ignore_addr_diffs: bool
     algorithm: str
     reg_categories: Dict[str, int]
+    disassembler: str = "objdump"
+    incremental_align: bool = False
 
     # Score options
     score_stack_differences = True
@@ -473,6 +559,7 @@ class Config:
 
 
 def create_project_settings(settings: Dict[str, Any]) -> ProjectSettings:
+    build_dir = settings.get("build_dir", settings.get("mw_build_dir", "build/"))
     return ProjectSettings(
         arch_str=settings.get("arch", "mips"),
         baseimg=settings.get("baseimg"),
@@ -492,10 +579,14 @@ def create_project_settings(settings: Dict[str, Any]) -> ProjectSettings:
         map_address_offset=settings.get(
             "map_address_offset", settings.get("ms_map_address_offset", 0)
         ),
-        build_dir=settings.get("build_dir", settings.get("mw_build_dir", "build/")),
+        build_dir=build_dir,
+        cache_dir=settings.get(
+            "cache_dir", os.path.join(build_dir, "asm-differ-cache")
+        ),
         show_line_numbers_default=settings.get("show_line_numbers_default", True),
         disassemble_all=settings.get("disassemble_all", False),
         reg_categories=settings.get("reg_categories", {}),
+        disassembler=settings.get("disassembler", "objdump"),
     )
 
 
@@ -511,8 +602,12 @@ def create_config(args: argparse.Namespace, project: ProjectSettings) -> Config:
         formatter = HtmlFormatter()
     elif args.format == "json":
         formatter = JsonFormatter(arch_str=arch.name)
+    elif args.format == "jsonl":
+        formatter = JsonLinesFormatter(arch_str=arch.name)
     else:
         raise ValueError(f"Unsupported --format: {args.format}")
+    if args.output_socket is not None and args.format != "jsonl":
+        raise ValueError("--output-socket requires --format=jsonl")
 
     compress = None
     if args.compress_matching is not None:
@@ -528,6 +623,15 @@ def create_config(args: argparse.Namespace, project: ProjectSettings) -> Config:
     if show_line_numbers is None:
         show_line_numbers = project.show_line_numbers_default
 
+    disassembler = args.disassembler or project.disassembler
+    if disassembler == "rabbitizer":
+        if arch.name not in MIPS_ARCH_NAMES:
+            raise ValueError("--disassembler=rabbitizer only supports MIPS")
+        if not args.diff_obj:
+            raise ValueError("--disassembler=rabbitizer requires -o")
+        if args.show_source or args.source_old_binutils:
+            raise ValueError("--disassembler=rabbitizer does not support --source")
+
     return Config(
         arch=arch,
         # Build/objdump options
@@ -556,6 +660,8 @@ def create_config(args: argparse.Namespace, project: ProjectSettings) -> Config:
         ignore_addr_diffs=args.ignore_addr_diffs,
         algorithm=args.algorithm,
         reg_categories=project.reg_categories,
+        disassembler=disassembler,
+        incremental_align=args.incremental_align,
     )
 
 
@@ -728,7 +834,8 @@ class TableData:
     current_score: int
     max_score: int
     previous_score: Optional[int]
-    lines: List[TableLine]
+    # Generated lazily, and only iterable once
+    lines: Iterator[TableLine]
 
 
 class Formatter(abc.ABC):
@@ -742,6 +849,10 @@ class Formatter(abc.ABC):
         """Format a multi-column table with metadata"""
         ...
 
+    def write_table(self, data: TableData, out: TextIO) -> None:
+        """Format a table to `out`, which formatters may do incrementally"""
+        out.write(self.table(data))
+
     def apply(self, text: Text) -> str:
         return "".join(self.apply_format(chunk, f) for chunk, f in text.segments)
 
@@ -895,6 +1006,17 @@ class JsonFormatter(Formatter):
         return NotImplemented
 
     def table(self, data: TableData) -> str:
+        output = self.serialize_header(data)
+        output_rows: List[Dict[str, Any]] = []
+        for row in data.lines:
+            output_row = self.serialize_row(row)
+            if output_row is not None:
+                output_rows.append(output_row)
+        output["rows"] = output_rows
+        return json.dumps(output)
+
+    @staticmethod
+    def serialize(text: Optional[Text]) -> List[Dict[str, Any]]:
         def serialize_format(s: str, f: Format) -> Dict[str, Any]:
             if f == BasicFormat.NONE:
                 return {"text": s}
@@ -907,52 +1029,86 @@ class JsonFormatter(Formatter):
             else:
                 static_assert_unreachable(f)
 
-        def serialize(text: Optional[Text]) -> List[Dict[str, Any]]:
-            if text is None:
-                return []
-            return [serialize_format(s, f) for s, f in text.segments]
+        if text is None:
+            return []
+        return [serialize_format(s, f) for s, f in text.segments]
 
+    def serialize_header(self, data: TableData) -> Dict[str, Any]:
         output: Dict[str, Any] = {}
         output["arch_str"] = self.arch_str
         output["header"] = {
-            name: serialize(h)
+            name: self.serialize(h)
             for h, name in zip(data.headers, ("base", "current", "previous"))
         }
         output["current_score"] = data.current_score
         output["max_score"] = data.max_score
         if data.previous_score is not None:
             output["previous_score"] = data.previous_score
-        output_rows: List[Dict[str, Any]] = []
+        return output
+
+    def serialize_row(self, row: TableLine) -> Optional[Dict[str, Any]]:
+        output_row: Dict[str, Any] = {}
+        output_row["key"] = row.key
+        output_row["is_data_ref"] = row.is_data_ref
+        iters: List[Tuple[str, Text, Optional[Line]]] = [
+            (label, *cell)
+            for label, cell in zip(("base", "current", "previous"), row.cells)
+        ]
+        if all(line is None for _, _, line in iters):
+            # Skip rows that were only for displaying source code
+            return None
+        for column_name, text, line in iters:
+            column: Dict[str, Any] = {}
+            column["text"] = self.serialize(text)
+            if line:
+                if line.line_num is not None:
+                    column["line"] = line.line_num
+                if line.branch_target is not None:
+                    column["branch"] = line.branch_target
+                if line.source_lines:
+                    column["src"] = line.source_lines
+                if line.comment is not None:
+                    column["src_comment"] = line.comment
+                if line.source_line_num is not None:
+                    column["src_line"] = line.source_line_num
+            if line or column["text"]:
+                output_row[column_name] = column
+        return output_row
+
+
+@dataclass
+class JsonLinesFormatter(JsonFormatter):
+    """
+    Writes one JSON object per line: a {"type": "row"} record for each row of
+    the table, followed by a {"type": "summary"} record with the headers,
+    scores and row counts. Each record is flushed once written, so that it
+    can be read line by line, e.g. through --output-socket. The diff itself
+    is still computed in full before the first row is written.
+    """
+
+    def table(self, data: TableData) -> str:
+        out = io.StringIO()
+        self.write_table(data, out)
+        return out.getvalue()
+
+    def write_table(self, data: TableData, out: TextIO) -> None:
+        num_rows = 0
+        num_lines: Dict[str, int] = defaultdict(int)
         for row in data.lines:
-            output_row: Dict[str, Any] = {}
-            output_row["key"] = row.key
-            output_row["is_data_ref"] = row.is_data_ref
-            iters: List[Tuple[str, Text, Optional[Line]]] = [
-                (label, *cell)
-                for label, cell in zip(("base", "current", "previous"), row.cells)
-            ]
-            if all(line is None for _, _, line in iters):
-                # Skip rows that were only for displaying source code
+            output_row = self.serialize_row(row)
+            if output_row is None:
                 continue
-            for column_name, text, line in iters:
-                column: Dict[str, Any] = {}
-                column["text"] = serialize(text)
-                if line:
-                    if line.line_num is not None:
-                        column["line"] = line.line_num
-                    if line.branch_target is not None:
-                        column["branch"] = line.branch_target
-                    if line.source_lines:
-                        column["src"] = line.source_lines
-                    if line.comment is not None:
-                        column["src_comment"] = line.comment
-                    if line.source_line_num is not None:
-                        column["src_line"] = line.source_line_num
-                if line or column["text"]:
-                    output_row[column_name] = column
-            output_rows.append(output_row)
-        output["rows"] = output_rows
-        return json.dumps(output)
+            num_rows += 1
+            for column_name in ("base", "current", "previous"):
+                if "line" in output_row.get(column_name, {}):
+                    num_lines[column_name] += 1
+            out.write(json.dumps({"type": "row", **output_row}) + "\n")
+            out.flush()
+        summary = self.serialize_header(data)
+        summary["num_rows"] = num_rows
+        summary["num_lines"] = dict(num_lines)
+        out.write(json.dumps({"type": "summary", **summary}) + "\n")
+        out.flush()
 
 
 def format_fields(
@@ -999,6 +1155,10 @@ def symbol_formatter(group: str, base_index: int) -> FormatFunction:
 
 ObjdumpCommand = Tuple[List[str], str, Optional[str]]
 
+# Either objdump output (see `preprocess_objdump_out`), or lines that have
+# already been processed, when disassembling in-process.
+Dump = Union[str, List["Line"]]
+
 # eval_expr adapted from https://stackoverflow.com/a/9558001
 
 import ast
@@ -1112,8 +1272,21 @@ def maybe_get_objdump_source_flags(config: Config) -> List[str]:
 
 def run_objdump(cmd: ObjdumpCommand, config: Config, project: ProjectSettings) -> str:
     flags, target, restrict = cmd
+    out = objdump_output(flags, target, config, project)
+
+    obj_data: Optional[bytes] = None
+    if config.diff_obj:
+        with open(target, "rb") as f:
+            obj_data = f.read()
+
+    return preprocess_objdump_out(restrict, obj_data, out, config)
+
+
+def objdump_output(
+    flags: List[str], target: str, config: Config, project: ProjectSettings
+) -> str:
     try:
-        out = subprocess.run(
+        return subprocess.run(
             [project.objdump_executable]
             + config.arch.arch_flags
             + project.objdump_flags
@@ -1125,18 +1298,88 @@ def run_objdump(cmd: ObjdumpCommand, config: Config, project: ProjectSettings) -
             universal_newlines=True,
         ).stdout
     except subprocess.CalledProcessError as e:
-        print(e.stdout)
-        print(e.stderr)
+        print(e.stdout, file=sys.stderr)
+        print(e.stderr, file=sys.stderr)
         if "unrecognized option '--source-comment" in e.stderr:
             fail("** Try using --source-old-binutils instead of --source **")
         raise e
 
-    obj_data: Optional[bytes] = None
-    if config.diff_obj:
-        with open(target, "rb") as f:
-            obj_data = f.read()
 
-    return preprocess_objdump_out(restrict, obj_data, out, config)
+def run_disassembler(
+    cmd: ObjdumpCommand, config: Config, project: ProjectSettings
+) -> Dump:
+    if config.disassembler == "rabbitizer":
+        return disassemble_mips_elf(cmd, config)
+    return run_objdump(cmd, config, project)
+
+
+def base_cache_key(
+    cmd: ObjdumpCommand, config: Config, project: ProjectSettings
+) -> str:
+    flags, target, restrict = cmd
+    h = hashlib.sha256()
+    for path in (target, __file__):
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+    # Everything that affects the output of process()
+    h.update(
+        repr(
+            (
+                flags,
+                restrict,
+                project.objdump_executable,
+                project.objdump_flags,
+                config.arch.name,
+                config.disassembler,
+                config.diff_obj,
+                config.diff_section,
+                config.inlines,
+                config.source_old_binutils,
+                config.max_function_size_lines,
+                config.show_rodata_refs,
+                config.show_line_numbers,
+                config.stop_at_ret,
+                config.ignore_large_imms,
+                config.score_stack_differences,
+            )
+        ).encode()
+    )
+    return h.hexdigest()
+
+
+def run_base_disassembler(
+    cmd: ObjdumpCommand, config: Config, project: ProjectSettings, use_cache: bool
+) -> Dump:
+    """
+    Like `run_disassembler`, but for the base (expected) side, which rarely
+    changes between invocations: the processed lines are cached on disk, keyed
+    by a hash of the file, the function and the config.
+
+    Not used with --source, since the source lines interleaved by objdump come
+    from files that aren't part of the key.
+    """
+    if not use_cache or not project.cache_dir or config.show_source:
+        return run_disassembler(cmd, config, project)
+
+    cache_path = os.path.join(
+        project.cache_dir, base_cache_key(cmd, config, project) + ".pickle"
+    )
+    try:
+        with open(cache_path, "rb") as f:
+            lines: List[Line] = pickle.load(f)
+        return lines
+    except Exception:
+        # Missing, or unreadable (e.g. written by an incompatible diff.py)
+        pass
+
+    lines = process_dump(run_disassembler(cmd, config, project), config)
+    os.makedirs(project.cache_dir, exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(lines, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, cache_path)
+    return lines
 
 
 def preprocess_objdump_out(
@@ -1169,12 +1412,34 @@ def preprocess_objdump_out(
 
 
 def search_build_objects(objname: str, project: ProjectSettings) -> Optional[str]:
+    # The objects in the build directory don't depend on the section being
+    # diffed, so they are kept in the index for no section in particular.
+    # Like the symbols, they are looked up again whenever the map changes,
+    # and the build directory is still walked if the index looks stale.
+    index = load_map_index(project, "")
+    if index is not None:
+        if index.build_objects is None:
+            index.build_objects = defaultdict(list)
+            for dirpath, _, filenames in os.walk(project.build_dir):
+                for f in filenames:
+                    index.build_objects[f].append(os.path.join(dirpath, f))
+            save_map_index(index, project, "")
+        objfiles = index.build_objects.get(objname, [])
+        if objfiles and all(os.path.isfile(objfile) for objfile in objfiles):
+            return check_build_objects(objname, objfiles, project)
+
     objfiles = [
         os.path.join(dirpath, f)
         for dirpath, _, filenames in os.walk(project.build_dir)
         for f in filenames
         if f == objname
     ]
+    return check_build_objects(objname, objfiles, project)
+
+
+def check_build_objects(
+    objname: str, objfiles: List[str], project: ProjectSettings
+) -> Optional[str]:
     if len(objfiles) > 1:
         all_objects = "\n".join(objfiles)
         fail(
@@ -1193,50 +1458,38 @@ def search_map_file(
     if not project.mapfile:
         fail(f"No map file configured; cannot find function {fn_name}.")
 
-    try:
-        with open(project.mapfile) as f:
-            contents = f.read()
-    except Exception:
-        fail(f"Failed to open map file {project.mapfile} for reading.")
-
     if project.map_format == "gnu":
-        if for_binary and "load address" not in contents:
+        index = load_map_index(project, config.diff_section) or MapIndex(
+            mtime_ns=0, size=0, symbols=None, has_load_address=False
+        )
+        if index.symbols is None:
+            try:
+                parse_gnu_map(read_map_file(project), config.diff_section, index)
+            except Exception as e:
+                traceback.print_exc()
+                fail(f"Internal error while parsing map file")
+            save_map_index(index, project, config.diff_section)
+        assert index.symbols is not None
+
+        if for_binary and not index.has_load_address:
             fail(
                 'Failed to find "load address" in map file. Maybe you need to add\n'
                 '"export LANG := C" to your Makefile to avoid localized output?'
             )
 
-        lines = contents.split("\n")
-
-        try:
-            cur_objfile = None
-            ram_to_rom = None
-            cands = []
-            last_line = ""
-            for line in lines:
-                if line.startswith(" " + config.diff_section):
-                    cur_objfile = line.split()[3]
-                if "load address" in line:
-                    tokens = last_line.split() + line.split()
-                    ram = int(tokens[1], 0)
-                    rom = int(tokens[5], 0)
-                    ram_to_rom = rom - ram
-                if line.endswith(" " + fn_name) or f" {fn_name} = 0x" in line:
-                    ram = int(line.split()[0], 0)
-                    if (for_binary and ram_to_rom is not None) or (
-                        not for_binary and cur_objfile is not None
-                    ):
-                        cands.append((cur_objfile, ram + (ram_to_rom or 0)))
-                last_line = line
-        except Exception as e:
-            traceback.print_exc()
-            fail(f"Internal error while parsing map file")
+        cands = []
+        for cur_objfile, ram, ram_to_rom in index.symbols.get(fn_name, []):
+            if (for_binary and ram_to_rom is not None) or (
+                not for_binary and cur_objfile is not None
+            ):
+                cands.append((cur_objfile, ram + (ram_to_rom or 0)))
 
         if len(cands) > 1:
             fail(f"Found multiple occurrences of function {fn_name} in map file.")
         if len(cands) == 1:
             return cands[0]
     elif project.map_format == "mw":
+        contents = read_map_file(project)
         find = re.findall(
             #            ram   elf rom  alignment
             r"  \S+ \S+ (\S+) (\S+) +\S+ "
@@ -1262,6 +1515,7 @@ def search_map_file(
             if objfile is not None:
                 return objfile, rom
     elif project.map_format == "ms":
+        contents = read_map_file(project)
         load_address_find = re.search(
             r"Preferred load address is ([0-9a-f]+)",
             contents,
@@ -1304,6 +1558,167 @@ def search_map_file(
     return None, None
 
 
+def read_map_file(project: ProjectSettings) -> str:
+    assert project.mapfile is not None
+    try:
+        with open(project.mapfile) as f:
+            return f.read()
+    except Exception:
+        fail(f"Failed to open map file {project.mapfile} for reading.")
+
+
+@dataclass
+class MapIndex:
+    """
+    What search_map_file and search_build_objects need from a link, kept in
+    the cache directory so that the map file (which can be tens of MB) doesn't
+    have to be scanned for every lookup. It is rebuilt when the map changes.
+    """
+
+    mtime_ns: int
+    size: int
+    # Symbol name -> (object file, RAM address, ROM - RAM offset), for GNU maps
+    symbols: Optional[Dict[str, List[Tuple[Optional[str], int, Optional[int]]]]]
+    has_load_address: bool
+    # (name, ROM start, ROM end) of the symbols in the diffed section, by ROM
+    # address, for GNU maps
+    functions: Optional[List[Tuple[str, int, int]]] = None
+    # Object file name -> paths in the build directory
+    build_objects: Optional[Dict[str, List[str]]] = None
+    # (object file, ROM start, ROM end) of the input sections of the diffed
+    # section, for GNU maps
+    sections: Optional[List[Tuple[str, int, int]]] = None
+
+
+MAP_INDEX_VERSION = 3
+
+
+def map_index_path(project: ProjectSettings, diff_section: str) -> Optional[str]:
+    if not project.cache_dir or not project.mapfile:
+        return None
+    key = repr(
+        (MAP_INDEX_VERSION, os.path.abspath(project.mapfile), diff_section)
+    ).encode()
+    return os.path.join(
+        project.cache_dir, f"map-index-{hashlib.sha256(key).hexdigest()[:16]}.pickle"
+    )
+
+
+def load_map_index(project: ProjectSettings, diff_section: str) -> Optional[MapIndex]:
+    """Load the index for the current map file, or an empty one to be filled
+    in if it isn't up to date. None if there is nowhere to cache it."""
+    path = map_index_path(project, diff_section)
+    if path is None:
+        return None
+    assert project.mapfile is not None
+    try:
+        st = os.stat(project.mapfile)
+    except OSError:
+        return None
+    try:
+        with open(path, "rb") as f:
+            index = pickle.load(f)
+        if (index.mtime_ns, index.size) == (st.st_mtime_ns, st.st_size):
+            assert isinstance(index, MapIndex)
+            return index
+    except Exception:
+        pass
+    return MapIndex(
+        mtime_ns=st.st_mtime_ns, size=st.st_size, symbols=None, has_load_address=False
+    )
+
+
+def save_map_index(
+    index: MapIndex, project: ProjectSettings, diff_section: str
+) -> None:
+    path = map_index_path(project, diff_section)
+    if path is None or not index.mtime_ns:
+        return
+    assert project.cache_dir is not None
+    os.makedirs(project.cache_dir, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def parse_gnu_map(contents: str, diff_section: str, index: MapIndex) -> None:
+    symbols: Dict[str, List[Tuple[Optional[str], int, Optional[int]]]] = defaultdict(
+        list
+    )
+    functions: List[Tuple[str, int, int]] = []
+    sections: List[Tuple[str, int, int]] = []
+    cur_objfile = None
+    ram_to_rom = None
+    last_line = ""
+
+    # The input section of diff_section being read: RAM end, ROM - RAM offset,
+    # and its symbols
+    section_end = 0
+    section_ram_to_rom: Optional[int] = None
+    section_symbols: List[Tuple[int, str]] = []
+
+    def add_functions() -> None:
+        if section_ram_to_rom is None:
+            return
+        section_symbols.sort()
+        ends = [ram for ram, _ in section_symbols[1:]] + [section_end]
+        for (ram, name), end in zip(section_symbols, ends):
+            if end > ram:
+                functions.append(
+                    (name, ram + section_ram_to_rom, end + section_ram_to_rom)
+                )
+
+    for line in contents.split("\n"):
+        if line.startswith(" " + diff_section):
+            cur_objfile = line.split()[3]
+        if "load address" in line:
+            tokens = last_line.split() + line.split()
+            ram = int(tokens[1], 0)
+            rom = int(tokens[5], 0)
+            ram_to_rom = rom - ram
+        last_line = line
+
+        if not line.startswith("  "):
+            # Start of an input or output section
+            add_functions()
+            section_ram_to_rom = None
+            section_symbols = []
+            tokens = line.split()
+            if len(tokens) >= 4 and tokens[0] == diff_section:
+                section_start = int(tokens[1], 0)
+                section_end = section_start + int(tokens[2], 0)
+                section_ram_to_rom = ram_to_rom
+                if ram_to_rom is not None and section_end > section_start:
+                    sections.append(
+                        (
+                            tokens[3],
+                            section_start + ram_to_rom,
+                            section_end + ram_to_rom,
+                        )
+                    )
+
+        # Symbol lines look like "<address> <name>" or "<address> <name> = 0x..."
+        tokens = line.split(None, 1)
+        if len(tokens) < 2 or not tokens[0].startswith("0x"):
+            continue
+        names = re.findall(r" (\S+) = 0x", line)
+        if " " in line:
+            names.append(line.rsplit(" ", 1)[1])
+        ram = int(tokens[0], 0)
+        for name in set(names):
+            symbols[name].append((cur_objfile, ram, ram_to_rom))
+
+        if section_ram_to_rom is not None and " " not in tokens[1].strip():
+            section_symbols.append((ram, tokens[1].strip()))
+    add_functions()
+
+    index.symbols = dict(symbols)
+    index.has_load_address = "load address" in contents
+    index.functions = sorted(functions, key=lambda f: f[1])
+    index.sections = sections
+
+
 def parse_elf_rodata_references(
     data: bytes, config: Config
 ) -> List[Tuple[int, int, str]]:
@@ -1491,16 +1906,11 @@ def dump_objfile(
     if not os.path.isfile(objfile):
         fail(f"Not able to find .o file for function: {objfile} is not a file.")
 
-    refobjfile = os.path.join(project.expected_dir, objfile)
+    refobjfile = expected_objfile(objfile, project)
     if config.diff_mode != DiffMode.SINGLE and not os.path.isfile(refobjfile):
         fail(f'Please ensure an OK .o file exists at "{refobjfile}".')
 
-    if project.disassemble_all:
-        disassemble_flag = "-D"
-    else:
-        disassemble_flag = "-d"
-
-    objdump_flags = [disassemble_flag, "-rz", "-j", config.diff_section]
+    objdump_flags = objfile_objdump_flags(config, project)
     return (
         objfile,
         (objdump_flags, refobjfile, start),
@@ -1508,6 +1918,22 @@ def dump_objfile(
     )
 
 
+def expected_objfile(objfile: str, project: ProjectSettings) -> str:
+    """The path of the expected counterpart of an object file. The expected
+    directory mirrors the project root, so the path is made relative to it
+    first (os.path.join would drop expected_dir for an absolute path)."""
+    return os.path.join(project.expected_dir, os.path.relpath(objfile))
+
+
+def objfile_objdump_flags(config: Config, project: ProjectSettings) -> List[str]:
+    if project.disassemble_all:
+        disassemble_flag = "-D"
+    else:
+        disassemble_flag = "-d"
+
+    return [disassemble_flag, "-rz", "-j", config.diff_section]
+
+
 def dump_binary(
     start: str, end: Optional[str], config: Config, project: ProjectSettings
 ) -> Tuple[str, ObjdumpCommand, ObjdumpCommand]:
@@ -2462,6 +2888,10 @@ def reloc_addend_from_imm(imm: str, before: str, arch: ArchSettings) -> str:
         addend = int(imm, 16)
     else:
         addend = int(imm, 0)
+    return format_addend(addend)
+
+
+def format_addend(addend: int) -> str:
     if addend == 0:
         return ""
     elif addend < 0:
@@ -2526,15 +2956,7 @@ def process(dump: str, config: Config) -> List[Line]:
             continue
 
         if config.diff_obj and num_instr >= config.max_function_size_lines:
-            output.append(
-                Line(
-                    mnemonic="...",
-                    diff_row="...",
-                    original="...",
-                    normalized_original="...",
-                    scorable_line="...",
-                )
-            )
+            output.append(truncation_line())
             break
 
         if not re.match(r"^\s+[0-9a-f]+:\s+", row):
@@ -2569,20 +2991,7 @@ def process(dump: str, config: Config) -> List[Line]:
             row = "\t".join(tabs[2:])
 
         if line_num in data_refs:
-            refs = data_refs[line_num]
-            ref_str = "; ".join(
-                section_name + "+" + ",".join(hex(off) for off in offs)
-                for section_name, offs in refs.items()
-            )
-            output.append(
-                Line(
-                    mnemonic="<data-ref>",
-                    diff_row="<data-ref>",
-                    original=ref_str,
-                    normalized_original=ref_str,
-                    scorable_line="<data-ref>",
-                )
-            )
+            output.append(data_ref_line(data_refs[line_num]))
 
         if "\t" in row:
             row_parts = row.split("\t", 1)
@@ -2640,14 +3049,7 @@ def process(dump: str, config: Config) -> List[Line]:
         if not config.score_stack_differences:
             scorable_line = re.sub(arch.re_sprel, "addr(sp)", scorable_line)
 
-        row = re.sub(arch.re_reg, "<reg>", row)
-        row = re.sub(arch.re_sprel, "addr(sp)", row)
-        if mnemonic in arch.instructions_with_address_immediates:
-            row = row.strip()
-            row, _ = split_off_address(row)
-            row += "<imm>"
-        else:
-            row = normalize_imms(row, arch)
+        row = normalize_diff_row(mnemonic, row, arch)
 
         branch_target = None
         if (
@@ -2704,6 +3106,281 @@ def process(dump: str, config: Config) -> List[Line]:
     return output
 
 
+# How relocated operands are shown, matching AsmProcessorMIPS.process_reloc
+MIPS_RELOC_FORMATS: Dict[str, str] = {
+    "R_MIPS_26": "{}",
+    "R_MIPS_PC16": "{}",
+    "R_MIPS_HI16": "%hi({})",
+    "R_MIPS_LO16": "%lo({})",
+    "R_MIPS_GPREL16": "%gp_rel({})",
+    "R_MIPS_GOT16": "%got({})",
+    "R_MIPS_CALL16": "%call16({})",
+}
+
+
+def sign_extend(value: int, bits: int) -> int:
+    sign_bit = 1 << (bits - 1)
+    return (value & (sign_bit - 1)) - (value & sign_bit)
+
+
+def read_mips_relocs(
+    elf: Any, section_index: int, words: List[int]
+) -> Dict[int, Tuple[str, str, int]]:
+    """Map offsets within a section to (type, symbol, addend) for each of its
+    relocations. Unlike objdump's output this keeps relocations in order, so
+    REL %hi/%lo pairs can be combined into their full addend."""
+    from elftools.elf.enums import ENUM_RELOC_TYPE_MIPS
+
+    type_names = {v: k for k, v in ENUM_RELOC_TYPE_MIPS.items() if k != "_default_"}
+
+    def symbol_name(symtab: Any, index: int) -> str:
+        sym = symtab.get_symbol(index)
+        shndx = sym["st_shndx"]
+        if sym["st_info"]["type"] == "STT_SECTION" and isinstance(shndx, int):
+            return str(elf.get_section(shndx).name)
+        return str(sym.name)
+
+    ret: Dict[int, Tuple[str, str, int]] = {}
+    for section in elf.iter_sections():
+        if section["sh_type"] not in ("SHT_REL", "SHT_RELA"):
+            continue
+        if section["sh_info"] != section_index:
+            continue
+        symtab = elf.get_section(section["sh_link"])
+
+        # %hi relocations waiting for their %lo, and the last %hi seen per symbol
+        pending_hi: List[Tuple[int, str, int]] = []
+        last_hi: Dict[str, int] = {}
+
+        for reloc in section.iter_relocations():
+            offset = reloc["r_offset"]
+            reloc_type = type_names.get(reloc["r_info_type"], str(reloc["r_info_type"]))
+            if reloc_type in ("R_MIPS_NONE", "R_MIPS_JALR"):
+                continue
+            name = symbol_name(symtab, reloc["r_info_sym"])
+            word = words[offset // 4]
+
+            if reloc.is_RELA():
+                addend = reloc["r_addend"]
+            elif reloc_type == "R_MIPS_26":
+                addend = (word & 0x3FFFFFF) << 2
+            elif reloc_type == "R_MIPS_HI16":
+                pending_hi.append((offset, name, word & 0xFFFF))
+                continue
+            elif reloc_type == "R_MIPS_LO16":
+                for hi_offset, hi_name, hi_imm in pending_hi:
+                    if hi_name == name:
+                        last_hi[name] = hi_imm
+                        hi_addend = sign_extend(
+                            (hi_imm << 16) + sign_extend(word, 16), 32
+                        )
+                        ret[hi_offset] = ("R_MIPS_HI16", name, hi_addend)
+                pending_hi = [hi for hi in pending_hi if hi[1] != name]
+                addend = sign_extend(
+                    (last_hi.get(name, 0) << 16) + sign_extend(word, 16), 32
+                )
+            else:
+                addend = sign_extend(word, 16)
+            ret[offset] = (reloc_type, name, addend)
+
+        # %hi relocations without a matching %lo
+        for hi_offset, hi_name, hi_imm in pending_hi:
+            ret[hi_offset] = ("R_MIPS_HI16", hi_name, sign_extend(hi_imm << 16, 32))
+    return ret
+
+
+def disassemble_mips_elf(cmd: ObjdumpCommand, config: Config) -> List[Line]:
+    """
+    In-process replacement for `run_objdump` followed by `process`, for MIPS
+    object files.
+
+    Reads the section and its relocations straight from the ELF and
+    disassembles it with rabbitizer. Like with objdump, disassembly starts at
+    the function's symbol and runs until the end of the section (or until
+    --stop-at-ret/--max-size kick in).
+    """
+    import rabbitizer
+    from elftools.elf.elffile import ELFFile
+
+    _, target, fn_name = cmd
+    with open(target, "rb") as f:
+        data = f.read()
+    elf = ELFFile(io.BytesIO(data))
+
+    section_index = None
+    for i, section in enumerate(elf.iter_sections()):
+        if section.name == config.diff_section and section["sh_size"] != 0:
+            section_index = i
+            break
+    if section_index is None:
+        return []
+    section_data = elf.get_section(section_index).data()
+    word_format = "<" if elf.little_endian else ">"
+    word_format += f"{len(section_data) // 4}I"
+    words = list(struct.unpack_from(word_format, section_data))
+
+    start = None
+    symtab = elf.get_section_by_name(".symtab")
+    if symtab is not None:
+        for sym in symtab.iter_symbols():
+            if sym.name == fn_name and sym["st_shndx"] == section_index:
+                start = sym["st_value"]
+                break
+    if start is None:
+        return []
+
+    relocs = read_mips_relocs(elf, section_index, words)
+
+    data_refs: Dict[int, Dict[str, List[int]]] = defaultdict(lambda: defaultdict(list))
+    if config.show_rodata_refs:
+        for text_offset, from_offset, from_section in parse_elf_rodata_references(
+            data, config
+        ):
+            data_refs[text_offset][from_section].append(from_offset)
+
+    rabbitizer.config.misc_omit0XOnSmallImm = True
+    rabbitizer.config.misc_unknownInstrComment = False
+    if config.arch.name == "mipsee":
+        category = rabbitizer.InstrCategory.R5900
+    else:
+        category = rabbitizer.InstrCategory.CPU
+
+    def disassemble(instr: Any, imm: Optional[str]) -> Tuple[str, str]:
+        # Operands are written like objdump does, e.g. "lw\tv0,0x10(sp)".
+        # The immediate is substituted afterwards to leave symbol names alone.
+        text = instr.disassemble(immOverride=None if imm is None else "\x01")
+        mnemonic, _, args = text.partition(" ")
+        args = args.strip().replace("$", "").replace(", ", ",")
+        if imm is not None:
+            args = args.replace("\x01", imm)
+        return mnemonic, args
+
+    arch = config.arch
+    processor = arch.proc(config)
+    rets_remaining = config.stop_at_ret
+    num_instr = 0
+    output: List[Line] = []
+    for line_num in range(start & ~3, len(words) * 4, 4):
+        if num_instr >= config.max_function_size_lines:
+            output.append(truncation_line())
+            break
+
+        if line_num in data_refs:
+            output.append(data_ref_line(data_refs[line_num]))
+
+        instr = rabbitizer.Instruction(
+            words[line_num // 4], vram=line_num, category=category
+        )
+
+        target_addr = None
+        if instr.isBranch():
+            target_addr = instr.getBranchVramGeneric()
+        elif instr.isJumpWithAddress():
+            target_addr = instr.getInstrIndexAsVram()
+        address = None if target_addr is None else f"{target_addr:x}"
+
+        mnemonic, args = disassemble(instr, address)
+        row = mnemonic + "\t" + args
+        original = row
+
+        symbol = None
+        is_text_relative_j = False
+        reloc = relocs.get(line_num)
+        if reloc is not None:
+            reloc_type, name, addend = reloc
+            if reloc_type == "R_MIPS_LITERAL":
+                repl = name
+            elif reloc_type in MIPS_RELOC_FORMATS:
+                repl = MIPS_RELOC_FORMATS[reloc_type].format(
+                    name + format_addend(addend)
+                )
+            else:
+                assert False, f"unknown relocation type '{reloc_type}' for line '{row}'"
+            if mnemonic == "j" and repl.startswith(".text"):
+                is_text_relative_j = True
+            else:
+                symbol = repl
+                original = mnemonic + "\t" + disassemble(instr, repl)[1]
+
+        normalized_original = processor.normalize(mnemonic, original)
+
+        scorable_line = normalized_original
+        if not config.score_stack_differences:
+            scorable_line = re.sub(arch.re_sprel, "addr(sp)", scorable_line)
+
+        branch_target = None
+        if (
+            mnemonic in arch.branch_instructions or is_text_relative_j
+        ) and symbol is None:
+            branch_target = target_addr
+
+        output.append(
+            Line(
+                mnemonic=mnemonic,
+                diff_row=normalize_diff_row(mnemonic, row, arch),
+                original=original,
+                normalized_original=normalized_original,
+                scorable_line=scorable_line,
+                symbol=symbol,
+                line_num=line_num,
+                branch_target=branch_target,
+            )
+        )
+        num_instr += 1
+
+        if rets_remaining and processor.is_end_of_function(mnemonic, args):
+            rets_remaining -= 1
+            if rets_remaining == 0:
+                break
+
+    processor.post_process(output)
+    return output
+
+
+def truncation_line() -> Line:
+    return Line(
+        mnemonic="...",
+        diff_row="...",
+        original="...",
+        normalized_original="...",
+        scorable_line="...",
+    )
+
+
+def data_ref_line(refs: Dict[str, List[int]]) -> Line:
+    ref_str = "; ".join(
+        section_name + "+" + ",".join(hex(off) for off in offs)
+        for section_name, offs in refs.items()
+    )
+    return Line(
+        mnemonic="<data-ref>",
+        diff_row="<data-ref>",
+        original=ref_str,
+        normalized_original=ref_str,
+        scorable_line="<data-ref>",
+    )
+
+
+def normalize_diff_row(mnemonic: str, row: str, arch: ArchSettings) -> str:
+    """Turn a line into the coarser form used for alignment, which ignores
+    registers and immediates."""
+    row = re.sub(arch.re_reg, "<reg>", row)
+    row = re.sub(arch.re_sprel, "addr(sp)", row)
+    if mnemonic in arch.instructions_with_address_immediates:
+        row = row.strip()
+        row, _ = split_off_address(row)
+        row += "<imm>"
+    else:
+        row = normalize_imms(row, arch)
+    return row
+
+
+def process_dump(dump: Dump, config: Config) -> List[Line]:
+    if isinstance(dump, str):
+        return process(dump, config)
+    return dump
+
+
 def normalize_imms(row: str, arch: ArchSettings) -> str:
     return re.sub(arch.re_imm, "<imm>", row)
 
@@ -2769,9 +3446,211 @@ def diff_sequences_difflib(
     return differ.get_opcodes()
 
 
+# Above this many cells (N * M) in the part of the sequences that differs, the bit-parallel
+# LCS in diff_sequences_myers would need too much memory, and Myers' algorithm is used.
+MAX_BIT_PARALLEL_DIFF_SIZE = 1 << 26
+
+
+def diff_sequences_myers(
+    seq1: List[str], seq2: List[str]
+) -> List[Tuple[str, int, int, int, int]]:
+    """
+    A minimal diff in terms of insertions and deletions (i.e. a longest common
+    subsequence). The common prefix and suffix are stripped first. If what
+    remains is small enough, it is aligned with a bit-parallel LCS, which
+    takes O(N * M / word size) time whatever the number of differences.
+    Otherwise, Myers' O(ND) diff is used, in linear space (bisecting on the
+    "middle snake"), which is fast when there are few differences.
+
+    Mnemonics are interned to integers first, so there is no limit on the
+    number of distinct ones. Returns difflib-style opcodes, where adjacent
+    deletions and insertions are merged into "replace".
+    """
+    interned: Dict[str, int] = {}
+    a = [interned.setdefault(x, len(interned)) for x in seq1]
+    b = [interned.setdefault(x, len(interned)) for x in seq2]
+
+    # (is_equal, i1, i2, j1, j2), in order
+    segments: List[Tuple[bool, int, int, int, int]] = []
+
+    def diff_bit_parallel(a_lo: int, a_hi: int, b_lo: int, b_hi: int) -> None:
+        """
+        Allison-Dix/Hyyrö bit-parallel LCS. Bit j of rows[i] is 0 if and only
+        if LCS(a[:i], b[:j + 1]) = LCS(a[:i], b[:j]) + 1 (relative to a_lo and
+        b_lo). All rows are kept, and the alignment is traced back from them.
+        """
+        m = b_hi - b_lo
+        full = (1 << m) - 1
+        matches: Dict[int, int] = defaultdict(int)
+        for j in range(m):
+            matches[b[b_lo + j]] |= 1 << j
+        rows = [full]
+        v = full
+        for i in range(a_lo, a_hi):
+            u = v & matches[a[i]]
+            v = ((v + u) | (v - u)) & full
+            rows.append(v)
+
+        steps: List[Tuple[bool, int, int, int, int]] = []
+        i = a_hi - a_lo
+        j = m
+        while i > 0 and j > 0:
+            x = a_lo + i - 1
+            y = b_lo + j - 1
+            if a[x] == b[y]:
+                steps.append((True, x, x + 1, y, y + 1))
+                i -= 1
+                j -= 1
+            elif (rows[i] >> (j - 1)) & 1:
+                # LCS(a[:i], b[:j - 1]) = LCS(a[:i], b[:j]), so b[y] can be inserted
+                steps.append((False, x + 1, x + 1, y, y + 1))
+                j -= 1
+            else:
+                steps.append((False, x, x + 1, y + 1, y + 1))
+                i -= 1
+        if i > 0:
+            steps.append((False, a_lo, a_lo + i, b_lo, b_lo))
+        if j > 0:
+            steps.append((False, a_lo, a_lo, b_lo, b_lo + j))
+        segments.extend(reversed(steps))
+
+    def diff(a_lo: int, a_hi: int, b_lo: int, b_hi: int) -> None:
+        # Strip the common prefix and suffix
+        prefix_end_a, prefix_end_b = a_lo, b_lo
+        while prefix_end_a < a_hi and prefix_end_b < b_hi:
+            if a[prefix_end_a] != b[prefix_end_b]:
+                break
+            prefix_end_a += 1
+            prefix_end_b += 1
+        suffix_start_a, suffix_start_b = a_hi, b_hi
+        while suffix_start_a > prefix_end_a and suffix_start_b > prefix_end_b:
+            if a[suffix_start_a - 1] != b[suffix_start_b - 1]:
+                break
+            suffix_start_a -= 1
+            suffix_start_b -= 1
+
+        if prefix_end_a > a_lo:
+            segments.append((True, a_lo, prefix_end_a, b_lo, prefix_end_b))
+        n = suffix_start_a - prefix_end_a
+        m = suffix_start_b - prefix_end_b
+        if 0 < n * m <= MAX_BIT_PARALLEL_DIFF_SIZE:
+            diff_bit_parallel(
+                prefix_end_a, suffix_start_a, prefix_end_b, suffix_start_b
+            )
+        else:
+            split = bisect(prefix_end_a, suffix_start_a, prefix_end_b, suffix_start_b)
+            if split is None:
+                segments.append(
+                    (False, prefix_end_a, suffix_start_a, prefix_end_b, suffix_start_b)
+                )
+            else:
+                x, y = split
+                diff(prefix_end_a, x, prefix_end_b, y)
+                diff(x, suffix_start_a, y, suffix_start_b)
+        if suffix_start_a < a_hi:
+            segments.append((True, suffix_start_a, a_hi, suffix_start_b, b_hi))
+
+    def bisect(a_lo: int, a_hi: int, b_lo: int, b_hi: int) -> Optional[Tuple[int, int]]:
+        """Find where the middle snake of an edit path crosses, or None if the
+        ranges are empty or have nothing in common."""
+        n = a_hi - a_lo
+        m = b_hi - b_lo
+        if n == 0 or m == 0:
+            return None
+        max_d = (n + m + 1) // 2
+        v_offset = max_d
+        v_length = 2 * max_d + 2
+        v1 = [-1] * v_length
+        v2 = [-1] * v_length
+        v1[v_offset + 1] = 0
+        v2[v_offset + 1] = 0
+        delta = n - m
+        front = delta % 2 != 0
+        k1start = k1end = k2start = k2end = 0
+        for d in range(max_d):
+            # Walk the forward path one step
+            for k1 in range(-d + k1start, d + 1 - k1end, 2):
+                k1_offset = v_offset + k1
+                if k1 == -d or (k1 != d and v1[k1_offset - 1] < v1[k1_offset + 1]):
+                    x1 = v1[k1_offset + 1]
+                else:
+                    x1 = v1[k1_offset - 1] + 1
+                y1 = x1 - k1
+                while x1 < n and y1 < m and a[a_lo + x1] == b[b_lo + y1]:
+                    x1 += 1
+                    y1 += 1
+                v1[k1_offset] = x1
+                if x1 > n:
+                    k1end += 2
+                elif y1 > m:
+                    k1start += 2
+                elif front:
+                    k2_offset = v_offset + delta - k1
+                    if 0 <= k2_offset < v_length and v2[k2_offset] != -1:
+                        if x1 >= n - v2[k2_offset]:
+                            return a_lo + x1, b_lo + y1
+
+            # Walk the reverse path one step
+            for k2 in range(-d + k2start, d + 1 - k2end, 2):
+                k2_offset = v_offset + k2
+                if k2 == -d or (k2 != d and v2[k2_offset - 1] < v2[k2_offset + 1]):
+                    x2 = v2[k2_offset + 1]
+                else:
+                    x2 = v2[k2_offset - 1] + 1
+                y2 = x2 - k2
+                while x2 < n and y2 < m and a[a_hi - x2 - 1] == b[b_hi - y2 - 1]:
+                    x2 += 1
+                    y2 += 1
+                v2[k2_offset] = x2
+                if x2 > n:
+                    k2end += 2
+                elif y2 > m:
+                    k2start += 2
+                elif not front:
+                    k1_offset = v_offset + delta - k2
+                    if 0 <= k1_offset < v_length and v1[k1_offset] != -1:
+                        x1 = v1[k1_offset]
+                        y1 = v_offset + x1 - k1_offset
+                        if x1 >= n - x2:
+                            return a_lo + x1, b_lo + y1
+        return None
+
+    diff(0, len(a), 0, len(b))
+
+    # Merge runs of non-equal segments into single opcodes
+    opcodes: List[Tuple[str, int, int, int, int]] = []
+    pending: Optional[Tuple[int, int, int, int]] = None
+    for is_equal, i1, i2, j1, j2 in segments + [(True, len(a), len(a), len(b), len(b))]:
+        if not is_equal:
+            if pending is None:
+                pending = (i1, i2, j1, j2)
+            else:
+                pending = (pending[0], i2, pending[2], j2)
+            continue
+        if pending is not None:
+            pi1, pi2, pj1, pj2 = pending
+            if pi1 == pi2 and pj1 == pj2:
+                pass
+            elif pi1 == pi2:
+                opcodes.append(("insert", pi1, pi2, pj1, pj2))
+            elif pj1 == pj2:
+                opcodes.append(("delete", pi1, pi2, pj1, pj2))
+            else:
+                opcodes.append(("replace", pi1, pi2, pj1, pj2))
+            pending = None
+        if i1 < i2:
+            if opcodes and opcodes[-1][0] == "equal":
+                _, ei1, _, ej1, _ = opcodes.pop()
+                i1, j1 = ei1, ej1
+            opcodes.append(("equal", i1, i2, j1, j2))
+    return opcodes
+
+
 def diff_sequences(
     seq1: List[str], seq2: List[str], algorithm: str
 ) -> List[Tuple[str, int, int, int, int]]:
+    if algorithm == "myers":
+        return diff_sequences_myers(seq1, seq2)
     if algorithm != "levenshtein":
         return diff_sequences_difflib(seq1, seq2)
 
@@ -2804,17 +3683,114 @@ def diff_sequences(
     return ret
 
 
+@dataclass
+class AlignmentCache:
+    """The last alignment computed by `diff_sequences_incremental`."""
+
+    seq1: List[str] = field(default_factory=list)
+    seq2: List[str] = field(default_factory=list)
+    opcodes: List[Tuple[str, int, int, int, int]] = field(default_factory=list)
+
+
+def diff_sequences_incremental(
+    seq1: List[str], seq2: List[str], algorithm: str, cache: AlignmentCache
+) -> List[Tuple[str, int, int, int, int]]:
+    """
+    Like `diff_sequences`, for when seq2 is an edited version of the sequence
+    that was last aligned against the same seq1, as happens on each rebuild in
+    watch mode. The alignment of the unchanged prefix and suffix of seq2 is
+    reused, and only the window in between is aligned again.
+
+    If only part of the function changed, the result can differ from aligning
+    everything from scratch, but the unchanged regions keep the alignment
+    they already had. This is why it is only used with --incremental-align.
+    """
+    old2 = cache.seq2
+    if seq1 != cache.seq1 or not cache.opcodes:
+        opcodes = diff_sequences(seq1, seq2, algorithm)
+    elif seq2 == old2:
+        opcodes = cache.opcodes
+    else:
+        max_common = min(len(seq2), len(old2))
+        prefix_len = 0
+        while prefix_len < max_common and seq2[prefix_len] == old2[prefix_len]:
+            prefix_len += 1
+        suffix_len = 0
+        while (
+            suffix_len < max_common - prefix_len
+            and seq2[-1 - suffix_len] == old2[-1 - suffix_len]
+        ):
+            suffix_len += 1
+
+        # Keep the old alignment up to the end of the unchanged prefix...
+        prefix: List[Tuple[str, int, int, int, int]] = []
+        for tag, i1, i2, j1, j2 in cache.opcodes:
+            if j1 >= prefix_len:
+                break
+            if j2 > prefix_len:
+                if tag != "equal":
+                    break
+                i2 = i1 + prefix_len - j1
+                j2 = prefix_len
+            prefix.append((tag, i1, i2, j1, j2))
+        # (up to a matching line, since lines that didn't match before may
+        # match something in the changed window now)
+        while prefix and prefix[-1][0] != "equal":
+            prefix.pop()
+        i_start, j_start = (prefix[-1][2], prefix[-1][4]) if prefix else (0, 0)
+
+        # ...and from the start of the unchanged suffix, shifted to where it
+        # now is in seq2.
+        suffix: List[Tuple[str, int, int, int, int]] = []
+        shift = len(seq2) - len(old2)
+        suffix_start = len(old2) - suffix_len
+        for tag, i1, i2, j1, j2 in reversed(cache.opcodes):
+            if j2 <= suffix_start or i1 < i_start or j1 + shift < j_start:
+                break
+            if j1 < suffix_start:
+                if tag != "equal":
+                    break
+                i1 = i2 - (j2 - suffix_start)
+                j1 = suffix_start
+                if i1 < i_start:
+                    break
+            suffix.append((tag, i1, i2, j1 + shift, j2 + shift))
+        while suffix and suffix[-1][0] != "equal":
+            suffix.pop()
+        suffix.reverse()
+        i_end, j_end = (
+            (suffix[0][1], suffix[0][3]) if suffix else (len(seq1), len(seq2))
+        )
+
+        middle = [
+            (tag, i1 + i_start, i2 + i_start, j1 + j_start, j2 + j_start)
+            for tag, i1, i2, j1, j2 in diff_sequences(
+                seq1[i_start:i_end], seq2[j_start:j_end], algorithm
+            )
+        ]
+        opcodes = prefix + middle + suffix
+
+    cache.seq1 = seq1
+    cache.seq2 = seq2
+    cache.opcodes = opcodes
+    return opcodes
+
+
 def diff_lines(
     lines1: List[Line],
     lines2: List[Line],
     algorithm: str,
+    alignment_cache: Optional[AlignmentCache] = None,
 ) -> List[Tuple[Optional[Line], Optional[Line]]]:
+    seq1 = [line.mnemonic for line in lines1]
+    seq2 = [line.mnemonic for line in lines2]
+    if alignment_cache is not None:
+        opcodes = diff_sequences_incremental(seq1, seq2, algorithm, alignment_cache)
+    else:
+        opcodes = diff_sequences(seq1, seq2, algorithm)
+
     ret = []
-    for tag, i1, i2, j1, j2 in diff_sequences(
-        [line.mnemonic for line in lines1],
-        [line.mnemonic for line in lines2],
-        algorithm,
-    ):
+    for tag, i1, i2, j1, j2 in opcodes:
         for line1, line2 in itertools.zip_longest(lines1[i1:i2], lines2[j1:j2]):
             if tag == "replace":
                 if line1 is None:
@@ -2994,7 +3970,12 @@ def trim_nops(lines: List[Line], arch: ArchSettings) -> List[Line]:
     return lines
 
 
-def do_diff(lines1: List[Line], lines2: List[Line], config: Config) -> Diff:
+def do_diff(
+    lines1: List[Line],
+    lines2: List[Line],
+    config: Config,
+    alignment_cache: Optional[AlignmentCache] = None,
+) -> Diff:
     if config.show_source:
         import cxxfilt
     arch = config.arch
@@ -3025,7 +4006,7 @@ def do_diff(lines1: List[Line], lines2: List[Line], config: Config) -> Diff:
     lines1 = trim_nops(lines1, arch)
     lines2 = trim_nops(lines2, arch)
 
-    diffed_lines = diff_lines(lines1, lines2, config.algorithm)
+    diffed_lines = diff_lines(lines1, lines2, config.algorithm, alignment_cache)
 
     line_num_base = -1
     line_num_offset = 0
@@ -3426,7 +4407,7 @@ def align_diffs(old_diff: Diff, new_diff: Diff, config: Config) -> TableData:
         current_score=current_score,
         max_score=max_score,
         previous_score=previous_score,
-        lines=[diff_line_to_table_line(line) for line in diff_lines],
+        lines=(diff_line_to_table_line(line) for line in diff_lines),
     )
 
 
@@ -3506,8 +4487,8 @@ def debounced_fs_watch(
 
 
 class Display:
-    basedump: str
-    mydump: str
+    basedump: Dump
+    mydump: Dump
     last_refresh_key: object
     config: Config
     emsg: Optional[str]
@@ -3517,40 +4498,53 @@ class Display:
     watch_queue: "queue.Queue[Optional[float]]"
     less_proc: "Optional[subprocess.Popen[bytes]]"
 
-    def __init__(self, basedump: str, mydump: str, config: Config) -> None:
+    def __init__(self, basedump: Dump, mydump: Dump, config: Config) -> None:
         self.config = config
-        self.base_lines = process(basedump, config)
+        self.base_lines = process_dump(basedump, config)
         self.mydump = mydump
         self.emsg = None
         self.last_refresh_key = None
         self.last_diff_output = None
+        # With --incremental-align, only the part of the function that changed
+        # since the last refresh is realigned
+        self.alignment_cache = AlignmentCache() if config.incremental_align else None
 
     def run_diff(self) -> Tuple[str, object]:
         if self.emsg is not None:
             return (self.emsg, self.emsg)
 
-        my_lines = process(self.mydump, self.config)
+        data, diff_output = self.diff_table()
+        output = self.config.formatter.table(data)
+
+        refresh_key = (
+            [line.key2 for line in diff_output.lines],
+            diff_output.score,
+        )
+
+        return (output, refresh_key)
+
+    def run_stream(self, out: TextIO) -> None:
+        data, _ = self.diff_table()
+        self.config.formatter.write_table(data, out)
+
+    def diff_table(self) -> Tuple[TableData, Diff]:
+        my_lines = process_dump(self.mydump, self.config)
 
         if self.config.diff_mode == DiffMode.SINGLE_BASE:
             diff_output = do_diff(self.base_lines, self.base_lines, self.config)
         elif self.config.diff_mode == DiffMode.SINGLE:
             diff_output = do_diff(my_lines, my_lines, self.config)
         else:
-            diff_output = do_diff(self.base_lines, my_lines, self.config)
+            diff_output = do_diff(
+                self.base_lines, my_lines, self.config, self.alignment_cache
+            )
 
         last_diff_output = self.last_diff_output or diff_output
         if self.config.diff_mode != DiffMode.THREEWAY_BASE or not self.last_diff_output:
             self.last_diff_output = diff_output
 
         data = align_diffs(last_diff_output, diff_output, self.config)
-        output = self.config.formatter.table(data)
-
-        refresh_key = (
-            [line.key2 for line in diff_output.lines],
-            diff_output.score,
-        )
-
-        return (output, refresh_key)
+        return (data, diff_output)
 
     def run_less(
         self, output: str
@@ -3615,7 +4609,7 @@ class Display:
         sys.stdout.write("\x1b7\x1b[1;1f{}\x1b8".format(msg + " "))
         sys.stdout.flush()
 
-    def update(self, text: str, error: bool) -> None:
+    def update(self, text: Dump, error: bool) -> None:
         if not error and not self.emsg and text == self.mydump:
             self.progress("Unchanged. ")
             return
@@ -3642,6 +4636,457 @@ class Display:
         self.ready_queue.get()
 
 
+def elf_function_symbols(objfile: str, section_name: str) -> List[str]:
+    from elftools.elf.elffile import ELFFile
+
+    with open(objfile, "rb") as f:
+        elf = ELFFile(f)
+        section_indices = [
+            i
+            for i, section in enumerate(elf.iter_sections())
+            if section.name == section_name
+        ]
+        symtab = elf.get_section_by_name(".symtab")
+        if symtab is None:
+            return []
+        return [
+            sym.name
+            for sym in symtab.iter_symbols()
+            if sym["st_info"]["type"] == "STT_FUNC"
+            and sym["st_shndx"] in section_indices
+        ]
+
+
+def elf_function_offsets(objfile: str, section_name: str) -> List[Tuple[str, int]]:
+    """(name, offset) of the functions in the section of an object file, or
+    nothing if the file can't be read or doesn't have exactly one such section."""
+    from elftools.common.exceptions import ELFError
+    from elftools.elf.elffile import ELFFile
+
+    try:
+        with open(objfile, "rb") as f:
+            elf = ELFFile(f)
+            section_indices = [
+                i
+                for i, section in enumerate(elf.iter_sections())
+                if section.name == section_name
+            ]
+            symtab = elf.get_section_by_name(".symtab")
+            if symtab is None or len(section_indices) != 1:
+                return []
+            return [
+                (sym.name, sym["st_value"])
+                for sym in symtab.iter_symbols()
+                if sym["st_info"]["type"] == "STT_FUNC"
+                and sym["st_shndx"] == section_indices[0]
+            ]
+    except (OSError, ELFError):
+        return []
+
+
+def find_batch_jobs(
+    targets: List[str], config: Config, project: ProjectSettings
+) -> Dict[str, Optional[List[str]]]:
+    """Map object files to the functions to score in them (None for all)."""
+    jobs: Dict[str, Optional[List[str]]] = {}
+    for target in targets or [project.build_dir]:
+        if os.path.isdir(target):
+            for dirpath, _, filenames in os.walk(target):
+                for filename in sorted(filenames):
+                    if filename.endswith(".o"):
+                        jobs[os.path.join(dirpath, filename)] = None
+            continue
+        objfile, _ = search_map_file(target, project, config, for_binary=False)
+        if objfile is None:
+            fail(f"Not able to find .o file for function {target}.")
+        fn_names = jobs.setdefault(objfile, [])
+        if fn_names is not None:
+            fn_names.append(target)
+    return jobs
+
+
+batch_config: Config
+batch_project: ProjectSettings
+
+
+def init_batch_worker(config: Config, project: ProjectSettings) -> None:
+    global batch_config, batch_project
+    batch_config = config
+    batch_project = project
+
+
+def score_batch_object(job: Tuple[str, Optional[List[str]]]) -> List[Dict[str, Any]]:
+    """
+    Score the given functions of an object file against the expected one.
+    The objects are disassembled once for all of their functions.
+
+    Errors, including calls to fail(), are reported as "error" entries for the
+    functions, so that one object can't abort the whole batch.
+    """
+    objfile, fn_names = job
+    messages = io.StringIO()
+    try:
+        with contextlib.redirect_stderr(messages):
+            if fn_names is None:
+                fn_names = elf_function_symbols(objfile, batch_config.diff_section)
+            return score_batch_object_functions(objfile, fn_names)
+    except Exception as e:
+        error = str(e)
+    except SystemExit:
+        error = messages.getvalue().strip() or "failed"
+    finally:
+        sys.stderr.write(messages.getvalue())
+    if fn_names is None:
+        fn_names = [""]
+    return [{"object": objfile, "function": fn, "error": error} for fn in fn_names]
+
+
+def score_batch_object_functions(
+    objfile: str, fn_names: List[str]
+) -> List[Dict[str, Any]]:
+    config = batch_config
+    project = batch_project
+    refobjfile = expected_objfile(objfile, project)
+
+    def result(fn_name: str, **kwargs: Any) -> Dict[str, Any]:
+        return {"object": objfile, "function": fn_name, **kwargs}
+
+    if not os.path.isfile(refobjfile):
+        return [result(fn, error=f"{refobjfile} is not a file") for fn in fn_names]
+
+    if config.disassembler == "objdump":
+        flags = objfile_objdump_flags(config, project)
+        outputs = {}
+        for path in (refobjfile, objfile):
+            with open(path, "rb") as f:
+                obj_data = f.read()
+            outputs[path] = (obj_data, objdump_output(flags, path, config, project))
+
+    results = []
+    for fn_name in fn_names:
+        lines = []
+        for path in (refobjfile, objfile):
+            if config.disassembler == "objdump":
+                obj_data, out = outputs[path]
+                dump: Dump = preprocess_objdump_out(fn_name, obj_data, out, config)
+            else:
+                dump = disassemble_mips_elf(([], path, fn_name), config)
+            lines.append(process_dump(dump, config))
+        base_lines, my_lines = lines
+        if not base_lines:
+            results.append(result(fn_name, error=f"not found in {refobjfile}"))
+            continue
+        diff_output = do_diff(base_lines, my_lines, config)
+        results.append(
+            result(fn_name, score=diff_output.score, max_score=diff_output.max_score)
+        )
+    return results
+
+
+def run_batch(
+    targets: List[str],
+    n_jobs: Optional[int],
+    config: Config,
+    project: ProjectSettings,
+) -> None:
+    import multiprocessing
+
+    jobs = find_batch_jobs(targets, config, project)
+    with multiprocessing.Pool(
+        n_jobs, initializer=init_batch_worker, initargs=(config, project)
+    ) as pool:
+        results = [
+            result
+            for object_results in pool.imap(score_batch_object, jobs.items())
+            for result in object_results
+        ]
+    json.dump(
+        {"arch_str": config.arch.name, "functions": results}, sys.stdout, indent=2
+    )
+    print()
+
+
+def find_rom_functions(
+    config: Config, project: ProjectSettings, objects_dir: str
+) -> List[Tuple[str, int, int]]:
+    """
+    (name, ROM start, ROM end) of every function in the map file.
+
+    Static functions aren't in GNU maps, so the map alone would merge each of
+    them into the function before it. The input sections of objects that can
+    be found under `objects_dir` are therefore split using the function
+    symbols of the object, if pyelftools is installed.
+    """
+    if not project.mapfile:
+        fail("No map file configured; cannot find functions.")
+    if project.map_format != "gnu":
+        fail("--rom-report requires a GNU map file.")
+    index = load_map_index(project, config.diff_section) or MapIndex(
+        mtime_ns=0, size=0, symbols=None, has_load_address=False
+    )
+    if index.functions is None:
+        try:
+            parse_gnu_map(read_map_file(project), config.diff_section, index)
+        except Exception as e:
+            traceback.print_exc()
+            fail(f"Internal error while parsing map file")
+        save_map_index(index, project, config.diff_section)
+    assert index.functions is not None
+    if not index.has_load_address:
+        fail(
+            'Failed to find "load address" in map file. Maybe you need to add\n'
+            '"export LANG := C" to your Makefile to avoid localized output?'
+        )
+    assert index.sections is not None
+    functions = split_static_functions(
+        index.functions, index.sections, objects_dir, config.diff_section
+    )
+    offset = project.map_address_offset
+    return [(name, start + offset, end + offset) for name, start, end in functions]
+
+
+def split_static_functions(
+    functions: List[Tuple[str, int, int]],
+    sections: List[Tuple[str, int, int]],
+    objects_dir: str,
+    diff_section: str,
+) -> List[Tuple[str, int, int]]:
+    try:
+        import elftools
+    except ModuleNotFoundError:
+        return functions
+
+    starts = [start for _, start, _ in functions]
+    split_sections = []
+    new_functions = []
+    for objfile, section_start, section_end in sections:
+        symbols = elf_function_offsets(os.path.join(objects_dir, objfile), diff_section)
+        if not symbols:
+            continue
+        split_sections.append((section_start, section_end))
+        names = {}
+        i = bisect.bisect_left(starts, section_start)
+        while i < len(functions) and functions[i][1] < section_end:
+            names[functions[i][1]] = functions[i][0]
+            i += 1
+        for name, offset in symbols:
+            names.setdefault(section_start + offset, name)
+        fn_starts = sorted(start for start in names if start < section_end)
+        for start, end in zip(fn_starts, fn_starts[1:] + [section_end]):
+            new_functions.append((names[start], start, end))
+
+    split_sections.sort()
+    section_starts = [start for start, _ in split_sections]
+    for fn in functions:
+        i = bisect.bisect_right(section_starts, fn[1]) - 1
+        if i < 0 or fn[1] >= split_sections[i][1]:
+            new_functions.append(fn)
+    return sorted(new_functions, key=lambda f: f[1])
+
+
+@dataclass
+class RomFunction:
+    name: str
+    # ROM range in the built image
+    rom: int
+    end: int
+    # ROM range in the base image, None if the function isn't in the expected map
+    base_rom: Optional[int]
+    base_end: Optional[int]
+
+
+def pair_rom_functions(
+    functions: List[Tuple[str, int, int]],
+    base_functions: List[Tuple[str, int, int]],
+) -> List[RomFunction]:
+    """
+    Find the functions of the built image in the base image, by name. As
+    static functions of different files can share a name, the n-th function
+    with a given name is paired with the n-th one of the base image.
+    """
+    base_ranges: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+    for name, start, end in base_functions:
+        base_ranges[name].append((start, end))
+    seen: Dict[str, int] = defaultdict(int)
+    paired = []
+    for name, start, end in functions:
+        ranges = base_ranges.get(name, [])
+        i = seen[name]
+        seen[name] += 1
+        base_start, base_end = ranges[i] if i < len(ranges) else (None, None)
+        paired.append(RomFunction(name, start, end, base_start, base_end))
+    return paired
+
+
+# Size in bytes above which a run of adjacent functions is split into several
+# objdump invocations, so that the work is spread between the workers.
+ROM_CHUNK_SIZE = 0x8000
+
+
+def chunk_rom_functions(functions: List[RomFunction]) -> List[List[RomFunction]]:
+    """Group functions that are adjacent in both images, so that each side of a
+    chunk can be disassembled at once."""
+    chunks: List[List[RomFunction]] = []
+    for fn in functions:
+        if chunks and fn.base_rom is not None:
+            chunk = chunks[-1]
+            last = chunk[-1]
+            if (
+                last.end == fn.rom
+                and last.base_end == fn.base_rom
+                and fn.end - chunk[0].rom <= ROM_CHUNK_SIZE
+            ):
+                chunk.append(fn)
+                continue
+        chunks.append([fn])
+    return chunks
+
+
+def score_rom_chunk(chunk: List[RomFunction]) -> List[Dict[str, Any]]:
+    """
+    Score a run of adjacent functions of the ROM against the base image.
+    Each side is disassembled with a single objdump invocation, whose output
+    is then split at the function boundaries.
+
+    Errors, including calls to fail(), are reported as "error" entries for the
+    functions, like in score_batch_object.
+    """
+
+    def result(fn: RomFunction, **kwargs: Any) -> Dict[str, Any]:
+        return {"function": fn.name, "rom": fn.rom, **kwargs}
+
+    if chunk[0].base_rom is None:
+        return [result(fn, error="not found in the expected map") for fn in chunk]
+
+    messages = io.StringIO()
+    try:
+        with contextlib.redirect_stderr(messages):
+            return score_rom_chunk_functions(chunk, result)
+    except Exception as e:
+        error = str(e)
+    except SystemExit:
+        error = messages.getvalue().strip() or "failed"
+    finally:
+        sys.stderr.write(messages.getvalue())
+    return [result(fn, error=error) for fn in chunk]
+
+
+def score_rom_chunk_functions(
+    chunk: List[RomFunction], result: Callable[..., Dict[str, Any]]
+) -> List[Dict[str, Any]]:
+    config = batch_config
+    project = batch_project
+    binfile = config.file or project.myimg
+    assert binfile is not None and project.baseimg is not None
+
+    objdump_flags = ["-Dz", "-bbinary"]
+    objdump_flags.append("-EB" if config.arch.big_endian else "-EL")
+    lines = []
+    for target, starts, end_addr in (
+        (project.baseimg, [fn.base_rom for fn in chunk], chunk[-1].base_end),
+        (binfile, [fn.rom for fn in chunk], chunk[-1].end),
+    ):
+        flags = objdump_flags + [
+            f"--start-address={starts[0]}",
+            f"--stop-address={end_addr}",
+        ]
+        out = objdump_output(flags, target, config, project)
+        rows: List[List[str]] = [[] for _ in chunk]
+        for row in out.split("\n"):
+            m = re.match(r"\s*([0-9a-f]+):", row)
+            if m:
+                addr = int(m.group(1), 16)
+                rows[bisect.bisect_right(starts, addr) - 1].append(row)
+        lines.append([process("\n".join(fn_rows), config) for fn_rows in rows])
+
+    results = []
+    for fn, base_lines, my_lines in zip(chunk, *lines):
+        # Like the interactive diff, so that the scores are the same. Formatting
+        # the lines is also what fills in the symbol map used for scoring.
+        diff = do_diff(base_lines, my_lines, config)
+        results.append(result(fn, score=diff.score, max_score=diff.max_score))
+    return results
+
+
+def run_rom_report(
+    n_worst: int,
+    n_jobs: Optional[int],
+    json_output: bool,
+    config: Config,
+    project: ProjectSettings,
+) -> None:
+    import multiprocessing
+
+    binfile = config.file or project.myimg
+    if not project.baseimg or not binfile:
+        fail("Missing myimg/baseimg in config.")
+    if config.make:
+        run_make(binfile, project)
+    for path in (project.baseimg, binfile):
+        if not os.path.isfile(path):
+            fail(f"Not able to find binary file: {path}")
+
+    assert project.mapfile is not None
+    expected_mapfile = os.path.join(project.expected_dir, project.mapfile)
+    if not os.path.isfile(expected_mapfile):
+        fail(
+            f"Not able to find the map file of the base image: {expected_mapfile}\n"
+            "It is needed to locate the functions in the base image."
+        )
+    base_functions = find_rom_functions(
+        config, replace(project, mapfile=expected_mapfile), project.expected_dir
+    )
+    functions = pair_rom_functions(
+        find_rom_functions(config, project, ""), base_functions
+    )
+    chunks = chunk_rom_functions(functions)
+    with multiprocessing.Pool(
+        n_jobs, initializer=init_batch_worker, initargs=(config, project)
+    ) as pool:
+        results = [
+            result
+            for chunk_results in pool.imap_unordered(score_rom_chunk, chunks)
+            for result in chunk_results
+        ]
+
+    errors = [result for result in results if "error" in result]
+    scored = [result for result in results if "error" not in result]
+    scored.sort(key=lambda result: (-result["score"], result["rom"]))
+    num_differing = sum(1 for result in scored if result["score"] != 0)
+    if n_worst > 0:
+        scored = scored[:n_worst]
+
+    if json_output:
+        json.dump(
+            {
+                "arch_str": config.arch.name,
+                "num_functions": len(results),
+                "num_differing": num_differing,
+                "functions": scored + errors,
+            },
+            sys.stdout,
+            indent=2,
+        )
+        print()
+        return
+
+    print(f"{num_differing} of {len(results)} functions differ.")
+    if scored and scored[0]["score"] != 0:
+        print()
+        print(f"{'SCORE':>8} {'MAX':>8} {'PCT':>7}  {'ROM':8}  FUNCTION")
+        for result in scored:
+            if result["score"] == 0:
+                break
+            score, max_score = result["score"], result["max_score"]
+            pct = 100 * score / max_score if max_score else 100.0
+            print(
+                f"{score:>8} {max_score:>8} {pct:>6.1f}%  {result['rom']:08X}  "
+                f"{result['function']}"
+            )
+    for result in errors:
+        print(f"{result['function']}: error: {result['error']}", file=sys.stderr)
+
+
 def main() -> None:
     args = parser.parse_args()
 
@@ -3673,6 +5118,34 @@ def main() -> None:
     ):
         fail("Threeway diffing requires -w.")
 
+    if args.format == "jsonl" and args.watch:
+        fail("--format=jsonl can't be used with -w.")
+
+    if args.batch is not None:
+        if not config.diff_obj:
+            fail("--batch requires -o")
+        try:
+            import elftools
+        except ModuleNotFoundError as e:
+            fail(MISSING_PREREQUISITES.format(e.name))
+        run_batch(args.batch, args.batch_jobs, config, project)
+        return
+
+    if args.rom_report is not None:
+        if config.diff_obj or args.diff_elf_symbol:
+            fail("--rom-report can't be used with -o or -e")
+        run_rom_report(
+            args.rom_report,
+            args.batch_jobs,
+            args.format == "json",
+            config,
+            project,
+        )
+        return
+
+    if args.start is None:
+        parser.error("the following arguments are required: start")
+
     if args.diff_elf_symbol:
         make_target, basecmd, mycmd = dump_elf(
             args.start, args.end, args.diff_elf_symbol, config, project
@@ -3688,6 +5161,18 @@ def main() -> None:
     if map_build_target_fn:
         make_target = map_build_target_fn(make_target=make_target)
 
+    if config.disassembler != "objdump" and (
+        args.write_asm is not None or args.base_asm is not None
+    ):
+        fail("--write-asm and --base-asm require --disassembler=objdump")
+
+    if config.disassembler == "rabbitizer":
+        try:
+            import rabbitizer
+            import elftools
+        except ModuleNotFoundError as e:
+            fail(MISSING_PREREQUISITES.format(e.name))
+
     if args.write_asm is not None:
         mydump = run_objdump(mycmd, config, project)
         with open(args.write_asm, "w") as f:
@@ -3699,15 +5184,28 @@ def main() -> None:
         with open(args.base_asm) as f:
             basedump = f.read()
     elif config.diff_mode != DiffMode.SINGLE:
-        basedump = run_objdump(basecmd, config, project)
+        basedump = run_base_disassembler(basecmd, config, project, args.base_cache)
     else:
         basedump = ""
 
-    mydump = run_objdump(mycmd, config, project)
+    mydump = run_disassembler(mycmd, config, project)
 
     display = Display(basedump, mydump, config)
 
-    if args.no_pager or args.format in ("html", "json"):
+    if args.format == "jsonl":
+        if args.output_socket is None:
+            display.run_stream(sys.stdout)
+        else:
+            import socket
+
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(args.output_socket)
+            except OSError as e:
+                fail(f"Failed to connect to {args.output_socket}: {e}")
+            with sock, sock.makefile("w", encoding="utf-8") as out:
+                display.run_stream(out)
+    elif args.no_pager or args.format in ("html", "json"):
         print(display.run_diff()[0])
     elif not args.watch:
         display.run_sync()
@@ -3753,7 +5251,7 @@ def main() -> None:
                             error=True,
                         )
                         continue
-                mydump = run_objdump(mycmd, config, project)
+                mydump = run_disassembler(mycmd, config, project)
                 display.update(mydump, error=False)
         except KeyboardInterrupt:
             display.terminate()
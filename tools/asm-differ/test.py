@@ -1,6 +1,8 @@
 import unittest
 import diff
 import json
+import random
+import time
 
 
 class TestSh2(unittest.TestCase):
@@ -185,5 +187,84 @@ class TestSh2(unittest.TestCase):
         print(loaded["rows"][2]["base"]["text"][1]["key"] == "10")
 
 
+class TestIncrementalAlignment(unittest.TestCase):
+    def check_opcodes(
+        self,
+        opcodes: list,
+        seq1: list,
+        seq2: list,
+    ) -> None:
+        i, j = 0, 0
+        for tag, i1, i2, j1, j2 in opcodes:
+            assert (i1, j1) == (i, j)
+            if tag == "equal":
+                assert seq1[i1:i2] == seq2[j1:j2]
+            i, j = i2, j2
+        assert (i, j) == (len(seq1), len(seq2))
+
+    def test_unchanged_prefix_and_suffix(self) -> None:
+        base = ["addiu", "sw", "lw", "jal", "nop", "lw", "jr", "addiu"]
+        old = ["addiu", "sw", "lw", "lw", "jal", "nop", "lw", "jr", "addiu"]
+        new = ["addiu", "sw", "lw", "jal", "nop", "lw", "jr", "addiu"]
+
+        for algorithm in ("levenshtein", "difflib"):
+            cache = diff.AlignmentCache()
+            old_opcodes = diff.diff_sequences_incremental(base, old, algorithm, cache)
+            self.check_opcodes(old_opcodes, base, old)
+
+            # Aligning the same sequence again reuses the previous result
+            assert (
+                diff.diff_sequences_incremental(base, old, algorithm, cache)
+                is old_opcodes
+            )
+
+            new_opcodes = diff.diff_sequences_incremental(base, new, algorithm, cache)
+            self.check_opcodes(new_opcodes, base, new)
+            assert all(tag == "equal" for tag, *_ in new_opcodes)
+
+
+class TestMyers(unittest.TestCase):
+    def test_opcodes(self) -> None:
+        seq1 = ["lui", "addiu", "lw", "jal", "nop", "lw", "jr", "addiu"]
+        seq2 = ["lui", "lw", "addiu", "jal", "sw", "lw", "jr", "addiu"]
+        assert diff.diff_sequences(seq1, seq2, "myers") == [
+            ("equal", 0, 1, 0, 1),
+            ("delete", 1, 2, 1, 1),
+            ("equal", 2, 3, 1, 2),
+            ("insert", 3, 3, 2, 3),
+            ("equal", 3, 4, 3, 4),
+            ("replace", 4, 5, 4, 5),
+            ("equal", 5, 8, 5, 8),
+        ]
+
+    def test_many_distinct_mnemonics(self) -> None:
+        # More distinct elements than chr() can map
+        seq1 = [str(i) for i in range(0x110001)]
+        seq2 = seq1[1:] + ["x"]
+        opcodes = diff.diff_sequences(seq1, seq2, "myers")
+        assert opcodes == [
+            ("delete", 0, 1, 0, 0),
+            ("equal", 1, 0x110001, 0, 0x110000),
+            ("insert", 0x110001, 0x110001, 0x110000, 0x110001),
+        ]
+
+    def test_reordered_faster_than_difflib(self) -> None:
+        # A function whose basic blocks were shuffled, which is the slow case
+        # for Myers' algorithm on its own
+        rng = random.Random(0)
+        mnemonics = ["lui", "addiu", "lw", "sw", "jal", "nop", "jr", "beq", "or"]
+        seq1 = [rng.choice(mnemonics) for _ in range(6000)]
+        blocks = [seq1[i : i + 20] for i in range(0, len(seq1), 20)]
+        rng.shuffle(blocks)
+        seq2 = [mnemonic for block in blocks for mnemonic in block]
+
+        def run(algorithm: str) -> float:
+            start = time.perf_counter()
+            diff.diff_sequences(seq1, seq2, algorithm)
+            return time.perf_counter() - start
+
+        assert run("myers") < run("difflib") / 4
+
+
 if __name__ == "__main__":
     unittest.main()
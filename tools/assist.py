@@ -5,6 +5,8 @@ import os
 import sys
 from collections import OrderedDict
 
+from rom import Rom
+
 gAddressWidth = 18 # if your ld >= 2.40 change this to 10
 
 script_dir = os.path.dirname(os.path.realpath(__file__))
@@ -13,8 +15,7 @@ asm_dir = root_dir + "asm/non_matchings/overlays/actors"
 build_dir = root_dir + "build/gc-eu-mq-dbg/"
 
 def read_rom():
-    with open("baseroms/gc-eu-mq-dbg/baserom-decompressed.z64", "rb") as f:
-        return f.read()
+    return Rom("baseroms/gc-eu-mq-dbg/baserom-decompressed.z64")
 
 
 def find_dir(query):
@@ -161,17 +162,18 @@ parser.add_argument("--num-out", help="number of functions to display", type=int
 
 args = parser.parse_args()
 
-rom_bytes = read_rom()
-map_syms = parse_map(build_dir + "oot-gc-eu-mq-dbg.map")
-map_offsets = get_map_offsets(map_syms)
+with read_rom() as rom:
+    rom_bytes = rom.data
+    map_syms = parse_map(build_dir + "oot-gc-eu-mq-dbg.map")
+    map_offsets = get_map_offsets(map_syms)
 
-s_files = get_all_s_files()
+    s_files = get_all_s_files()
 
-query_dir = find_dir(args.query)
+    query_dir = find_dir(args.query)
 
-if query_dir is not None:
-    files = os.listdir(query_dir)
-    for f_name in files:
-        do_query(f_name[:-2])
-else:
-    do_query(args.query)
+    if query_dir is not None:
+        files = os.listdir(query_dir)
+        for f_name in files:
+            do_query(f_name[:-2])
+    else:
+        do_query(args.query)
@@ -0,0 +1,61 @@
+# SPDX-FileCopyrightText: © 2024 ZeldaRET
+# SPDX-License-Identifier: CC0-1.0
+
+from __future__ import annotations
+
+import multiprocessing.pool
+import queue
+from typing import Any, Callable, Generic, Iterable, Iterator, TypeVar
+
+
+T = TypeVar("T")
+
+
+class CompletionQueue(Generic[T]):
+    """
+    Submits jobs to a `multiprocessing.Pool` and hands them back in the order
+    they complete, without polling.
+
+    Each job is submitted with a tag, which is what `as_completed` yields once
+    the job is done (successfully or not). The `AsyncResult` returned by
+    `submit` is ready by the time its tag is yielded, so `get()` on it doesn't
+    block (but raises if the job raised).
+    """
+
+    def __init__(self, pool: multiprocessing.pool.Pool):
+        self.pool = pool
+        self.pending = 0
+        self.completed: queue.SimpleQueue[T] = queue.SimpleQueue()
+
+    def submit(
+        self, func: Callable[..., Any], args: Iterable[Any], tag: T
+    ) -> multiprocessing.pool.AsyncResult:
+        # The callbacks run in the pool's result handler thread
+        def on_completion(_):
+            self.completed.put(tag)
+
+        self.pending += 1
+        return self.pool.apply_async(
+            func,
+            tuple(args),
+            callback=on_completion,
+            error_callback=on_completion,
+        )
+
+    def __len__(self):
+        return self.pending
+
+    def wait(self) -> T:
+        """Block until a job completes and return its tag."""
+        assert self.pending > 0
+        tag = self.completed.get()
+        self.pending -= 1
+        return tag
+
+    def as_completed(self) -> Iterator[T]:
+        """
+        Yield tags of jobs as they complete, until no job is pending.
+        Jobs may be submitted while iterating.
+        """
+        while self.pending > 0:
+            yield self.wait()
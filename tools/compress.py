@@ -8,13 +8,18 @@ from __future__ import annotations
 import argparse
 from pathlib import Path
 import dataclasses
-import time
+import hashlib
+import io
+import os
 import multiprocessing
 import multiprocessing.pool
+from typing import BinaryIO
 
 import crunch64
 
+from completion_queue import CompletionQueue
 import dmadata
+from rom import Rom
 
 
 COMPRESSION_METHODS = {
@@ -23,6 +28,11 @@ COMPRESSION_METHODS = {
 }
 
 
+# How many segments per thread may be compressing at once when streaming the
+# compressed rom, which bounds how much uncompressed data is copied out at once
+IN_FLIGHT_SEGMENTS_PER_THREAD = 4
+
+
 def align(v: int):
     v += 0xF
     return v // 0x10 * 0x10
@@ -36,12 +46,65 @@ class RomSegment:
     is_syms: bool
     data: memoryview | None
     data_async: multiprocessing.pool.AsyncResult | None
+    cache_key: str | None = None
+    uncompressed_data: memoryview | None = None
+    submitted: bool = False
+    # In the cache, read only when it is time to write the segment
+    cached: bool = False
 
     @property
     def uncompressed_size(self):
         return self.vrom_end - self.vrom_start
 
 
+class CompressionCache:
+    """
+    On-disk cache of compressed segments.
+
+    Entries are keyed by a hash of the compression format and the uncompressed
+    segment data, so a segment only needs to be compressed again if its
+    contents changed.
+    """
+
+    def __init__(self, cache_dir: Path, compression_format: str):
+        self.cache_dir = cache_dir
+        self.compression_format = compression_format
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, data: memoryview) -> str:
+        h = hashlib.sha256()
+        h.update(self.compression_format.encode())
+        h.update(b"\0")
+        h.update(data)
+        return h.hexdigest()
+
+    def path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / key
+
+    def has(self, key: str) -> bool:
+        if self.path(key).is_file():
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def get(self, key: str) -> bytes | None:
+        try:
+            return self.path(key).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, data: bytes):
+        path = self.path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first so that an interrupted write never
+        # leaves a truncated entry in the cache
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+
+
 # Make interrupting the compression with ^C less jank
 # https://stackoverflow.com/questions/72967793/keyboardinterrupt-with-python-multiprocessing-pool
 def set_sigint_ignored():
@@ -58,6 +121,8 @@ def compress_rom(
     pad_to_multiple_of: int,
     fill_padding_bytes: bool,
     n_threads: int = None,
+    cache: CompressionCache | None = None,
+    out_file: BinaryIO | None = None,
 ):
     """
     rom_data: the uncompressed rom data
@@ -67,6 +132,11 @@ def compress_rom(
     pad_to_multiple_of: pad the compressed rom to a multiple of this size, in bytes
     fill_padding_bytes: fill the padding bytes with a 0x00 0x01 0x02 ... pattern instead of zeros
     n_threads: how many cores to use for compression
+    cache: if set, reuse compressed segments from this cache and store newly compressed ones in it
+    out_file: if set, stream the compressed rom to this seekable file instead of
+        building it in memory, and return None
+
+    Returns the compressed rom data, unless `out_file` is set.
     """
 
     # Compression function
@@ -75,112 +145,87 @@ def compress_rom(
     # Segments of the compressed rom (not all are compressed)
     compressed_rom_segments: list[RomSegment] = []
 
-    dma_entries = dmadata.read_dmadata(rom_data, dmadata_start)
+    dma_table = dmadata.DmaTable.from_bin(rom_data, dmadata_start)
     # We sort the DMA entries by ROM start because `compress_entries_indices`
     # refers to indices in ROM order, but the uncompressed dmadata might not be
     # in ROM order.
-    dma_entries.sort(key=lambda dma_entry: dma_entry.vrom_start)
-
-    with multiprocessing.Pool(n_threads, initializer=set_sigint_ignored) as p:
-        # Extract each segment from the input rom
-        for entry_index, dma_entry in enumerate(dma_entries):
-            segment_rom_start = dma_entry.rom_start
-            segment_rom_end = dma_entry.rom_start + (
-                dma_entry.vrom_end - dma_entry.vrom_start
-            )
-            segment_data_uncompressed = rom_data[segment_rom_start:segment_rom_end]
-
-            is_compressed = entry_index in compress_entries_indices
-
-            if is_compressed:
-                segment_data = None
-                segment_data_async = p.apply_async(
-                    compress,
-                    (bytes(segment_data_uncompressed),),
-                )
-            else:
-                segment_data = segment_data_uncompressed
-                segment_data_async = None
-
-            compressed_rom_segments.append(
-                RomSegment(
-                    dma_entry.vrom_start,
-                    dma_entry.vrom_end,
-                    is_compressed,
-                    dma_entry.is_syms(),
-                    segment_data,
-                    segment_data_async,
-                )
-            )
+    dma_entries = [dma_table[i] for i in dma_table.vrom_order()]
 
-        # Wait on compression of all compressed segments
-        waiting_on_segments = [
-            segment for segment in compressed_rom_segments if segment.is_compressed
-        ]
-        total_uncompressed_size_of_data_to_compress = sum(
-            segment.uncompressed_size for segment in waiting_on_segments
+    # Extract each segment from the input rom
+    for entry_index, dma_entry in enumerate(dma_entries):
+        segment_rom_start = dma_entry.rom_start
+        segment_rom_end = dma_entry.rom_start + (
+            dma_entry.vrom_end - dma_entry.vrom_start
         )
-        uncompressed_size_of_data_compressed_so_far = 0
-        while waiting_on_segments:
-            # Show progress
-            progress = (
-                uncompressed_size_of_data_compressed_so_far
-                / total_uncompressed_size_of_data_to_compress
-            )
-            print(f"Compressing... {progress * 100:.1f}%", end="\r")
+        segment_data_uncompressed = rom_data[segment_rom_start:segment_rom_end]
 
-            # The segments for which the compression is not finished yet are
-            # added to this list
-            still_waiting_on_segments = []
-            got_some_results = False
-            for segment in waiting_on_segments:
-                assert segment.data is None
-                assert segment.data_async is not None
-
-                try:
-                    compressed_data = segment.data_async.get(0)
-                except multiprocessing.TimeoutError:
-                    # Compression not finished yet
-                    still_waiting_on_segments.append(segment)
-                else:
-                    # Compression finished!
-                    assert isinstance(compressed_data, bytes)
-                    segment.data = memoryview(compressed_data)
-                    uncompressed_size_of_data_compressed_so_far += (
-                        segment.uncompressed_size
-                    )
-                    got_some_results = True
-                    segment.data_async = None
+        is_compressed = entry_index in compress_entries_indices
+        cache_key = None
+        cached = False
 
-            if not got_some_results and still_waiting_on_segments:
-                # Nothing happened this wait iteration, idle a bit
-                time.sleep(0.010)
+        if is_compressed:
+            segment_data = None
+            if cache is not None:
+                cache_key = cache.key(segment_data_uncompressed)
+                cached = cache.has(cache_key)
+        else:
+            segment_data = segment_data_uncompressed
+
+        compressed_rom_segments.append(
+            RomSegment(
+                dma_entry.vrom_start,
+                dma_entry.vrom_end,
+                is_compressed,
+                dma_entry.is_syms(),
+                segment_data,
+                None,
+                cache_key,
+                # Compressed segments keep a view of their uncompressed data,
+                # copied out only on submission
+                segment_data_uncompressed if segment_data is None else None,
+                cached=cached,
+            )
+        )
 
-            waiting_on_segments = still_waiting_on_segments
+    if cache is not None:
+        print(f"Compression cache: {cache.hits} hits, {cache.misses} misses")
 
-    print("Putting together the compressed rom...")
-
-    # Put together the compressed rom
-    compressed_rom_size = sum(
-        align(len(segment.data)) for segment in compressed_rom_segments
+    segments_to_compress = [
+        segment
+        for segment in compressed_rom_segments
+        if segment.data is None and not segment.cached
+    ]
+    total_uncompressed_size_of_data_to_compress = sum(
+        segment.uncompressed_size for segment in segments_to_compress
     )
-    compressed_rom_size_padded = (
-        (compressed_rom_size + pad_to_multiple_of - 1)
-        // pad_to_multiple_of
-        * pad_to_multiple_of
-    )
-    compressed_rom_data = memoryview(bytearray(compressed_rom_size_padded))
+    uncompressed_size_of_data_compressed_so_far = 0
+
+    if out_file is None:
+        # Build the rom in memory
+        out = io.BytesIO()
+        # Compress everything upfront
+        max_in_flight = len(segments_to_compress)
+    else:
+        out = out_file
+        out.seek(0)
+        out.truncate()
+        # Only keep a few segments per thread compressing or waiting to be
+        # written, so that memory usage stays bounded
+        max_in_flight = IN_FLIGHT_SEGMENTS_PER_THREAD * (n_threads or os.cpu_count())
+
     compressed_rom_dma_entries: list[dmadata.DmaEntry] = []
     rom_offset = 0
-    for segment in compressed_rom_segments:
-        assert segment.data is not None
+
+    def write_segment(segment: RomSegment):
+        nonlocal rom_offset
 
         segment_rom_start = rom_offset
         segment_rom_end = align(segment_rom_start + len(segment.data))
 
-        i = segment_rom_start + len(segment.data)
-        assert i <= len(compressed_rom_data)
-        compressed_rom_data[segment_rom_start:i] = segment.data
+        out.write(segment.data)
+        out.write(bytes(segment_rom_end - (segment_rom_start + len(segment.data))))
+        # Release the segment data as soon as it is written
+        segment.data = None
 
         rom_offset = segment_rom_end
 
@@ -199,19 +244,129 @@ def compress_rom(
             )
         )
 
-    assert rom_offset == compressed_rom_size
+    with multiprocessing.Pool(n_threads, initializer=set_sigint_ignored) as p:
+        completion_queue: CompletionQueue[RomSegment] = CompletionQueue(p)
+        written_segments_count = 0
+
+        # Submit the largest segments first, so that the few huge segments
+        # don't start late and end up dominating the tail of the compression
+        submission_order = sorted(
+            segments_to_compress,
+            key=lambda segment: segment.uncompressed_size,
+            reverse=True,
+        )
+        submission_order_index = 0
+        # Segments submitted for compression that haven't been written yet,
+        # whether they are still compressing or done and waiting for their turn
+        unwritten_submitted_count = 0
+
+        def submit_segment(segment: RomSegment):
+            nonlocal unwritten_submitted_count
+            unwritten_submitted_count += 1
+            segment.submitted = True
+            segment.data_async = completion_queue.submit(
+                compress,
+                (bytes(segment.uncompressed_data),),
+                segment,
+            )
+            segment.uncompressed_data = None
+
+        def submit_segments():
+            nonlocal submission_order_index
+            # Always submit the next segment to write, so that writing out the
+            # rom is never stuck waiting on a segment that isn't compressing
+            if written_segments_count < len(compressed_rom_segments):
+                segment = compressed_rom_segments[written_segments_count]
+                if segment.uncompressed_data is not None and not segment.cached:
+                    submit_segment(segment)
+            while (
+                submission_order_index < len(submission_order)
+                and unwritten_submitted_count < max_in_flight
+            ):
+                segment = submission_order[submission_order_index]
+                submission_order_index += 1
+                # Skip segments already submitted as the next segment to write
+                if segment.uncompressed_data is not None:
+                    submit_segment(segment)
+
+        def read_cached_segment(segment: RomSegment):
+            assert cache is not None and segment.cache_key is not None
+            compressed_data = cache.get(segment.cache_key)
+            if compressed_data is None:
+                # The entry was removed from the cache since it was looked up
+                compressed_data = compress(bytes(segment.uncompressed_data))
+            segment.data = memoryview(compressed_data)
+            segment.uncompressed_data = None
+
+        def write_ready_segments():
+            # Write segments in ROM order, up to the first one still being
+            # compressed. Segments that finish compressing early are held until
+            # their turn.
+            nonlocal written_segments_count
+            nonlocal unwritten_submitted_count
+            while written_segments_count < len(compressed_rom_segments):
+                segment = compressed_rom_segments[written_segments_count]
+                if segment.data is None and segment.cached:
+                    read_cached_segment(segment)
+                if segment.data is None:
+                    break
+                if segment.submitted:
+                    unwritten_submitted_count -= 1
+                write_segment(segment)
+                written_segments_count += 1
+
+        write_ready_segments()
+        submit_segments()
+
+        # Handle each compressed segment as soon as it is done
+        for segment in completion_queue.as_completed():
+            compressed_data = segment.data_async.get()
+            assert isinstance(compressed_data, bytes)
+            segment.data = memoryview(compressed_data)
+            segment.data_async = None
+            if cache is not None:
+                cache.put(segment.cache_key, compressed_data)
+            uncompressed_size_of_data_compressed_so_far += segment.uncompressed_size
+
+            # Show progress
+            progress = (
+                uncompressed_size_of_data_compressed_so_far
+                / total_uncompressed_size_of_data_to_compress
+            )
+            print(f"Compressing... {progress * 100:.1f}%", end="\r")
+
+            write_ready_segments()
+            submit_segments()
+
+        assert written_segments_count == len(compressed_rom_segments)
+
+    print("Putting together the compressed rom...")
+
+    compressed_rom_size = rom_offset
+    compressed_rom_size_padded = (
+        (compressed_rom_size + pad_to_multiple_of - 1)
+        // pad_to_multiple_of
+        * pad_to_multiple_of
+    )
     if fill_padding_bytes:
         # Pad the compressed rom with the pattern matching the baseroms
-        for i in range(compressed_rom_size, compressed_rom_size_padded):
-            compressed_rom_data[i] = i % 256
+        padding = bytes(i % 256 for i in range(256))
+        i = compressed_rom_size
+        while i < compressed_rom_size_padded:
+            chunk_size = min(256 - i % 256, compressed_rom_size_padded - i)
+            out.write(padding[i % 256 : i % 256 + chunk_size])
+            i += chunk_size
+    else:
+        out.write(bytes(compressed_rom_size_padded - compressed_rom_size))
 
-    # Write the new dmadata
-    offset = dmadata_start
-    for dma_entry in compressed_rom_dma_entries:
-        dma_entry.to_bin(compressed_rom_data[offset:])
-        offset += dmadata.DmaEntry.SIZE_BYTES
+    # Patch in the new dmadata
+    out.seek(dmadata_start)
+    out.write(dmadata.DmaTable.from_entries(compressed_rom_dma_entries).to_bin())
+    out.seek(0, io.SEEK_END)
 
-    return compressed_rom_data
+    if out_file is None:
+        return out.getbuffer()
+    return None
 
 
 def main():
@@ -274,6 +429,18 @@ def main():
         default=1,
         help="how many cores to use for parallel compression",
     )
+    parser.add_argument(
+        "--cache-dir",
+        dest="cache_dir",
+        type=Path,
+        help="directory in which to cache compressed segments, to skip compressing unchanged segments again",
+    )
+    parser.add_argument(
+        "--in-memory",
+        dest="in_memory",
+        action="store_true",
+        help="build the whole compressed rom in memory before writing it out, instead of streaming it to the output file",
+    )
     args = parser.parse_args()
 
     in_rom_p = Path(args.in_rom)
@@ -308,17 +475,45 @@ def main():
     fill_padding_bytes = args.fill_padding_bytes
     n_threads = args.n_threads
 
-    in_rom_data = in_rom_p.read_bytes()
-    out_rom_data = compress_rom(
-        memoryview(in_rom_data),
-        dmadata_start,
-        compress_entries_indices,
-        compression_format,
-        pad_to_multiple_of,
-        fill_padding_bytes,
-        n_threads,
-    )
-    out_rom_p.write_bytes(out_rom_data)
+    if args.cache_dir is not None:
+        cache = CompressionCache(args.cache_dir, compression_format)
+    else:
+        cache = None
+
+    with Rom(in_rom_p) as in_rom:
+        if args.in_memory:
+            out_rom_data = compress_rom(
+                in_rom.data,
+                dmadata_start,
+                compress_entries_indices,
+                compression_format,
+                pad_to_multiple_of,
+                fill_padding_bytes,
+                n_threads,
+                cache,
+            )
+            out_rom_p.write_bytes(out_rom_data)
+        else:
+            # Stream to a temporary file next to the output and only replace the
+            # output once done, so that a failed or interrupted run doesn't leave
+            # behind a truncated rom that make would consider up to date
+            tmp_rom_p = out_rom_p.with_name(f"{out_rom_p.name}.tmp")
+            try:
+                with tmp_rom_p.open("wb") as out_rom_f:
+                    compress_rom(
+                        in_rom.data,
+                        dmadata_start,
+                        compress_entries_indices,
+                        compression_format,
+                        pad_to_multiple_of,
+                        fill_padding_bytes,
+                        n_threads,
+                        cache,
+                        out_rom_f,
+                    )
+                os.replace(tmp_rom_p, out_rom_p)
+            finally:
+                tmp_rom_p.unlink(missing_ok=True)
 
 
 if __name__ == "__main__":
@@ -7,7 +7,7 @@ from __future__ import annotations
 
 import argparse
 import hashlib
-import io
+import multiprocessing
 from pathlib import Path
 import struct
 from typing import Iterable
@@ -17,6 +17,7 @@ import ipl3checksum
 import zlib
 
 import dmadata
+from rom import Rom
 import version_config
 
 
@@ -42,63 +43,94 @@ def round_up(n, shift):
     return (n + mod - 1) >> shift << shift
 
 
-def update_crc(decompressed: io.BytesIO, is_ique: bool) -> io.BytesIO:
+def update_crc(decompressed: bytearray, is_ique: bool) -> bytearray:
     print("Recalculating crc...")
     if is_ique:
         cic_kind = ipl3checksum.CICKind.CIC_6102_7101
     else:
         cic_kind = ipl3checksum.CICKind.CIC_X105
-    calculated_checksum = cic_kind.calculateChecksum(bytes(decompressed.getbuffer()))
-    new_crc = struct.pack(f">II", calculated_checksum[0], calculated_checksum[1])
-
-    decompressed.seek(0x10)
-    decompressed.write(new_crc)
+    calculated_checksum = cic_kind.calculateChecksum(bytes(decompressed))
+    struct.pack_into(
+        f">II", decompressed, 0x10, calculated_checksum[0], calculated_checksum[1]
+    )
     return decompressed
 
 
+def decompress_worker(args: tuple[int, bytes, bool]) -> tuple[int, bytes]:
+    vrom_start, data, is_ique = args
+    return vrom_start, decompress(data, is_ique)
+
+
 def decompress_rom(
     file_content: bytearray,
     dmadata_start: int,
     dma_entries: list[dmadata.DmaEntry],
     is_ique: bool,
+    n_threads: int = 1,
 ) -> bytearray:
-    rom_segments = {}  # vrom start : data s.t. len(data) == vrom_end - vrom_start
     new_dmadata = []  # new dmadata: list[dmadata.Entry]
+    compressed_entries = []  # dma entries of the segments to decompress
 
-    decompressed = io.BytesIO(b"")
+    # Preallocate the decompressed rom, large enough for every segment, the
+    # new dmadata and the padding
+    padding_start = dma_entries[-1].vrom_end
+    padding_end = round_up(padding_start, 12)
+    decompressed_size = max(
+        max(dma_entry.vrom_end for dma_entry in dma_entries),
+        dmadata_start + len(dma_entries) * dmadata.DmaEntry.SIZE_BYTES,
+        padding_end,
+    )
+    decompressed = bytearray(decompressed_size)
+    file_content_view = memoryview(file_content)
 
+    def write_segment(vrom_start: int, data: bytes | memoryview):
+        vrom_end = vrom_start + len(data)
+        if vrom_end > len(decompressed):
+            decompressed.extend(bytes(vrom_end - len(decompressed)))
+        decompressed[vrom_start:vrom_end] = data
+
+    # write uncompressed rom segments to vaddrs
     for dma_entry in dma_entries:
         v_start = dma_entry.vrom_start
         v_end = dma_entry.vrom_end
         p_start = dma_entry.rom_start
-        p_end = dma_entry.rom_end
         if dma_entry.is_syms():
             new_dmadata.append(dma_entry)
             continue
         if dma_entry.is_compressed():
-            new_contents = decompress(file_content[p_start:p_end], is_ique)
-            rom_segments[v_start] = new_contents
+            compressed_entries.append(dma_entry)
         else:
-            rom_segments[v_start] = file_content[p_start : p_start + v_end - v_start]
+            write_segment(
+                v_start, file_content_view[p_start : p_start + v_end - v_start]
+            )
         new_dmadata.append(dmadata.DmaEntry(v_start, v_end, v_start, 0))
 
-    # write rom segments to vaddrs
-    for vrom_st, data in rom_segments.items():
-        decompressed.seek(vrom_st)
-        decompressed.write(data)
+    # decompress the compressed rom segments and write them to vaddrs
+    decompress_args = (
+        (
+            dma_entry.vrom_start,
+            bytes(file_content_view[dma_entry.rom_start : dma_entry.rom_end]),
+            is_ique,
+        )
+        for dma_entry in compressed_entries
+    )
+    if n_threads > 1:
+        with multiprocessing.Pool(n_threads) as p:
+            for vrom_start, data in p.imap_unordered(
+                decompress_worker, decompress_args, chunksize=8
+            ):
+                write_segment(vrom_start, data)
+    else:
+        for vrom_start, data in map(decompress_worker, decompress_args):
+            write_segment(vrom_start, data)
+
     # write new dmadata
-    decompressed.seek(dmadata_start)
-    for dma_entry in new_dmadata:
-        entry_data = bytearray(dmadata.DmaEntry.SIZE_BYTES)
-        dma_entry.to_bin(entry_data)
-        decompressed.write(entry_data)
+    new_dmadata_bin = dmadata.DmaTable.from_entries(new_dmadata).to_bin()
+    decompressed[dmadata_start : dmadata_start + len(new_dmadata_bin)] = new_dmadata_bin
     # pad to size
-    padding_start = dma_entries[-1].vrom_end
-    padding_end = round_up(padding_start, 12)
-    decompressed.seek(padding_start)
-    decompressed.write(b"\x00" * (padding_end - padding_start))
+    decompressed[padding_start:padding_end] = bytes(padding_end - padding_start)
     # re-calculate crc
-    return bytearray(update_crc(decompressed, is_ique).getbuffer())
+    return update_crc(decompressed, is_ique)
 
 
 def get_str_hash(byte_array):
@@ -108,8 +140,9 @@ def get_str_hash(byte_array):
 def check_existing_rom(rom_path: Path, correct_str_hashes: Iterable[str]):
     # If the baserom exists and is correct, we don't need to change anything
     if rom_path.exists():
-        if get_str_hash(rom_path.read_bytes()) in correct_str_hashes:
-            return True
+        with Rom(rom_path) as rom:
+            if get_str_hash(rom.data) in correct_str_hashes:
+                return True
     return False
 
 
@@ -165,6 +198,13 @@ def main():
         "version",
         help="Version of the game to decompress.",
     )
+    parser.add_argument(
+        "--threads",
+        dest="n_threads",
+        type=int,
+        default=1,
+        help="how many cores to use for parallel decompression",
+    )
 
     args = parser.parse_args()
 
@@ -207,7 +247,8 @@ def main():
     # Read in the original ROM
     print(f"File '{rom_file_name}' found.")
 
-    file_content = bytearray(rom_file_name.read_bytes())
+    with Rom(rom_file_name) as rom:
+        file_content = bytearray(rom.data)
 
     # Check if ROM needs to be byte/word swapped
     # Little-endian
@@ -250,7 +291,9 @@ def main():
     if any(dma_entry.is_compressed() for dma_entry in dma_entries):
         print("Decompressing rom...")
         is_ique = version.startswith("ique-")
-        file_content = decompress_rom(file_content, dmadata_start, dma_entries, is_ique)
+        file_content = decompress_rom(
+            file_content, dmadata_start, dma_entries, is_ique, args.n_threads
+        )
 
     # Double check the hash
     str_hash = get_str_hash(file_content)
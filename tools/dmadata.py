@@ -3,8 +3,11 @@
 
 from __future__ import annotations
 
+from array import array
+import bisect
 import dataclasses
 import struct
+import sys
 
 
 STRUCT_IIII = struct.Struct(">IIII")
@@ -70,14 +73,132 @@ class DmaEntry:
 DMA_ENTRY_END = DmaEntry(0, 0, 0, 0)
 
 
-def read_dmadata(rom_data: memoryview, start_offset: int) -> list[DmaEntry]:
-    result = []
+class DmaTable:
+    """
+    All the entries of a dmadata, stored as a flat array of 32-bit words (four
+    per entry) instead of one `DmaEntry` object per entry.
+
+    Indexing or iterating the table gives `DmaEntry` objects. Those are copies,
+    modifying them doesn't modify the table.
+    """
+
+    def __init__(self, words: array):
+        assert words.typecode == "I" and words.itemsize == 4
+        assert len(words) % 4 == 0
+        self.words = words
+        self._vrom_index: tuple[list[int], list[int]] | None = None
+        self._rom_index: tuple[list[int], list[int]] | None = None
 
-    offset = start_offset
-    while (
-        entry := DmaEntry.from_bin(rom_data[offset : offset + DmaEntry.SIZE_BYTES])
-    ) != DMA_ENTRY_END:
-        result.append(entry)
-        offset += DmaEntry.SIZE_BYTES
+    @staticmethod
+    def from_bin(rom_data: memoryview, start_offset: int) -> DmaTable:
+        """Read the dmadata at `start_offset`, up to the terminating empty entry."""
+        end_offset = start_offset
+        for entry in STRUCT_IIII.iter_unpack(
+            rom_data[
+                start_offset : len(rom_data)
+                - (len(rom_data) - start_offset) % DmaEntry.SIZE_BYTES
+            ]
+        ):
+            if entry == (0, 0, 0, 0):
+                break
+            end_offset += DmaEntry.SIZE_BYTES
+
+        words = array("I")
+        words.frombytes(rom_data[start_offset:end_offset])
+        if sys.byteorder == "little":
+            words.byteswap()
+        return DmaTable(words)
+
+    @staticmethod
+    def from_entries(entries: list[DmaEntry]) -> DmaTable:
+        words = array("I")
+        for entry in entries:
+            words.extend(
+                (entry.vrom_start, entry.vrom_end, entry.rom_start, entry.rom_end)
+            )
+        return DmaTable(words)
+
+    def to_bin(self) -> bytes:
+        """The table in dmadata format, without the terminating empty entry."""
+        words = array("I", self.words)
+        if sys.byteorder == "little":
+            words.byteswap()
+        return words.tobytes()
+
+    def __len__(self):
+        return len(self.words) // 4
+
+    def __getitem__(self, index: int) -> DmaEntry:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return DmaEntry(*self.words[index * 4 : index * 4 + 4])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield DmaEntry(*self.words[i * 4 : i * 4 + 4])
+
+    def vrom_order(self) -> list[int]:
+        """The indices of the entries, sorted by VROM start."""
+        vrom_starts = self.words[0::4]
+        return sorted(range(len(self)), key=lambda i: vrom_starts[i])
+
+    def _get_vrom_index(self):
+        if self._vrom_index is None:
+            vrom_starts = self.words[0::4]
+            vrom_ends = self.words[1::4]
+            # Empty entries don't contain any address
+            order = sorted(
+                (i for i in range(len(self)) if vrom_starts[i] != vrom_ends[i]),
+                key=lambda i: vrom_starts[i],
+            )
+            self._vrom_index = ([vrom_starts[i] for i in order], order)
+        return self._vrom_index
+
+    def _get_rom_index(self):
+        if self._rom_index is None:
+            vrom_starts = self.words[0::4]
+            vrom_ends = self.words[1::4]
+            rom_starts = self.words[2::4]
+            # "syms" entries have no ROM range
+            order = sorted(
+                (
+                    i
+                    for i in range(len(self))
+                    if vrom_starts[i] != vrom_ends[i] and rom_starts[i] != 0xFFFFFFFF
+                ),
+                key=lambda i: rom_starts[i],
+            )
+            self._rom_index = ([rom_starts[i] for i in order], order)
+        return self._rom_index
+
+    def find_by_vrom(self, vrom: int) -> int | None:
+        """The index of the entry containing the VROM address `vrom`, if any."""
+        starts, order = self._get_vrom_index()
+        i = bisect.bisect_right(starts, vrom) - 1
+        if i < 0:
+            return None
+        index = order[i]
+        if vrom < self.words[index * 4 + 1]:
+            return index
+        return None
+
+    def find_by_rom(self, rom: int) -> int | None:
+        """The index of the entry containing the ROM address `rom`, if any."""
+        starts, order = self._get_rom_index()
+        i = bisect.bisect_right(starts, rom) - 1
+        if i < 0:
+            return None
+        index = order[i]
+        vrom_start, vrom_end, rom_start, rom_end = self.words[index * 4 : index * 4 + 4]
+        if rom_end == 0:
+            # Uncompressed segment
+            rom_end = rom_start + (vrom_end - vrom_start)
+        if rom < rom_end:
+            return index
+        return None
 
-    return result
+
+def read_dmadata(rom_data: memoryview, start_offset: int) -> list[DmaEntry]:
+    return list(DmaTable.from_bin(rom_data, start_offset))
@@ -1,15 +1,22 @@
 #!/usr/bin/env python3
 
 import argparse
+import hashlib
 import json
 import os
 import signal
-import time
 import multiprocessing
+import multiprocessing.util
 from pathlib import Path
+import subprocess
+import xml.etree.ElementTree as ET
 
 import version_config
 
+zapdPath = Path("tools") / "ZAPD" / "ZAPD.out"
+
+globalZAPDBatchProcess = None
+
 
 def SignalHandler(sig, frame):
     print(f'Signal {sig} received. Aborting...')
@@ -17,48 +24,198 @@ def SignalHandler(sig, frame):
     # Don't exit immediately to update the extracted assets file.
 
 def ExtractFile(assetConfig: version_config.AssetConfig, outputPath: Path, outputSourcePath: Path):
+    """
+    Returns whether the extraction succeeded, or None if it was skipped because
+    the extraction was aborted.
+    """
     name = assetConfig.name
     xmlPath = assetConfig.xml_path
-    version = globalVersionConfig.version
     if globalAbort.is_set():
         # Don't extract if another file wasn't extracted properly.
-        return
-
-    zapdPath = Path("tools") / "ZAPD" / "ZAPD.out"
-    configPath = Path("tools") / "ZAPDConfigs" / version / "Config.xml"
+        return None
 
     outputPath.mkdir(parents=True, exist_ok=True)
     outputSourcePath.mkdir(parents=True, exist_ok=True)
 
-    execStr = f"{zapdPath} e -eh -i {xmlPath} -b {globalBaseromSegmentsDir} -o {outputPath} -osf {outputSourcePath} -gsf 1 -rconf {configPath} --cs-float both {ZAPDArgs}"
+    jobArgs = GetZAPDJobArgs(assetConfig, outputPath, outputSourcePath)
+
+    if globalBatch:
+        success = RunZAPDBatchJob(jobArgs)
+    else:
+        execStr = " ".join([str(zapdPath), "e"] + jobArgs + GetZAPDCommonArgs())
+        print(execStr)
+        success = os.system(execStr) == 0
+
+    if not success:
+        globalAbort.set()
+        print("\n")
+        print(f"Error when extracting from file {xmlPath}", file=os.sys.stderr)
+        print("Aborting...", file=os.sys.stderr)
+        print("\n")
+    return success
+
+def GetZAPDJobArgs(assetConfig: version_config.AssetConfig, outputPath: Path, outputSourcePath: Path):
+    name = assetConfig.name
+    xmlPath = assetConfig.xml_path
+
+    jobArgs = ["-i", str(xmlPath), "-o", str(outputPath), "-osf", str(outputSourcePath)]
 
     if name.startswith("code/") or name.startswith("n64dd/") or name.startswith("overlays/"):
         assert assetConfig.start_offset is not None
         assert assetConfig.end_offset is not None
 
-        execStr += f" --start-offset 0x{assetConfig.start_offset:X}"
-        execStr += f" --end-offset 0x{assetConfig.end_offset:X}"
+        jobArgs += ["--start-offset", f"0x{assetConfig.start_offset:X}"]
+        jobArgs += ["--end-offset", f"0x{assetConfig.end_offset:X}"]
 
     if name.startswith("overlays/"):
         overlayName = name.split("/")[1]
         baseAddress = globalVersionConfig.dmadata_segments[overlayName].vram + assetConfig.start_offset
 
-        execStr += f" --base-address 0x{baseAddress:X}"
-        execStr += " --static"
+        jobArgs += ["--base-address", f"0x{baseAddress:X}"]
+        jobArgs += ["--static"]
 
-    if globalUnaccounted:
-        execStr += " -Wunaccounted"
+    return jobArgs
 
-    print(execStr)
-    exitValue = os.system(execStr)
-    if exitValue != 0:
-        globalAbort.set()
-        print("\n")
-        print(f"Error when extracting from file {xmlPath}", file=os.sys.stderr)
-        print("Aborting...", file=os.sys.stderr)
-        print("\n")
+def GetZAPDConfigPath(version: str):
+    return Path("tools") / "ZAPDConfigs" / version / "Config.xml"
+
+def GetZAPDCommonArgs():
+    configPath = GetZAPDConfigPath(globalVersionConfig.version)
+
+    commonArgs = ["-eh", "-b", str(globalBaseromSegmentsDir), "-gsf", "1", "-rconf", str(configPath), "--cs-float", "both"]
+    commonArgs += ZAPDArgs.split()
+
+    if globalUnaccounted:
+        commonArgs += ["-Wunaccounted"]
+
+    return commonArgs
+
+# Marker printed by ZAPD's batch mode on its own line once a job is done, followed by the job's exit code
+ZAPD_BATCH_JOB_DONE_MARKER = "ZAPD_BATCH_JOB_DONE"
+
+def RunZAPDBatchJob(jobArgs: list[str]) -> bool:
+    """
+    Run an extraction on this worker's long-lived ZAPD process, started on first use.
+    This avoids paying for ZAPD's startup and config parsing for every xml.
+    """
+    global globalZAPDBatchProcess
+
+    if globalZAPDBatchProcess is None:
+        batchCmd = [str(zapdPath), "batch"] + GetZAPDCommonArgs()
+        print(" ".join(batchCmd))
+        globalZAPDBatchProcess = subprocess.Popen(batchCmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+
+    assert all("\t" not in arg and "\n" not in arg for arg in jobArgs)
+    print(" ".join(jobArgs))
+    process = globalZAPDBatchProcess
+    try:
+        process.stdin.write("\t".join(jobArgs) + "\n")
+        process.stdin.flush()
+    except BrokenPipeError:
+        pass
+
+    # Forward ZAPD's output for this job, until the job is done
+    output = []
+    for line in process.stdout:
+        if line.startswith(ZAPD_BATCH_JOB_DONE_MARKER):
+            print("".join(output), end="")
+            return int(line.split()[1]) == 0
+        output.append(line)
+
+    # ZAPD exited (or crashed) before finishing the job, restart it for the next job
+    print("".join(output), end="")
+    process.wait()
+    globalZAPDBatchProcess = None
+    return False
+
+def StopZAPDBatchProcess():
+    global globalZAPDBatchProcess
+
+    if globalZAPDBatchProcess is not None:
+        globalZAPDBatchProcess.stdin.close()
+        globalZAPDBatchProcess.wait()
+        globalZAPDBatchProcess = None
+
+def HashFile(h, path: Path):
+    h.update(str(path).encode())
+    h.update(b"\0")
+    if path.exists():
+        h.update(hashlib.sha256(path.read_bytes()).digest())
+    else:
+        h.update(b"<missing>")
+
+def GetZAPDConfigDependencyHash(version: str, zapdHash: str) -> str:
+    """
+    Hash of everything every extraction depends on: the ZAPD binary, the ZAPD
+    config and the files it references.
+    """
+    h = hashlib.sha256()
+    h.update(zapdHash.encode())
+
+    configPath = GetZAPDConfigPath(version)
+    HashFile(h, configPath)
+    configRoot = ET.parse(configPath).getroot()
+    for element in configRoot:
+        if "File" in element.attrib:
+            HashFile(h, configPath.parent / element.attrib["File"])
+        if element.tag == "ExternalFile":
+            HashFile(h, GetExternalXMLFolder(configRoot) / element.attrib["XmlPath"])
+    return h.hexdigest()
+
+def GetExternalXMLFolder(configRoot) -> Path:
+    for element in configRoot:
+        if element.tag == "ExternalXMLFolder":
+            return Path(element.attrib["Path"])
+    return Path()
+
+def GetSegmentHash(segmentName: str) -> str:
+    segmentHash = globalSegmentHashes.get(segmentName)
+    if segmentHash is None:
+        segmentPath = globalBaseromSegmentsDir / segmentName
+        if segmentPath.exists():
+            segmentHash = hashlib.sha1(segmentPath.read_bytes()).hexdigest()
+        else:
+            segmentHash = "<missing>"
+    return segmentHash
+
+def GetAssetDependencyHash(assetConfig: version_config.AssetConfig, jobArgs: list[str]) -> str:
+    """
+    Hash of everything the extraction of an asset depends on: the config hash
+    (see GetZAPDConfigDependencyHash), the ZAPD arguments, the XML and the
+    XMLs it references, and the baserom segments they extract from.
+    """
+    h = hashlib.sha256()
+    h.update(globalConfigDependencyHash.encode())
+    for arg in GetZAPDCommonArgs() + jobArgs:
+        h.update(arg.encode())
+        h.update(b"\0")
+
+    xmlPaths = [assetConfig.xml_path]
+    seenXmlPaths = set()
+    while xmlPaths:
+        xmlPath = xmlPaths.pop()
+        if xmlPath in seenXmlPaths:
+            continue
+        seenXmlPaths.add(xmlPath)
+
+        HashFile(h, xmlPath)
+        if not xmlPath.exists():
+            continue
+        for element in ET.parse(xmlPath).getroot():
+            if element.tag == "File":
+                segmentName = element.attrib["Name"]
+                h.update(f"{segmentName}:{GetSegmentHash(segmentName)}\0".encode())
+            elif element.tag == "ExternalFile":
+                xmlPaths.append(globalExternalXMLFolder / element.attrib["XmlPath"])
+    return h.hexdigest()
 
 def ExtractFunc(assetConfig: version_config.AssetConfig):
+    """
+    Extract an asset if anything it depends on changed since it was last
+    extracted. Returns the asset's xml path and the dependency hash to record
+    for it: the new hash if it is up to date, the previous one if it was
+    skipped because the extraction was aborted, or None if it failed.
+    """
     objectName = assetConfig.name
     xml_path = assetConfig.xml_path
     xml_path_str = str(xml_path)
@@ -66,38 +223,47 @@ def ExtractFunc(assetConfig: version_config.AssetConfig):
     outPath = globalOutputDir / objectName
     outSourcePath = outPath
 
-    if xml_path_str in globalExtractedAssetsTracker:
-        timestamp = globalExtractedAssetsTracker[xml_path_str]["timestamp"]
-        modificationTime = int(os.path.getmtime(xml_path))
-        if modificationTime < timestamp:
-            # XML has not been modified since last extraction.
-            return
-
-    currentTimeStamp = int(time.time())
+    dependencyHash = GetAssetDependencyHash(assetConfig, GetZAPDJobArgs(assetConfig, outPath, outSourcePath))
+    if globalExtractionHashes.get(xml_path_str) == dependencyHash:
+        # Nothing changed since last extraction.
+        return xml_path_str, dependencyHash
 
-    ExtractFile(assetConfig, outPath, outSourcePath)
+    success = ExtractFile(assetConfig, outPath, outSourcePath)
 
-    if not globalAbort.is_set():
-        # Only update timestamp on successful extractions
-        if xml_path_str not in globalExtractedAssetsTracker:
-            globalExtractedAssetsTracker[xml_path_str] = globalManager.dict()
-        globalExtractedAssetsTracker[xml_path_str]["timestamp"] = currentTimeStamp
+    if success is None:
+        # Nothing was done, so whatever was extracted before is still there
+        return xml_path_str, globalExtractionHashes.get(xml_path_str)
+    if not success:
+        return xml_path_str, None
+    # Only record the hash on successful extractions
+    return xml_path_str, dependencyHash
 
-def initializeWorker(versionConfig: version_config.VersionConfig, abort, unaccounted: bool, extractedAssetsTracker: dict, manager, baseromSegmentsDir: Path, outputDir: Path):
+def initializeWorker(versionConfig: version_config.VersionConfig, abort, unaccounted: bool, extractionHashes: dict[str, str], configDependencyHash: str, segmentHashes: dict[str, str], baseromSegmentsDir: Path, outputDir: Path, batch: bool):
     global globalVersionConfig
     global globalAbort
     global globalUnaccounted
-    global globalExtractedAssetsTracker
-    global globalManager
+    global globalExtractionHashes
+    global globalConfigDependencyHash
+    global globalSegmentHashes
+    global globalExternalXMLFolder
     global globalBaseromSegmentsDir
     global globalOutputDir
+    global globalBatch
     globalVersionConfig = versionConfig
     globalAbort = abort
     globalUnaccounted = unaccounted
-    globalExtractedAssetsTracker = extractedAssetsTracker
-    globalManager = manager
+    globalExtractionHashes = extractionHashes
+    globalConfigDependencyHash = configDependencyHash
+    globalSegmentHashes = segmentHashes
+    globalExternalXMLFolder = GetExternalXMLFolder(ET.parse(GetZAPDConfigPath(versionConfig.version)).getroot())
     globalBaseromSegmentsDir = baseromSegmentsDir
     globalOutputDir = outputDir
+    globalBatch = batch
+
+def initializePoolWorker(*workerArgs):
+    initializeWorker(*workerArgs)
+    # Pool workers exit without going back to main, stop their ZAPD process when they do
+    multiprocessing.util.Finalize(None, StopZAPDBatchProcess, exitpriority=0)
 
 def processZAPDArgs(argsZ):
     badZAPDArg = False
@@ -131,6 +297,7 @@ def main():
     parser.add_argument("-j", "--jobs", help="Number of cpu cores to extract with.")
     parser.add_argument("-u", "--unaccounted", help="Enables ZAPD unaccounted detector warning system.", action="store_true")
     parser.add_argument("-Z", help="Pass the argument on to ZAPD, e.g. `-ZWunaccounted` to warn about unaccounted blocks in XMLs. Each argument should be passed separately, *without* the leading dash.", metavar="ZAPD_ARG", action="append")
+    parser.add_argument("--no-batch", help="Start a new ZAPD process for every xml, instead of sending the xmls to a few long-lived ZAPD processes.", action="store_true")
     args = parser.parse_args()
 
     baseromSegmentsDir: Path = args.baserom_segments_dir
@@ -146,14 +313,26 @@ def main():
 
     global mainAbort
     mainAbort = multiprocessing.Event()
-    manager = multiprocessing.Manager()
     signal.signal(signal.SIGINT, SignalHandler)
 
-    extraction_times_p = outputDir / "assets_extraction_times.json"
-    extractedAssetsTracker = manager.dict()
-    if extraction_times_p.exists() and not args.force:
-        with extraction_times_p.open(encoding='utf-8') as f:
-            extractedAssetsTracker.update(json.load(f, object_hook=manager.dict))
+    extraction_hashes_p = outputDir / "assets_extraction_hashes.json"
+    extractionHashes = dict()
+    if extraction_hashes_p.exists() and not args.force:
+        with extraction_hashes_p.open(encoding='utf-8') as f:
+            extractionHashes = json.load(f)
+
+    configDependencyHash = GetZAPDConfigDependencyHash(version, hashlib.sha256(zapdPath.read_bytes()).hexdigest())
+
+    # Reuse the segment hashes computed by extract_baserom.py
+    segmentHashes = dict()
+    segments_manifest_p = baseromSegmentsDir / "segments_manifest.json"
+    if segments_manifest_p.exists():
+        with segments_manifest_p.open(encoding='utf-8') as f:
+            segmentHashes = {name: entry["sha1"] for name, entry in json.load(f).items()}
+
+    workerArgs = (versionConfig, mainAbort, args.unaccounted, extractionHashes, configDependencyHash, segmentHashes, baseromSegmentsDir, outputDir, not args.no_batch)
+
+    newExtractionHashes = dict()
 
     singleAssetName = args.single
     if singleAssetName is not None:
@@ -166,12 +345,17 @@ def main():
             print(f"Error. Asset {singleAssetName} not found in config.", file=os.sys.stderr)
             exit(1)
 
-        initializeWorker(versionConfig, mainAbort, args.unaccounted, extractedAssetsTracker, manager, baseromSegmentsDir, outputDir)
+        # Keep the hashes of the other assets
+        newExtractionHashes.update(extractionHashes)
+        initializeWorker(*workerArgs)
         # Always extract if -s is used.
         xml_path_str = str(assetConfig.xml_path)
-        if xml_path_str in extractedAssetsTracker:
-            del extractedAssetsTracker[xml_path_str]
-        ExtractFunc(assetConfig)
+        if xml_path_str in extractionHashes:
+            del extractionHashes[xml_path_str]
+        if xml_path_str in newExtractionHashes:
+            del newExtractionHashes[xml_path_str]
+        results = [ExtractFunc(assetConfig)]
+        StopZAPDBatchProcess()
     else:
         class CannotMultiprocessError(Exception):
             pass
@@ -185,21 +369,26 @@ def main():
                 mp_context = multiprocessing.get_context("fork")
             except ValueError as e:
                 raise CannotMultiprocessError() from e
-            with mp_context.Pool(numCores, initializer=initializeWorker, initargs=(versionConfig, mainAbort, args.unaccounted, extractedAssetsTracker, manager, baseromSegmentsDir, outputDir)) as p:
-                p.map(ExtractFunc, versionConfig.assets)
+            with mp_context.Pool(numCores, initializer=initializePoolWorker, initargs=workerArgs) as p:
+                results = p.map(ExtractFunc, versionConfig.assets)
+                # Let the workers exit on their own (instead of being terminated when
+                # leaving the with block) so that they stop their ZAPD processes
+                p.close()
+                p.join()
         except (multiprocessing.ProcessError, TypeError, CannotMultiprocessError):
             print("Warning: Multiprocessing exception occurred.", file=os.sys.stderr)
             print("Disabling mutliprocessing.", file=os.sys.stderr)
 
-            initializeWorker(versionConfig, mainAbort, args.unaccounted, extractedAssetsTracker, manager, baseromSegmentsDir, outputDir)
-            for assetConfig in versionConfig.assets:
-                ExtractFunc(assetConfig)
+            initializeWorker(*workerArgs)
+            results = [ExtractFunc(assetConfig) for assetConfig in versionConfig.assets]
+            StopZAPDBatchProcess()
+
+    for xml_path_str, dependencyHash in results:
+        if dependencyHash is not None:
+            newExtractionHashes[xml_path_str] = dependencyHash
 
-    with extraction_times_p.open('w', encoding='utf-8') as f:
-        serializableDict = dict()
-        for xml, data in extractedAssetsTracker.items():
-            serializableDict[xml] = dict(data)
-        json.dump(dict(serializableDict), f, ensure_ascii=False, indent=4)
+    with extraction_hashes_p.open('w', encoding='utf-8') as f:
+        json.dump(newExtractionHashes, f, ensure_ascii=False, indent=4)
 
     if mainAbort.is_set():
         exit(1)
@@ -6,13 +6,20 @@
 from __future__ import annotations
 
 import argparse
+import hashlib
+import json
+import os
 from pathlib import Path
 import sys
 
 import dmadata
+from rom import Rom
 import version_config
 
 
+MANIFEST_NAME = "segments_manifest.json"
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Extract segments from an uncompressed ROM, based on its dmadata."
@@ -40,15 +47,42 @@ def main():
         ),
     )
 
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Write all segments, even those unchanged since the last extraction",
+    )
+
     args = parser.parse_args()
 
-    rom_data = memoryview(args.rom.read_bytes())
+    with Rom(args.rom) as rom:
+        extract_segments(
+            rom, args.output_dir, args.oot_version, args.dmadata_start, args.force
+        )
+
 
-    config = version_config.load_version_config(args.oot_version)
-    dmadata_start = args.dmadata_start or config.dmadata_start
+def write_file_atomic(path: Path, data: memoryview):
+    # Write to a temporary file first so that an interrupted extraction never
+    # leaves a truncated segment behind
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+
+
+def extract_segments(
+    rom: Rom,
+    output_dir: Path,
+    version: str,
+    dmadata_start_override: int | None,
+    force: bool = False,
+):
+    rom_data = rom.data
+
+    config = version_config.load_version_config(version)
+    dmadata_start = dmadata_start_override or config.dmadata_start
     dma_names = config.dmadata_segments.keys()
 
-    dma_entries = dmadata.read_dmadata(rom_data, dmadata_start)
+    dma_entries = dmadata.DmaTable.from_bin(rom_data, dmadata_start)
     if len(dma_names) != len(dma_entries):
         print(
             f"Error: expected {len(dma_names)} DMA entries but found {len(dma_entries)} in ROM",
@@ -56,7 +90,19 @@ def main():
         )
         exit(1)
 
-    args.output_dir.mkdir(parents=True, exist_ok=True)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    # The manifest records the VROM range and hash of each segment extracted
+    # previously. Segments that didn't change are not written again, so that
+    # their modification time doesn't change either.
+    manifest_p = output_dir / MANIFEST_NAME
+    manifest = {}
+    if manifest_p.exists() and not force:
+        with manifest_p.open(encoding="utf-8") as f:
+            manifest = json.load(f)
+    new_manifest = {}
+    num_written = 0
+
     for dma_name, dma_entry in zip(dma_names, dma_entries):
         if dma_entry.is_syms():
             segment_rom_start = dma_entry.vrom_start
@@ -70,11 +116,29 @@ def main():
             dma_entry.vrom_end - dma_entry.vrom_start
         )
 
-        segment_data = rom_data[segment_rom_start:segment_rom_end]
-        segment_path = args.output_dir / dma_name
-        segment_path.write_bytes(segment_data)
-
-    print(f"Extracted {len(dma_entries)} segments to {args.output_dir}")
+        segment_path = output_dir / dma_name
+        with rom.segment(segment_rom_start, segment_rom_end) as segment_data:
+            manifest_entry = {
+                "vrom_start": dma_entry.vrom_start,
+                "vrom_end": dma_entry.vrom_end,
+                "sha1": hashlib.sha1(segment_data).hexdigest(),
+            }
+            new_manifest[dma_name] = manifest_entry
+            if (
+                manifest.get(dma_name) != manifest_entry
+                or not segment_path.exists()
+                or segment_path.stat().st_size != len(segment_data)
+            ):
+                write_file_atomic(segment_path, segment_data)
+                num_written += 1
+
+    with manifest_p.open("w", encoding="utf-8") as f:
+        json.dump(new_manifest, f, indent=4)
+
+    print(
+        f"Extracted {len(dma_entries)} segments to {output_dir}"
+        f" ({len(dma_entries) - num_written} unchanged)"
+    )
 
 
 if __name__ == "__main__":
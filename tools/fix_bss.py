@@ -11,26 +11,30 @@ from collections import Counter
 import colorama
 from dataclasses import dataclass
 import io
+import itertools
 import multiprocessing
 import multiprocessing.pool
 from pathlib import Path
 import re
 import shlex
 import sys
-import time
 import traceback
-from typing import BinaryIO, Iterator, Optional, Tuple
+from typing import Iterator, Optional, Tuple
 
+from completion_queue import CompletionQueue
 from ido_block_numbers import (
-    generate_make_log,
+    cfe_cache_dir,
     find_compiler_command_line,
+    load_compile_commands,
     run_cfe,
     SymbolTableEntry,
     UcodeOp,
 )
+from rom import Rom
 
 import elftools.elf.elffile
 import mapfile_parser.mapfile
+import numpy as np
 
 
 # Set on program start since we replace sys.stdout in worker processes
@@ -44,21 +48,6 @@ def output(message: str = "", color: Optional[str] = None, end: str = "\n"):
         print(message, end=end)
 
 
-def read_u32(f: BinaryIO, offset: int) -> int:
-    f.seek(offset)
-    return int.from_bytes(f.read(4), "big")
-
-
-def read_u16(f: BinaryIO, offset: int) -> int:
-    f.seek(offset)
-    return int.from_bytes(f.read(2), "big")
-
-
-def read_s16(f: BinaryIO, offset: int) -> int:
-    f.seek(offset)
-    return int.from_bytes(f.read(2), "big", signed=True)
-
-
 class FixBssException(Exception):
     pass
 
@@ -87,72 +76,72 @@ class BssSection:
 
 
 # Read relocations from an ELF file section
-def read_relocs(object_path: Path, section_name: str) -> list[Reloc]:
-    with open(object_path, "rb") as f:
-        elffile = elftools.elf.elffile.ELFFile(f)
-        symtab = elffile.get_section_by_name(".symtab")
-
-        section = elffile.get_section_by_name(section_name)
-        if section is None:
-            return []
-
-        data = elffile.get_section_by_name(section_name).data()
-
-        reloc_section = elffile.get_section_by_name(f".rel{section_name}")
-        if reloc_section is None:
-            return []
-
-        relocs = []
-        offset_hi16 = 0
-        for reloc in reloc_section.iter_relocations():
-            reloc_offset = reloc.entry["r_offset"]
-            reloc_type = reloc.entry["r_info_type"]
-            reloc_name = symtab.get_symbol(reloc.entry["r_info_sym"]).name
-
-            if reloc_type == 2:  # R_MIPS_32
-                offset_32 = reloc_offset
-                addend = int.from_bytes(
-                    data[reloc_offset : reloc_offset + 4], "big", signed=True
-                )
-                relocs.append(Reloc(reloc_name, offset_32, None, None, addend))
-            elif reloc_type == 4:  # R_MIPS_26
-                pass
-            elif reloc_type == 5:  # R_MIPS_HI16
-                offset_hi16 = reloc_offset
-            elif reloc_type == 6:  # R_MIPS_LO16
-                offset_lo16 = reloc_offset
-                addend_hi16 = int.from_bytes(
-                    data[offset_hi16 + 2 : offset_hi16 + 4], "big", signed=False
-                )
-                addend_lo16 = int.from_bytes(
-                    data[offset_lo16 + 2 : offset_lo16 + 4], "big", signed=True
-                )
-                addend = (addend_hi16 << 16) + addend_lo16
-                relocs.append(Reloc(reloc_name, None, offset_hi16, offset_lo16, addend))
-            else:
-                raise NotImplementedError(f"Unsupported relocation type: {reloc_type}")
+def read_relocs(
+    elffile: elftools.elf.elffile.ELFFile, section_name: str
+) -> list[Reloc]:
+    symtab = elffile.get_section_by_name(".symtab")
+
+    section = elffile.get_section_by_name(section_name)
+    if section is None:
+        return []
+
+    data = section.data()
+
+    reloc_section = elffile.get_section_by_name(f".rel{section_name}")
+    if reloc_section is None:
+        return []
+
+    relocs = []
+    offset_hi16 = 0
+    for reloc in reloc_section.iter_relocations():
+        reloc_offset = reloc.entry["r_offset"]
+        reloc_type = reloc.entry["r_info_type"]
+        reloc_name = symtab.get_symbol(reloc.entry["r_info_sym"]).name
+
+        if reloc_type == 2:  # R_MIPS_32
+            offset_32 = reloc_offset
+            addend = int.from_bytes(
+                data[reloc_offset : reloc_offset + 4], "big", signed=True
+            )
+            relocs.append(Reloc(reloc_name, offset_32, None, None, addend))
+        elif reloc_type == 4:  # R_MIPS_26
+            pass
+        elif reloc_type == 5:  # R_MIPS_HI16
+            offset_hi16 = reloc_offset
+        elif reloc_type == 6:  # R_MIPS_LO16
+            offset_lo16 = reloc_offset
+            addend_hi16 = int.from_bytes(
+                data[offset_hi16 + 2 : offset_hi16 + 4], "big", signed=False
+            )
+            addend_lo16 = int.from_bytes(
+                data[offset_lo16 + 2 : offset_lo16 + 4], "big", signed=True
+            )
+            addend = (addend_hi16 << 16) + addend_lo16
+            relocs.append(Reloc(reloc_name, None, offset_hi16, offset_lo16, addend))
+        else:
+            raise NotImplementedError(f"Unsupported relocation type: {reloc_type}")
 
-        return relocs
+    return relocs
 
 
 def get_file_pointers(
     file: mapfile_parser.mapfile.File,
-    base: BinaryIO,
-    build: BinaryIO,
+    elffile: elftools.elf.elffile.ELFFile,
+    base: Rom,
+    build: Rom,
 ) -> list[Pointer]:
     pointers = []
-    # TODO: open each ELF file only once instead of once per section?
-    for reloc in read_relocs(file.filepath, file.sectionType):
+    for reloc in read_relocs(elffile, file.sectionType):
         if reloc.offset_32 is not None:
-            base_value = read_u32(base, file.vrom + reloc.offset_32)
-            build_value = read_u32(build, file.vrom + reloc.offset_32)
+            base_value = base.read_u32(file.vrom + reloc.offset_32)
+            build_value = build.read_u32(file.vrom + reloc.offset_32)
         elif reloc.offset_hi16 is not None and reloc.offset_lo16 is not None:
             if (
-                read_u16(base, file.vrom + reloc.offset_hi16)
-                != read_u16(build, file.vrom + reloc.offset_hi16)
+                base.read_u16(file.vrom + reloc.offset_hi16)
+                != build.read_u16(file.vrom + reloc.offset_hi16)
             ) or (
-                read_u16(base, file.vrom + reloc.offset_lo16)
-                != read_u16(build, file.vrom + reloc.offset_lo16)
+                base.read_u16(file.vrom + reloc.offset_lo16)
+                != build.read_u16(file.vrom + reloc.offset_lo16)
             ):
                 raise FixBssException(
                     f"Reference to {reloc.name} in {file.filepath} is in a shifted or non-matching portion of the ROM.\n"
@@ -160,11 +149,11 @@ def get_file_pointers(
                 )
 
             base_value = (
-                read_u16(base, file.vrom + reloc.offset_hi16 + 2) << 16
-            ) + read_s16(base, file.vrom + reloc.offset_lo16 + 2)
+                base.read_u16(file.vrom + reloc.offset_hi16 + 2) << 16
+            ) + base.read_s16(file.vrom + reloc.offset_lo16 + 2)
             build_value = (
-                read_u16(build, file.vrom + reloc.offset_hi16 + 2) << 16
-            ) + read_s16(build, file.vrom + reloc.offset_lo16 + 2)
+                build.read_u16(file.vrom + reloc.offset_hi16 + 2) << 16
+            ) + build.read_s16(file.vrom + reloc.offset_lo16 + 2)
         else:
             assert False, "Invalid relocation"
 
@@ -184,21 +173,37 @@ def get_file_pointers(
     return pointers
 
 
+# Get pointers for all sections of an object file, parsing the ELF file only once
+def get_object_pointers(
+    files: list[mapfile_parser.mapfile.File],
+    base: Rom,
+    build: Rom,
+) -> list[Pointer]:
+    pointers = []
+    with open(files[0].filepath, "rb") as f:
+        elffile = elftools.elf.elffile.ELFFile(f)
+        for file in files:
+            pointers.extend(get_file_pointers(file, elffile, base, build))
+    return pointers
+
+
 base = None
 build = None
 
 
-def get_file_pointers_worker_init(base_path: Path, build_path: Path):
+def get_object_pointers_worker_init(base_path: Path, build_path: Path):
     global base
     global build
-    base = open(base_path, "rb")
-    build = open(build_path, "rb")
+    base = Rom(base_path)
+    build = Rom(build_path)
 
 
-def get_file_pointers_worker(file: mapfile_parser.mapfile.File) -> list[Pointer]:
+def get_object_pointers_worker(
+    files: list[mapfile_parser.mapfile.File],
+) -> list[Pointer]:
     assert base is not None
     assert build is not None
-    return get_file_pointers(file, base, build)
+    return get_object_pointers(files, base, build)
 
 
 # Compare pointers between the baserom and the current build, returning a dictionary from
@@ -229,36 +234,42 @@ def compare_pointers(version: str) -> dict[Path, BssSection]:
             continue
         source_code_segments.append(mapfile_segment)
 
+    # Group sections by object file, so that each object file is read only once
+    object_files: dict[Path, list[mapfile_parser.mapfile.File]] = {}
+    for mapfile_segment in source_code_segments:
+        for file in mapfile_segment:
+            if not str(file.filepath).endswith(".o"):
+                continue
+            if file.sectionType == ".bss":
+                continue
+            object_files.setdefault(file.filepath, []).append(file)
+
     # Find all pointers with different values
     if not stdout_isatty:
         output(f"Comparing pointers between baserom and build ...")
     pointers = []
     file_results = []
     with multiprocessing.Pool(
-        initializer=get_file_pointers_worker_init,
+        initializer=get_object_pointers_worker_init,
         initargs=(base_path, build_path),
     ) as p:
-        for mapfile_segment in source_code_segments:
-            for file in mapfile_segment:
-                if not str(file.filepath).endswith(".o"):
-                    continue
-                if file.sectionType == ".bss":
-                    continue
-                file_result = p.apply_async(get_file_pointers_worker, (file,))
-                file_results.append(file_result)
+        completion_queue = CompletionQueue(p)
+        for object_path, files in object_files.items():
+            file_result = completion_queue.submit(
+                get_object_pointers_worker, (files,), object_path
+            )
+            file_results.append(file_result)
 
-        # Report progress and wait until all files are done
+        # Report progress as files are done and wait until all files are done
         num_files = len(file_results)
-        while True:
-            time.sleep(0.010)
-            num_files_done = sum(file_result.ready() for file_result in file_results)
+        num_files_done = 0
+        for _ in completion_queue.as_completed():
+            num_files_done += 1
             if stdout_isatty:
                 output(
                     f"Comparing pointers between baserom and build ... {num_files_done:>{len(f'{num_files}')}}/{num_files}",
                     end="\r",
                 )
-            if num_files_done == num_files:
-                break
         if stdout_isatty:
             output("")
 
@@ -513,32 +524,292 @@ def gen_seq(nu: int) -> Iterator[int]:
             yield (2 * i + 1) * (1 << nu)
 
 
-# Yields all n-tuples of integers in the range [0, 256) with minimum 2-adic valuation
-# of exactly `min_nu`.
-def gen_candidates_impl(n: int, min_nu: int) -> Iterator[tuple[int, ...]]:
-    if n == 1:
-        for n in gen_seq(min_nu):
-            yield (n,)
-    else:
-        # (a, *b) has min 2-adic valuation = min_nu if and only if either:
-        #   a has 2-adic valuation >  min_nu and b has min 2-adic valuation == min_nu
-        #   a has 2-adic valuation == min_nu and b has min 2-adic valuation >= min_nu
-        for min_nu_a in reversed(range(min_nu + 1, 9)):
-            for a in gen_seq(min_nu_a):
-                for b in gen_candidates_impl(n - 1, min_nu):
-                    yield (a, *b)
-        for a in gen_seq(min_nu):
-            for min_nu_b in reversed(range(min_nu, 9)):
-                for b in gen_candidates_impl(n - 1, min_nu_b):
-                    yield (a, *b)
-
-
-# Yields all n-tuples of integers in the range [0, 256), ordered by descending minimum
-# 2-adic valuation of the elements in the tuple. For example, for n = 2 the sequence is:
-#   (0, 0), (0, 128), (128, 0), (128, 128), (0, 64), (0, 192), (128, 64), (128, 192), ...
-def gen_candidates(n: int) -> Iterator[tuple[int, ...]]:
-    for nu in reversed(range(9)):
-        yield from gen_candidates_impl(n, nu)
+ALL_RESIDUES = (1 << 256) - 1
+
+
+# Set of residues mod 256 in the range [lo, hi], as a bitmask.
+def residue_range(lo: int, hi: int) -> int:
+    if lo > hi:
+        return 0
+    return ((1 << (hi - lo + 1)) - 1) << lo
+
+
+# Maps a set of residues r to the set of residues (r - shift) mod 256.
+def rotate_residues(mask: int, shift: int) -> int:
+    shift %= 256
+    return ((mask >> shift) | (mask << (256 - shift))) & ALL_RESIDUES
+
+
+# Constraints on the increment_block_number amounts, in terms of the sums of the amounts
+# of the first k pragmas mod 256 (called "prefix sums" below).
+#
+# Changing the amounts shifts the block number of each variable by the prefix sum for the
+# pragmas before it (minus a constant), so the sort key of a variable only depends on one
+# prefix sum. Ties between sort keys are broken by block number, which is unaffected by the
+# amounts since pragmas never move variables past each other.
+#
+# Variables that can be matched to the baserom must be sorted in the same order as the
+# baserom. As this order is total, it's enough to require it for each pair of variables
+# that are next to each other in the baserom. Each such pair gives either a constraint
+# on a single prefix sum (if both variables are after the same pragma), or on a pair of
+# prefix sums. Both are precomputed as bitmasks of allowed residues mod 256.
+@dataclass
+class BssOrderingConstraints:
+    # unary[k]: allowed values of prefix sum k
+    unary: list[int]
+    # binary[(i, j)][s]: allowed values of prefix sum j if prefix sum i is s, for i < j
+    binary: dict[tuple[int, int], list[int]]
+    # used[k]: whether the sort key of any variable depends on prefix sum k
+    used: list[bool]
+
+
+def compute_bss_ordering_constraints(
+    pragmas: list[Pragma],
+    bss_variables: list[BssVariable],
+    base_bss_symbols: list[BssSymbol],
+) -> BssOrderingConstraints:
+    n = len(pragmas)
+    # Prefix sum 0 is the empty sum, which is always 0
+    unary = [1] + [ALL_RESIDUES] * n
+    binary: dict[tuple[int, int], list[int]] = {}
+
+    # For each variable: which prefix sum its sort key depends on, and the sort key when
+    # that prefix sum is 0
+    level: dict[str, int] = {}
+    base_key: dict[str, int] = {}
+    block_number: dict[str, int] = {}
+    used = [False] * (n + 1)
+    for var in bss_variables:
+        k = sum(1 for pragma in pragmas if var.block_number >= pragma.block_number)
+        level[var.name] = k
+        used[k] = used[k] or not var.referenced_in_data
+        base_key[var.name] = (
+            var.block_number - sum(pragma.amount for pragma in pragmas[:k])
+        ) % 256
+        block_number[var.name] = var.block_number
+
+    # Variables referenced in .data or .rodata aren't sorted
+    sorted_names = [
+        symbol.name
+        for symbol in base_bss_symbols
+        if symbol.name in level and not symbol.referenced_in_data
+    ]
+
+    for a, b in zip(sorted_names, sorted_names[1:]):
+        # a must sort before b: (key_a, block_number_a) < (key_b, block_number_b)
+        tie_ok = block_number[a] < block_number[b]
+        if level[a] == level[b]:
+            k = level[a]
+            allowed = 0
+            for s in range(256):
+                key_a = (base_key[a] + s) % 256
+                key_b = (base_key[b] + s) % 256
+                if key_a < key_b or (key_a == key_b and tie_ok):
+                    allowed |= 1 << s
+            unary[k] &= allowed
+            continue
+
+        if level[a] < level[b]:
+            first, second = a, b
+        else:
+            first, second = b, a
+        table = binary.setdefault((level[first], level[second]), [ALL_RESIDUES] * 256)
+        for s in range(256):
+            key = (base_key[first] + s) % 256
+            if first == a:
+                # Allowed keys of b given the key of a
+                keys = residue_range(key if tie_ok else key + 1, 255)
+            else:
+                # Allowed keys of a given the key of b
+                keys = residue_range(0, key if tie_ok else key - 1)
+            table[s] &= rotate_residues(keys, base_key[second])
+
+    # Fold constraints involving prefix sum 0 into the unary ones
+    for (i, j), table in list(binary.items()):
+        if i == 0:
+            unary[j] &= table[0]
+            del binary[(i, j)]
+
+    return BssOrderingConstraints(unary, binary, used)
+
+
+# Removes the values of prefix sums that aren't allowed by any value of the prefix sums they
+# are constrained with, until there are no more to remove (this is AC-3). Returns False if
+# a prefix sum has no allowed values left.
+def propagate_bss_ordering_constraints(
+    allowed: list[int],
+    neighbors: list[list[tuple[int, list[int]]]],
+    changed: list[int],
+) -> bool:
+    queue = set(changed)
+    while queue:
+        j = queue.pop()
+        for i, table in neighbors[j]:
+            # table[s]: allowed values of prefix sum j if prefix sum i is s
+            new_allowed_i = 0
+            for s in range(256):
+                if (allowed[i] >> s) & 1 and table[s] & allowed[j]:
+                    new_allowed_i |= 1 << s
+            if new_allowed_i != allowed[i]:
+                if not new_allowed_i:
+                    return False
+                allowed[i] = new_allowed_i
+                queue.add(i)
+    return True
+
+
+# Yields new increment_block_number amounts for which the variables that can be matched to
+# the baserom are sorted in the right order, using backtracking over the amounts of each
+# pragma in turn. Each choice of amount is propagated to the allowed values of the other
+# prefix sums, so that the search backtracks as soon as one of them has none left.
+#
+# The search is repeated for decreasing minimum 2-adic valuations of the amounts (see
+# gen_seq), so that "rounder" amounts are found first. All amounts are multiples of 2^nu
+# if and only if all prefix sums are, which prunes the search further.
+def gen_bss_ordering_candidates(
+    constraints: BssOrderingConstraints,
+) -> Iterator[tuple[int, ...]]:
+    n = len(constraints.unary) - 1
+    neighbors: list[list[tuple[int, list[int]]]] = [[] for _ in range(n + 1)]
+    for (i, j), table in constraints.binary.items():
+        transposed = [0] * 256
+        for s_i in range(256):
+            for s_j in range(256):
+                if (table[s_i] >> s_j) & 1:
+                    transposed[s_j] |= 1 << s_i
+        neighbors[j].append((i, table))
+        neighbors[i].append((j, transposed))
+
+    prefix_sums = [0] * (n + 1)
+    amounts = [0] * n
+
+    # Yields the candidates with a minimum 2-adic valuation of exactly min_nu, given the
+    # amounts of the first k - 1 pragmas and the allowed values of the other prefix sums
+    def search(
+        k: int, allowed: list[int], min_nu: int, has_min_nu: bool
+    ) -> Iterator[tuple[int, ...]]:
+        if k > n:
+            if has_min_nu:
+                yield tuple(amounts)
+            return
+        for nu in reversed(range(min_nu, 9)):
+            for amount in gen_seq(nu):
+                s = (prefix_sums[k - 1] + amount) % 256
+                if not (allowed[k] >> s) & 1:
+                    continue
+                new_allowed = allowed[:]
+                new_allowed[k] = 1 << s
+                if propagate_bss_ordering_constraints(new_allowed, neighbors, [k]):
+                    prefix_sums[k] = s
+                    amounts[k - 1] = amount
+                    yield from search(
+                        k + 1, new_allowed, min_nu, has_min_nu or nu == min_nu
+                    )
+                if not constraints.used[k]:
+                    # Nothing depends on this prefix sum, so any other amount would
+                    # only be equivalent to this one
+                    return
+
+    for min_nu in reversed(range(9)):
+        multiples = sum(1 << s for s in range(0, 256, 1 << min_nu))
+        initial_allowed = [allowed & multiples for allowed in constraints.unary]
+        if propagate_bss_ordering_constraints(
+            initial_allowed, neighbors, list(range(n + 1))
+        ):
+            yield from search(1, initial_allowed, min_nu, False)
+
+
+# Predicts the BSS offsets of the variables (the same way as predict_bss_ordering) for a batch
+# of candidate increment_block_number amounts at once, and checks them against the offsets of
+# the variables that were matched to the baserom.
+class BssOrderingEvaluator:
+    def __init__(
+        self,
+        pragmas: list[Pragma],
+        bss_variables: list[BssVariable],
+        base_bss_symbols: list[BssSymbol],
+    ):
+        base_offsets = {symbol.name: symbol.offset for symbol in base_bss_symbols}
+
+        # Variables referenced in .data or .rodata keep their original order and come first,
+        # so their offsets don't depend on the amounts.
+        offset = 0
+        self.always_mismatches = False
+        for var in bss_variables:
+            if not var.referenced_in_data:
+                continue
+            offset = (offset + var.align - 1) & ~(var.align - 1)
+            if base_offsets.get(var.name, offset) != offset:
+                self.always_mismatches = True
+            offset += var.size
+        self.start_offset = offset
+
+        variables = [var for var in bss_variables if not var.referenced_in_data]
+        self.old_amounts = np.array([p.amount for p in pragmas], dtype=np.int64)
+        self.block_numbers = np.array(
+            [var.block_number for var in variables], dtype=np.int64
+        )
+        self.sizes = np.array([var.size for var in variables], dtype=np.int64)
+        self.aligns = np.array([var.align for var in variables], dtype=np.int64)
+        # affected[i, j] is 1 if the block number of variable i is incremented by pragma j
+        self.affected = np.array(
+            [
+                [var.block_number >= p.block_number for p in pragmas]
+                for var in variables
+            ],
+            dtype=np.int64,
+        ).reshape(len(variables), len(pragmas))
+        self.expected_offsets = np.array(
+            [base_offsets.get(var.name, -1) for var in variables], dtype=np.int64
+        )
+        self.unmatched = self.expected_offsets < 0
+
+    # Returns the index of the first candidate in the batch for which all matched variables
+    # end up at the same offsets as in the baserom, or None if there is no such candidate.
+    def first_match(self, candidates: list[tuple[int, ...]]) -> Optional[int]:
+        if self.always_mismatches or not candidates:
+            return None
+
+        num_candidates = len(candidates)
+        amounts = np.array(candidates, dtype=np.int64).reshape(
+            num_candidates, len(self.old_amounts)
+        )
+        block_numbers = (
+            self.block_numbers + (amounts - self.old_amounts) @ self.affected.T
+        )
+
+        # Sort by block number mod 256, and by block number for ties. Block numbers are
+        # nonnegative and much less than 2^32, so a single key will do.
+        keys = (block_numbers % 256) * (1 << 32) + block_numbers
+        order = np.argsort(keys, axis=1, kind="stable")
+        sizes = self.sizes[order]
+        aligns = self.aligns[order]
+
+        # Lay out the variables in sorted order, one column for all candidates at a time
+        sorted_offsets = np.empty_like(order)
+        offset = np.full(num_candidates, self.start_offset, dtype=np.int64)
+        for i in range(order.shape[1]):
+            offset = (offset + aligns[:, i] - 1) & ~(aligns[:, i] - 1)
+            sorted_offsets[:, i] = offset
+            offset += sizes[:, i]
+
+        offsets = np.empty_like(sorted_offsets)
+        np.put_along_axis(offsets, order, sorted_offsets, axis=1)
+        matches = np.all((offsets == self.expected_offsets) | self.unmatched, axis=1)
+        if not matches.any():
+            return None
+        return int(np.argmax(matches))
+
+
+# Number of candidates evaluated at once by solve_bss_ordering. The batches start small since
+# the first few candidates usually work, and grow for the files where they don't.
+MIN_CANDIDATE_BATCH_SIZE = 16
+MAX_CANDIDATE_BATCH_SIZE = 4096
+
+# Number of candidates after which solve_bss_ordering gives up. The search space grows by a
+# factor of up to 256 per pragma, and the constraints don't account for the variables that
+# couldn't be matched, so without a limit an unsolvable file could take practically forever.
+MAX_CANDIDATES = 1 << 18
 
 
 # Determine a new set of increment_block_number pragmas that will fix the BSS ordering.
@@ -547,49 +818,44 @@ def solve_bss_ordering(
     bss_variables: list[BssVariable],
     base_bss_symbols: list[BssSymbol],
 ) -> list[Pragma]:
-    base_symbols_by_name = {symbol.name: symbol for symbol in base_bss_symbols}
-
-    # Our "algorithm" just tries all possible combinations of increment_block_number amounts,
-    # which can get very slow with more than a few pragmas. But, we order the candidates in a
-    # binary-search-esque way to try to find a solution faster.
-    for new_amounts in gen_candidates(len(pragmas)):
-        # Generate new block numbers
-        new_bss_variables = []
-        for var in bss_variables:
-            new_block_number = var.block_number
-            for pragma, new_amount in zip(pragmas, new_amounts):
-                if var.block_number >= pragma.block_number:
-                    new_block_number += new_amount - pragma.amount
-            new_bss_variables.append(
-                BssVariable(
-                    new_block_number,
-                    var.name,
-                    var.size,
-                    var.align,
-                    var.referenced_in_data,
-                )
+    # Only amounts that put the matched variables in the right order are tried. Variables that
+    # couldn't be matched also affect the offsets of the others, so each of these candidates is
+    # still checked against the baserom.
+    constraints = compute_bss_ordering_constraints(
+        pragmas, bss_variables, base_bss_symbols
+    )
+    evaluator = BssOrderingEvaluator(pragmas, bss_variables, base_bss_symbols)
+    if evaluator.always_mismatches:
+        raise FixBssException("Could not find any solutions")
+
+    candidates = gen_bss_ordering_candidates(constraints)
+    batch_size = MIN_CANDIDATE_BATCH_SIZE
+    num_candidates = 0
+    while True:
+        if num_candidates >= MAX_CANDIDATES:
+            raise FixBssException(
+                f"Could not find any solutions in the first {MAX_CANDIDATES} candidates"
             )
+        batch = list(
+            itertools.islice(
+                candidates, min(batch_size, MAX_CANDIDATES - num_candidates)
+            )
+        )
+        if not batch:
+            break
+        num_candidates += len(batch)
 
-        # Predict new BSS and check if new ordering matches
-        new_bss_symbols = predict_bss_ordering(new_bss_variables)
-
-        bss_ordering_matches = True
-        for symbol in new_bss_symbols:
-            base_symbol = base_symbols_by_name.get(symbol.name)
-            if base_symbol is None:
-                continue
-            if symbol.offset != base_symbol.offset:
-                bss_ordering_matches = False
-                break
-
-        if bss_ordering_matches:
+        index = evaluator.first_match(batch)
+        if index is not None:
             new_pragmas = []
-            for pragma, new_amount in zip(pragmas, new_amounts):
+            for pragma, new_amount in zip(pragmas, batch[index]):
                 new_pragmas.append(
                     Pragma(pragma.line_number, pragma.block_number, new_amount)
                 )
             return new_pragmas
 
+        batch_size = min(batch_size * 2, MAX_CANDIDATE_BATCH_SIZE)
+
     raise FixBssException("Could not find any solutions")
 
 
@@ -692,13 +958,13 @@ def update_source_file(version_to_update: str, file: Path, new_pragmas: list[Pra
 def process_file(
     file: Path,
     bss_section: BssSection,
-    make_log: list[str],
+    compile_commands: dict[str, list[list[str]]],
     dry_run: bool,
     version: str,
 ):
     output(f"Processing {file} ...", color=colorama.Fore.CYAN)
 
-    command_line = find_compiler_command_line(make_log, file)
+    command_line = find_compiler_command_line(compile_commands, file)
     if command_line is None:
         raise FixBssException(f"Could not determine compiler command line for {file}")
 
@@ -709,7 +975,9 @@ def process_file(
             "Can't automatically fix BSS ordering for EGCS-compiled files"
         )
 
-    symbol_table, ucode = run_cfe(command_line, keep_files=False)
+    symbol_table, ucode = run_cfe(
+        command_line, keep_files=False, cache_dir=cfe_cache_dir(version)
+    )
 
     bss_variables = find_bss_variables(symbol_table, ucode)
     output("BSS variables:")
@@ -737,13 +1005,8 @@ def process_file(
         )
 
     pragmas = find_pragmas(symbol_table)
-    max_pragmas = 3
     if not pragmas:
         raise FixBssException(f"No increment_block_number pragmas found in {file}")
-    elif len(pragmas) > max_pragmas:
-        raise FixBssException(
-            f"Too many increment_block_number pragmas found in {file} (found {len(pragmas)}, max {max_pragmas})"
-        )
 
     output("Solving BSS ordering ...")
     new_pragmas = solve_bss_ordering(pragmas, bss_variables, base_bss_symbols)
@@ -845,27 +1108,29 @@ def main():
     if not files_to_fix:
         return
 
-    output(f"Running make to find compiler command line ...")
-    make_log = generate_make_log(version)
+    output(f"Finding compiler command lines ...")
+    compile_commands = load_compile_commands(version, files_to_fix)
 
     with multiprocessing.Pool() as p:
+        completion_queue = CompletionQueue(p)
         file_results = []
         for file in files_to_fix:
-            file_result = p.apply_async(
+            file_result = completion_queue.submit(
                 process_file_worker,
                 (
                     file,
                     bss_sections[file],
-                    make_log,
+                    compile_commands,
                     args.dry_run,
                     version,
                 ),
+                file,
             )
             file_results.append(file_result)
 
         # Wait until all files are done
-        while not all(file_result.ready() for file_result in file_results):
-            time.sleep(0.010)
+        for _ in completion_queue.as_completed():
+            pass
 
         # Collect results and check for errors
         num_successes = sum(file_result.successful() for file_result in file_results)
@@ -20,13 +20,20 @@ from __future__ import annotations
 
 import argparse
 from dataclasses import dataclass
+import hashlib
 import itertools
+import json
+import os
 from pathlib import Path
+import pickle
 import platform
+import re
+import shutil
 import struct
 import subprocess
 import shlex
 import sys
+import tempfile
 from typing import Optional, Tuple
 
 
@@ -477,48 +484,184 @@ def generate_make_log(oot_version: str) -> list[str]:
     return subprocess.check_output(make_command_line).decode("utf-8").splitlines()
 
 
-def find_compiler_command_line(
-    make_log: list[str], filename: Path
-) -> Optional[list[str]]:
-    found = 0
-    for line in make_log:
+# Files that the compiler command lines in the make log depend on
+def compile_command_dependencies(oot_version: str) -> list[Path]:
+    return [
+        Path("Makefile"),
+        Path(".make_options.mk"),
+        Path(f"baseroms/{oot_version}/config.yml"),
+    ]
+
+
+def compile_commands_hash(oot_version: str) -> str:
+    h = hashlib.sha256()
+    h.update(oot_version.encode())
+    for path in compile_command_dependencies(oot_version):
+        h.update(b"\0")
+        h.update(str(path).encode())
+        h.update(b"\0")
+        if path.exists():
+            h.update(hashlib.sha256(path.read_bytes()).digest())
+        else:
+            h.update(b"<missing>")
+    return h.hexdigest()
+
+
+# Map each C source file to the compiler command lines that mention it. There should
+# be exactly one, but all of them are kept so that ambiguous lookups can be detected.
+def generate_compile_commands(oot_version: str) -> dict[str, list[list[str]]]:
+    compile_commands: dict[str, list[list[str]]] = {}
+    for line in generate_make_log(oot_version):
         parts = line.split()
-        if "-o" in parts and str(filename) in parts:
-            compiler_command_line = parts
-            found += 1
+        if "-o" not in parts:
+            continue
+        for part in set(parts):
+            if part.endswith(".c"):
+                compile_commands.setdefault(part, []).append(parts)
+    return compile_commands
+
+
+# Load the compiler command lines for a version, cached in the build directory since running
+# make on the whole project takes a while. The cache is regenerated if the Makefile or the
+# version config changed, or if one of the given files is missing (e.g. if it was just added).
+def load_compile_commands(
+    oot_version: str, filenames: list[Path]
+) -> dict[str, list[list[str]]]:
+    cache_path = Path(f"build/{oot_version}/compile_commands_cache.json")
+    dependency_hash = compile_commands_hash(oot_version)
+
+    try:
+        with open(cache_path) as f:
+            cache = json.load(f)
+        if cache["hash"] == dependency_hash and all(
+            str(filename) in cache["commands"] for filename in filenames
+        ):
+            return cache["commands"]
+    except (OSError, ValueError, KeyError):
+        pass
 
-    if found != 1:
+    compile_commands = generate_compile_commands(oot_version)
+
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump({"hash": dependency_hash, "commands": compile_commands}, f)
+    os.replace(tmp_path, cache_path)
+
+    return compile_commands
+
+
+def find_compiler_command_line(
+    compile_commands: dict[str, list[list[str]]], filename: Path
+) -> Optional[list[str]]:
+    command_lines = compile_commands.get(str(filename), [])
+    if len(command_lines) != 1:
         return None
 
-    return compiler_command_line
+    return command_lines[0]
 
 
-def run_cfe(
-    command_line: list[str], keep_files: bool
-) -> Tuple[list[SymbolTableEntry], list[UcodeOp]]:
+# Directory for caching the output of cfe (see run_cfe)
+def cfe_cache_dir(oot_version: str) -> Path:
+    return Path(f"build/{oot_version}/cfe_cache")
+
+
+LINEMARKER_RE = re.compile(rb'^(#(?:line)?\s*\d+\s+)"([^"]*)"', re.MULTILINE)
+
+
+# Hash of everything the output of cfe depends on: the command line and the preprocessed
+# source (including headers), which the compiler outputs with -E instead of -Hf.
+def cfe_input_hash(command_line: list[str]) -> str:
+    input_file = Path(command_line[-1])
+    rest = command_line[:-1]
+
+    # Don't let -E write the output file
+    if "-o" in rest:
+        i = rest.index("-o")
+        rest = rest[:i] + rest[i + 2 :]
+
+    preprocessed = subprocess.run(
+        rest + ["-E", input_file], check=True, stdout=subprocess.PIPE
+    ).stdout
+
+    # preprocess.sh compiles a copy of the input file in a new temporary directory each time,
+    # so normalize the path of the input file in linemarkers
+    def normalize_linemarker(m: re.Match) -> bytes:
+        if Path(os.fsdecode(m.group(2))).name == input_file.name:
+            return m.group(1) + b'"' + os.fsencode(input_file) + b'"'
+        return m.group(0)
+
+    preprocessed = LINEMARKER_RE.sub(normalize_linemarker, preprocessed)
+
+    h = hashlib.sha256()
+    for arg in command_line:
+        h.update(arg.encode())
+        h.update(b"\0")
+    h.update(b"\0")
+    h.update(preprocessed)
+    return h.hexdigest()
+
+
+# Run cfe in a new temporary directory, since the symbol table and ucode files are written to
+# the current directory and named after the input file. The temporary directory links to
+# everything in the current directory so that the relative paths in the command line work.
+# Returns the contents of the symbol table and ucode files.
+def run_cfe_isolated(command_line: list[str], keep_files: bool) -> Tuple[bytes, bytes]:
     # Assume command line is of the form:
     # python3 tools/preprocess.py [COMPILER] [COMPILER_ARGS] [INPUT_FILE]
     input_file = Path(command_line[-1])
     rest = command_line[:-1]
 
     stem = input_file.stem
-    symbol_table_file = Path(f"{stem}.T")
-    ucode_file = Path(f"{stem}.B")
+    with tempfile.TemporaryDirectory(prefix="cfe_") as temp_dir:
+        work_dir = Path(temp_dir)
+        for entry in Path.cwd().iterdir():
+            (work_dir / entry.name).symlink_to(entry.absolute())
+
+        symbol_table_file = work_dir / f"{stem}.T"
+        ucode_file = work_dir / f"{stem}.B"
 
-    try:
         # Invoke compiler
         # -Hf stops compilation after cfe so we can inspect the symbol table
-        subprocess.run(rest + ["-Hf", input_file], check=True)
-
-        # Read symbol table
-        symbol_table = parse_symbol_table(symbol_table_file.read_bytes())
-        ucode = parse_ucode(ucode_file.read_bytes())
-        return (symbol_table, ucode)
-    finally:
-        # Cleanup
+        subprocess.run(rest + ["-Hf", input_file], check=True, cwd=work_dir)
+
+        if keep_files:
+            shutil.copyfile(symbol_table_file, symbol_table_file.name)
+            shutil.copyfile(ucode_file, ucode_file.name)
+
+        return (symbol_table_file.read_bytes(), ucode_file.read_bytes())
+
+
+# Run cfe, reusing the output of a previous run with the same inputs from cache_dir if given.
+# With keep_files, cfe always runs so that the symbol table and ucode files are written.
+def run_cfe(
+    command_line: list[str], keep_files: bool, cache_dir: Optional[Path] = None
+) -> Tuple[list[SymbolTableEntry], list[UcodeOp]]:
+    output = None
+    if cache_dir is not None:
+        cache_path = cache_dir / f"{cfe_input_hash(command_line)}.pickle"
         if not keep_files:
-            symbol_table_file.unlink(missing_ok=True)
-            ucode_file.unlink(missing_ok=True)
+            try:
+                with open(cache_path, "rb") as f:
+                    output = pickle.load(f)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                pass
+
+    if output is None:
+        output = run_cfe_isolated(command_line, keep_files)
+
+        if cache_dir is not None:
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+            with open(tmp_path, "wb") as f:
+                pickle.dump(output, f)
+            os.replace(tmp_path, cache_path)
+
+    # Read symbol table
+    symbol_table_data, ucode_data = output
+    symbol_table = parse_symbol_table(symbol_table_data)
+    ucode = parse_ucode(ucode_data)
+    return (symbol_table, ucode)
 
 
 def main():
@@ -545,19 +688,21 @@ def main():
 
     args = parser.parse_args()
 
-    print(f"Running make to find compiler command line ...", file=sys.stderr)
-    make_log = generate_make_log(args.oot_version)
+    print(f"Finding compiler command line ...", file=sys.stderr)
+    compile_commands = load_compile_commands(args.oot_version, [args.filename])
 
-    command_line = find_compiler_command_line(make_log, args.filename)
+    command_line = find_compiler_command_line(compile_commands, args.filename)
     if command_line is None:
         print(
-            f"Error: could not determine compiler command line for {filename}",
+            f"Error: could not determine compiler command line for {args.filename}",
             file=sys.stderr,
         )
         sys.exit(1)
     print(f"Compiler command: {shlex.join(command_line)}", file=sys.stderr)
 
-    symbol_table, ucode = run_cfe(command_line, args.keep_files)
+    symbol_table, ucode = run_cfe(
+        command_line, args.keep_files, cfe_cache_dir(args.oot_version)
+    )
     print_symbol_table(symbol_table)
     if args.print_ucode:
         print_ucode(ucode)
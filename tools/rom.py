@@ -0,0 +1,63 @@
+# SPDX-FileCopyrightText: © 2024 ZeldaRET
+# SPDX-License-Identifier: CC0-1.0
+
+from __future__ import annotations
+
+import mmap
+from pathlib import Path
+import struct
+
+
+STRUCT_U32 = struct.Struct(">I")
+STRUCT_U16 = struct.Struct(">H")
+STRUCT_S16 = struct.Struct(">h")
+
+
+class Rom:
+    """
+    A read-only view of a ROM file, memory-mapped instead of read into memory.
+
+    Slicing `data` doesn't copy anything, and processes mapping the same file
+    share its pages through the page cache.
+
+    Memoryviews taken from `data` must be released (or garbage collected)
+    before the ROM is closed.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.data = memoryview(self._mmap)
+
+    def close(self):
+        self.data.release()
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.close()
+        except BufferError:
+            # Views into the ROM may still be referenced by the traceback of
+            # the exception being raised, don't hide it behind this error.
+            # The mapping is closed once the views are garbage collected.
+            if exc_type is None:
+                raise
+
+    def __len__(self):
+        return len(self.data)
+
+    def segment(self, start: int, end: int) -> memoryview:
+        return self.data[start:end]
+
+    def read_u32(self, offset: int) -> int:
+        return STRUCT_U32.unpack_from(self.data, offset)[0]
+
+    def read_u16(self, offset: int) -> int:
+        return STRUCT_U16.unpack_from(self.data, offset)[0]
+
+    def read_s16(self, offset: int) -> int:
+        return STRUCT_S16.unpack_from(self.data, offset)[0]
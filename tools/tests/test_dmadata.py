@@ -0,0 +1,73 @@
+import sys
+
+sys.path.insert(0, "tools")
+
+from dmadata import DmaEntry, DmaTable
+
+table = DmaTable.from_entries(
+    [
+        # Uncompressed
+        DmaEntry(0x0000, 0x1000, 0x0000, 0),
+        # Compressed, with a gap after it in VROM and ROM
+        DmaEntry(0x1000, 0x3000, 0x1000, 0x1800),
+        # Empty
+        DmaEntry(0x3400, 0x3400, 0x2000, 0),
+        # Out of VROM order, compressed
+        DmaEntry(0x5000, 0x5100, 0x2400, 0x2480),
+        # Syms, which has no ROM range
+        DmaEntry(0x3400, 0x4000, 0xFFFFFFFF, 0xFFFFFFFF),
+        # Uncompressed, at the end of VROM
+        DmaEntry(0x4000, 0x4800, 0x2000, 0),
+    ]
+)
+
+find_by_vrom_tests = [
+    (0x0000, 0),
+    (0x0FFF, 0),
+    (0x1000, 1),
+    (0x2FFF, 1),
+    # Gap
+    (0x3000, None),
+    (0x33FF, None),
+    (0x3400, 4),
+    (0x3FFF, 4),
+    (0x4000, 5),
+    (0x47FF, 5),
+    (0x4800, None),
+    (0x5000, 3),
+    (0x50FF, 3),
+    (0x5100, None),
+    (0xFFFFFFFF, None),
+]
+
+find_by_rom_tests = [
+    (0x0000, 0),
+    (0x0FFF, 0),
+    (0x1000, 1),
+    (0x17FF, 1),
+    # Gap after the compressed entry
+    (0x1800, None),
+    (0x1FFF, None),
+    (0x2000, 5),
+    (0x23FF, 5),
+    (0x2400, 3),
+    (0x247F, 3),
+    (0x2480, None),
+    (0xFFFFFFFF, None),
+]
+
+failed = False
+for name, find, tests in (
+    ("find_by_vrom", table.find_by_vrom, find_by_vrom_tests),
+    ("find_by_rom", table.find_by_rom, find_by_rom_tests),
+):
+    for address, expected in tests:
+        result = find(address)
+        if result != expected:
+            print(f"{name}(0x{address:X}) returned {result}, expected {expected}")
+            failed = True
+
+if failed:
+    exit(1)
+
+print("all tests ok")
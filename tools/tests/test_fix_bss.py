@@ -0,0 +1,72 @@
+import sys
+
+sys.path.insert(0, "tools")
+
+from fix_bss import (
+    BssSymbol,
+    BssVariable,
+    FixBssException,
+    Pragma,
+    predict_bss_ordering,
+    solve_bss_ordering,
+)
+
+
+# Variables named u* are never matched to the baserom, like variables that no pointer refers to
+def make_variables(amounts: list[int]) -> tuple[list[Pragma], list[BssVariable]]:
+    pragmas = []
+    bss_variables = []
+    block_number = 10
+    for k in range(len(amounts) + 1):
+        if k > 0:
+            pragmas.append(Pragma(100 + k, block_number, amounts[k - 1]))
+            block_number += amounts[k - 1]
+        for name, size in ((f"u{k}", 4), (f"m{k}a", 8), (f"m{k}b", 2)):
+            bss_variables.append(
+                BssVariable(block_number, name, size, min(size, 8), False)
+            )
+            block_number += 1
+    return pragmas, bss_variables
+
+
+def matched(bss_symbols: list[BssSymbol]) -> list[BssSymbol]:
+    return [symbol for symbol in bss_symbols if not symbol.name.startswith("u")]
+
+
+def test_solvable():
+    _, target_variables = make_variables([40, 200, 7])
+    base_bss_symbols = matched(predict_bss_ordering(target_variables))
+
+    pragmas, bss_variables = make_variables([1, 1, 1])
+    new_pragmas = solve_bss_ordering(pragmas, bss_variables, base_bss_symbols)
+
+    _, new_variables = make_variables([pragma.amount for pragma in new_pragmas])
+    assert matched(predict_bss_ordering(new_variables)) == base_bss_symbols
+
+
+# The matched variables are in an order the amounts can produce, but not at offsets they can
+def test_unsolvable():
+    for num_pragmas in range(1, 5):
+        pragmas, bss_variables = make_variables([1] * num_pragmas)
+        base_bss_symbols = []
+        for k in range(num_pragmas + 1):
+            base_bss_symbols.append(BssSymbol(f"m{k}a", k * 0x1000, 8, 8, False))
+            base_bss_symbols.append(
+                BssSymbol(f"m{k}b", k * 0x1000 + 0x100, 2, 2, False)
+            )
+        try:
+            solve_bss_ordering(pragmas, bss_variables, base_bss_symbols)
+        except FixBssException:
+            pass
+        else:
+            assert False, f"found a solution with {num_pragmas} pragmas"
+
+
+for test in (test_solvable, test_unsolvable):
+    try:
+        test()
+    except AssertionError as e:
+        print(f"failed test {test.__name__}: {e}")
+        exit(1)
+
+print("all tests ok")